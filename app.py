@@ -1,11 +1,89 @@
+import os
+import logging
+from functools import partial
 from flask import Flask, request, jsonify
 from file_utils import FileUtils
-from controllers import upload_video_controller, detect_line_violation_controller, detect_helmet_violation_controller, get_captured_violations_controller, get_file
+from controllers import upload_video_controller, detect_line_violation_controller, detect_helmet_violation_controller, detect_all_violation_controller, get_job_status_controller, get_job_result_controller, get_captured_violations_controller, detect_stream_controller, stop_job_controller, get_metrics_controller, invalidate_cache_controller, get_file
+from model import model_registry, configure_model_backend, MODEL_PATHS
+from exported_models import export_model
+from detect import start_detection
+from jobs import JobManager
+from result_cache import ResultCache
+from worker_pool import DetectionWorkerPool
+from calibration import CalibrationCache
+from inference import load_inference_config
+from metrics import metrics
+from frame_log import configure_frame_logging
 
 app = Flask(__name__)
 
 utils = FileUtils()
 app.config['UPLOAD_FOLDER'] = utils.create_uploads_dir()
+app.config['WARMUP_MODELS'] = os.environ.get('WARMUP_MODELS', 'true').lower() == 'true'
+app.config['DETECTION_WORKERS'] = int(os.environ.get('DETECTION_WORKERS', 2))
+app.config['DETECTION_QUEUE_SIZE'] = int(os.environ.get('DETECTION_QUEUE_SIZE', 8))
+app.config['DETECTION_BATCH_SIZE'] = int(os.environ.get('DETECTION_BATCH_SIZE', 1))
+app.config['NORMALIZE_UPLOAD_FPS'] = int(os.environ.get('NORMALIZE_UPLOAD_FPS', 0))
+app.config['CALIBRATION_DIR'] = os.environ.get('CALIBRATION_DIR', './calibration')
+app.config['CALIBRATION_MAX_ENTRIES'] = int(os.environ.get('CALIBRATION_MAX_ENTRIES', 256))
+app.config['SNAPSHOT_JPEG_QUALITY'] = int(os.environ.get('SNAPSHOT_JPEG_QUALITY', 95))
+app.config['INFERENCE_CONFIG'] = os.environ.get('INFERENCE_CONFIG', '')
+app.config['STREAM_WORKERS'] = int(os.environ.get('STREAM_WORKERS', 2))
+app.config['STREAM_SOURCES'] = [prefix for prefix in os.environ.get('STREAM_SOURCES', 'rtsp://,rtsps://').split(',') if prefix]
+app.config['SHARD_WORKERS'] = int(os.environ.get('SHARD_WORKERS', os.cpu_count() or 1))
+app.config['MODEL_BACKEND'] = os.environ.get('MODEL_BACKEND', 'pytorch').lower()
+app.config['MODEL_INT8'] = os.environ.get('MODEL_INT8', 'false').lower() == 'true'
+app.config['MODEL_EXPORT_DIR'] = os.environ.get('MODEL_EXPORT_DIR', './model/exported')
+app.config['DETECTION_BACKEND'] = os.environ.get('DETECTION_BACKEND', 'thread').lower()
+app.config['WORKER_THREADS'] = int(os.environ.get('WORKER_THREADS', 0))
+app.config['PIN_WORKER_CORES'] = os.environ.get('PIN_WORKER_CORES', 'false').lower() == 'true'
+app.config['RESULT_CACHE_DIR'] = os.environ.get('RESULT_CACHE_DIR', './result_cache')
+app.config['RESULT_CACHE_MAX_MB'] = int(os.environ.get('RESULT_CACHE_MAX_MB', 2048))
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', '')
+app.config['FRAME_LOG_EVERY'] = int(os.environ.get('FRAME_LOG_EVERY', 30))
+
+# per-frame detector records are DEBUG and sampled, LOG_LEVEL=DEBUG shows one frame in FRAME_LOG_EVERY
+if app.config['LOG_LEVEL']:
+    logging.basicConfig(level=app.config['LOG_LEVEL'].upper())
+configure_frame_logging(app.config['FRAME_LOG_EVERY'])
+
+# MODEL_BACKEND=onnx|torchscript serves exported copies of the weights (exported on first use),
+# worker and shard processes are spawned and apply the same setting before loading anything
+model_backend = (app.config['MODEL_BACKEND'], app.config['MODEL_INT8'], app.config['MODEL_EXPORT_DIR'])
+configure_model_backend(*model_backend)
+if app.config['MODEL_BACKEND'] != 'pytorch':
+    # exported here once, so workers and shards starting together don't race to export the same weights
+    for path in MODEL_PATHS:
+        export_model(path, *model_backend)
+
+calibration_cache = CalibrationCache(app.config['CALIBRATION_DIR'], max_entries=app.config['CALIBRATION_MAX_ENTRIES'])
+inference_config = load_inference_config(app.config['INFERENCE_CONFIG'])
+run_detection = partial(start_detection, batch_size=app.config['DETECTION_BATCH_SIZE'], index=utils.index, calibration_cache=calibration_cache, jpeg_quality=app.config['SNAPSHOT_JPEG_QUALITY'], inference_config=inference_config, shard_workers=app.config['SHARD_WORKERS'], shard_initializer=configure_model_backend, shard_initargs=model_backend)
+
+# finished runs are kept (outside the uploads folder) and replayed when the same video, models and
+# settings are submitted again, RESULT_CACHE_MAX_MB=0 turns the cache off
+result_cache = None
+if app.config['RESULT_CACHE_MAX_MB'] > 0:
+    result_cache = ResultCache(app.config['RESULT_CACHE_DIR'], app.config['RESULT_CACHE_MAX_MB'] * 1024 * 1024, index=utils.index, settings={'jpeg_quality': app.config['SNAPSHOT_JPEG_QUALITY'], 'inference_config': inference_config})
+
+# DETECTION_BACKEND=process runs file jobs in worker processes with their own models and a fixed
+# share of the cores, instead of threads that each let torch use every core
+if app.config['DETECTION_BACKEND'] == 'process':
+    worker_pool = DetectionWorkerPool(workers=app.config['DETECTION_WORKERS'], threads=app.config['WORKER_THREADS'] or None, pin_cores=app.config['PIN_WORKER_CORES'], warmup=app.config['WARMUP_MODELS'], initializer=configure_model_backend, initargs=model_backend)
+    run_file_detection = partial(worker_pool.run_detection, **run_detection.keywords)
+    jobs = JobManager(run_file_detection, max_workers=worker_pool.workers, max_queue_size=app.config['DETECTION_QUEUE_SIZE'], result_cache=result_cache)
+elif app.config['DETECTION_BACKEND'] == 'thread':
+    jobs = JobManager(run_detection, max_workers=app.config['DETECTION_WORKERS'], max_queue_size=app.config['DETECTION_QUEUE_SIZE'], result_cache=result_cache)
+else:
+    raise ValueError(f"Unknown DETECTION_BACKEND: {app.config['DETECTION_BACKEND']}")
+
+# streams hold a worker until stopped, so they get their own pool and never queue
+streams = JobManager(run_detection, max_workers=app.config['STREAM_WORKERS'], max_queue_size=0)
+
+# Load every model once per process and run a warm-up inference before serving, pool workers
+# warm up their own and the parent only loads models for streams, on first use
+if app.config['WARMUP_MODELS'] and app.config['DETECTION_BACKEND'] == 'thread':
+    model_registry.warmup()
 
 METHOD_NOT_ALLOWED_ERROR = {
     'status': 'error',
@@ -20,22 +98,56 @@ def hello_world():
 @app.route('/upload', methods=['POST'])
 def upload_video():
     if request.method == 'POST':
-        return upload_video_controller(app.config['UPLOAD_FOLDER'], utils)
+        return upload_video_controller(app.config['UPLOAD_FOLDER'], utils, app.config['NORMALIZE_UPLOAD_FPS'])
     else:
         return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
 
 @app.route('/detectLineViolation', methods=['POST'])
 def detect_line_violation():
-    if request.method == 'POST': 
-        return detect_line_violation_controller(app.config['UPLOAD_FOLDER'], utils)
+    if request.method == 'POST':
+        return detect_line_violation_controller(app.config['UPLOAD_FOLDER'], utils, jobs)
     else: return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
 
 @app.route('/detectHelmetViolation', methods=['POST'])
 def detect_helmet_violation():
-    if request.method == 'POST': 
-        return detect_helmet_violation_controller(app.config['UPLOAD_FOLDER'], utils)
+    if request.method == 'POST':
+        return detect_helmet_violation_controller(app.config['UPLOAD_FOLDER'], utils, jobs)
     else: return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
 
+@app.route('/detectAllViolation', methods=['POST'])
+def detect_all_violation():
+    if request.method == 'POST':
+        return detect_all_violation_controller(app.config['UPLOAD_FOLDER'], utils, jobs)
+    else: return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
+
+@app.route('/detectStream', methods=['POST'])
+def detect_stream():
+    if request.method == 'POST':
+        return detect_stream_controller(app.config['UPLOAD_FOLDER'], utils, streams, app.config['STREAM_SOURCES'])
+    else:
+        return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
+
+@app.route('/stopJob', methods=['POST'])
+def stop_job():
+    if request.method == 'POST':
+        return stop_job_controller(jobs, streams)
+    else:
+        return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
+
+@app.route('/jobStatus', methods=['GET'])
+def get_job_status():
+    if request.method == 'GET':
+        return get_job_status_controller(jobs, streams)
+    else:
+        return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
+
+@app.route('/jobResult', methods=['GET'])
+def get_job_result():
+    if request.method == 'GET':
+        return get_job_result_controller(app.config['UPLOAD_FOLDER'], jobs, streams, utils)
+    else:
+        return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
+
 @app.route('/capturedViolation', methods=['GET'])
 def get_captured_violations():
     if request.method == 'GET':
@@ -43,9 +155,23 @@ def get_captured_violations():
     else:
         return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
 
+@app.route('/invalidateCache', methods=['POST'])
+def invalidate_cache():
+    if request.method == 'POST':
+        return invalidate_cache_controller(utils, result_cache)
+    else:
+        return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if request.method == 'GET':
+        return get_metrics_controller(metrics)
+    else:
+        return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
+
 @app.route('/file', methods=['GET'])
 def get_video():
     if request.method == 'GET':
-        return get_file(app.config['UPLOAD_FOLDER'])
+        return get_file(app.config['UPLOAD_FOLDER'], utils)
     else:
         return jsonify(METHOD_NOT_ALLOWED_ERROR), 405
\ No newline at end of file
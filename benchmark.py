@@ -0,0 +1,900 @@
+import os
+import cv2
+import json
+import time
+import hashlib
+import shutil
+import logging
+import argparse
+import tempfile
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def read_frames(video_input_path, max_frames, size=(1280, 720)):
+    capture = cv2.VideoCapture(video_input_path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, size))
+    capture.release()
+    return frames
+
+def make_synthetic_clip(video_path, seconds, fps, size=(1920, 1080), seed=0):
+    # moving boxes over a noisy background so the encoder produces real P-frames
+    rng = np.random.default_rng(seed)
+    width, height = size
+    background = rng.integers(0, 60, size=(height, width, 3), dtype=np.uint8)
+    out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for i in range(int(seconds * fps)):
+        frame = background.copy()
+        for box in range(8):
+            x = (i * (3 + box) + box * 200) % (width - 120)
+            y = (box * 120 + i) % (height - 80)
+            cv2.rectangle(frame, (x, y), (x + 120, y + 80), (40 * box % 255, 200, 255 - 30 * box), -1)
+        out.write(frame)
+    out.release()
+    return video_path
+
+def legacy_save_and_resize(temp_file_path, file_path, new_fps=15):
+    # the seek-per-output-frame resampler FileUtils used before sequential decoding
+    capture = cv2.VideoCapture(temp_file_path)
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    original_fps = capture.get(cv2.CAP_PROP_FPS)
+    out = cv2.VideoWriter(file_path, fourcc, new_fps, (1280, 720))
+    
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    duration = frame_count / original_fps
+    new_frame_count = int(duration * new_fps)
+    
+    written = 0
+    for i in range(new_frame_count):
+        capture.set(cv2.CAP_PROP_POS_FRAMES, i * original_fps / new_fps)
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frame = cv2.resize(frame, (1280, 720))
+        out.write(frame)
+        written += 1
+    
+    capture.release()
+    out.release()
+    return written
+
+def bench_resample(args):
+    from file_utils import FileUtils
+    
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        source = make_synthetic_clip(os.path.join(work_dir, "source.mp4"), args.seconds, args.source_fps, tuple(args.source_size))
+        utils = FileUtils(os.path.join(work_dir, "uploads"), os.path.join(work_dir, "index.sqlite3"))
+        report = {"benchmark": "resample", "seconds": args.seconds, "source_fps": args.source_fps, "target_fps": args.target_fps, "runs": []}
+        
+        for name, resample in (("seek_per_frame", legacy_save_and_resize), ("sequential", utils.save_and_resize)):
+            start = time.perf_counter()
+            written = resample(source, os.path.join(work_dir, f"{name}.mp4"), args.target_fps)
+            elapsed = time.perf_counter() - start
+            
+            run = {"method": name, "frames_written": written, "seconds": round(elapsed, 2)}
+            report["runs"].append(run)
+            print(f"{name:<15} frames={written:<6} time={run['seconds']:>8} s")
+        
+        report["speedup"] = round(report["runs"][0]["seconds"] / report["runs"][1]["seconds"], 1)
+        print(f"speedup={report['speedup']}x")
+        return report
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def legacy_crossings(track_ids, starts, ends, areas):
+    # one pure-Python ccw test per track and area, as draw_bounding_box did before crossing.py
+    def ccw(a, b, c):
+        return (c[1] - a[1]) * (b[0] - a[0]) > (b[1] - a[1]) * (c[0] - a[0])
+    
+    events = []
+    for idx, p1, p2 in zip(track_ids, starts, ends):
+        for area_index, area in enumerate(areas):
+            q1, q2 = area["coords"][0], area["coords"][1]
+            if ccw(p1, q1, q2) != ccw(p2, q1, q2) and ccw(p1, p2, q1) != ccw(p1, p2, q2):
+                direction = "North" if p1[1] > p2[1] else "South" if p1[1] < p2[1] else ""
+                events.append((idx, area_index, direction))
+    return events
+
+def bench_crossing(args):
+    from crossing import find_crossings
+    
+    rng = np.random.default_rng(args.seed)
+    areas = [
+        {"coords": np.array([[100 + 50 * i, 300 + 60 * i], [1100 - 50 * i, 300 + 60 * i]], dtype=np.int32)}
+        for i in range(args.areas)
+    ]
+    report = {"benchmark": "crossing", "areas": args.areas, "iterations": args.iterations, "runs": []}
+    
+    for count in args.tracks:
+        track_ids = list(range(1, count + 1))
+        starts = [tuple(point) for point in rng.integers(0, 720, size=(count, 2)).tolist()]
+        ends = [(x + int(dx), y + int(dy)) for (x, y), dx, dy in zip(starts, rng.integers(-10, 10, count), rng.integers(-40, 40, count))]
+        
+        match = legacy_crossings(track_ids, starts, ends, areas) == [tuple(event) for event in find_crossings(track_ids, starts, ends, areas)]
+        
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            legacy_crossings(track_ids, starts, ends, areas)
+        legacy_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            find_crossings(track_ids, starts, ends, areas)
+        vectorized_time = time.perf_counter() - start
+        
+        run = {
+            "tracks": count,
+            "legacy_us": round(legacy_time / args.iterations * 1e6, 1),
+            "vectorized_us": round(vectorized_time / args.iterations * 1e6, 1),
+            "speedup": round(legacy_time / vectorized_time, 1),
+            "match": match
+        }
+        report["runs"].append(run)
+        print(f"tracks={count:<4} legacy={run['legacy_us']:>9} us  vectorized={run['vectorized_us']:>7} us  speedup={run['speedup']}x  match={match}")
+    
+    return report
+
+def bench_batch(args):
+    import torch
+    from model import get_model, LINE_MODEL_PATH, HELMET_MODEL_PATH
+    from detect import start_detection
+    
+    model_path = LINE_MODEL_PATH if args.violation_type == "line" else HELMET_MODEL_PATH
+    model = get_model(model_path)
+    frames = read_frames(args.video, args.frames)
+    report = {"benchmark": "batch", "violation_type": args.violation_type, "frames": len(frames), "runs": []}
+    
+    # frame-by-frame reference for the parity check
+    reference = [model(frame).xyxy[0] for frame in frames]
+    
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        batched = []
+        for i in range(0, len(frames), batch_size):
+            batch = frames[i:i + batch_size]
+            if batch_size == 1:
+                batched.append(model(batch[0]).xyxy[0])
+            else:
+                batched.extend(result.xyxy[0] for result in model(batch).tolist())
+        inference_time = time.perf_counter() - start
+        
+        parity = len(batched) == len(reference) and all(
+            a.shape == b.shape and torch.allclose(a, b, atol=1e-3) for a, b in zip(batched, reference)
+        )
+        
+        # end to end run on a scratch copy so results don't land in the uploads tree
+        work_dir = tempfile.mkdtemp(prefix="bench_")
+        progress = {"frames": 0}
+        try:
+            start = time.perf_counter()
+            start_detection(work_dir, args.video, args.violation_type, progress_callback=lambda done, _: progress.update(frames=done), batch_size=batch_size)
+            pipeline_time = time.perf_counter() - start
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        run = {
+            "batch_size": batch_size,
+            "inference_fps": round(len(frames) / inference_time, 2),
+            "pipeline_fps": round(progress["frames"] / pipeline_time, 2),
+            "detections_match": parity
+        }
+        report["runs"].append(run)
+        print(f"batch={batch_size:<3} inference={run['inference_fps']:>8} fps  pipeline={run['pipeline_fps']:>8} fps  match={parity}")
+    
+    return report
+
+def match_detections(reference, candidate, min_iou):
+    # greedy same-class matching per frame, highest IoU first: (matched pairs, reference boxes, candidate boxes)
+    from sharding import iou_matrix
+    
+    pairs = []
+    for expected, found in zip(reference, candidate):
+        if not len(expected) or not len(found):
+            continue
+        ious = iou_matrix(expected[:, :4], found[:, :4])
+        ious[expected[:, 5][:, None] != found[:, 5][None, :]] = 0
+        used_expected, used_found = set(), set()
+        for i, j in sorted(zip(*np.nonzero(ious >= min_iou)), key=lambda ij: -ious[ij]):
+            if i in used_expected or j in used_found:
+                continue
+            used_expected.add(i)
+            used_found.add(j)
+            pairs.append((ious[i, j], abs(expected[i, 4] - found[j, 4])))
+    return pairs, sum(len(expected) for expected in reference), sum(len(found) for found in candidate)
+
+def bench_backends(args):
+    from model import load_model, configure_model_backend, LINE_MODEL_PATH, CROSSWALK_MODEL_PATH, HELMET_MODEL_PATH
+    from exported_models import load_exported_model
+    from detections import to_numpy
+    
+    model_paths = {"line": LINE_MODEL_PATH, "crosswalk": CROSSWALK_MODEL_PATH, "helmet": HELMET_MODEL_PATH}
+    frames = read_frames(args.video, args.frames)
+    report = {"benchmark": "backends", "frames": len(frames), "min_confidence": args.min_confidence, "runs": []}
+    
+    def run_model(model):
+        model(frames[0])
+        detections = []
+        start = time.perf_counter()
+        for frame in frames:
+            detections.append(to_numpy(model(frame)))
+        elapsed = time.perf_counter() - start
+        
+        # low-confidence boxes flicker between runtimes, the rules only act on boxes above the thresholds
+        return [rows[rows[:, 4] >= args.min_confidence] for rows in detections], elapsed
+    
+    for name in args.models:
+        configure_model_backend("pytorch")
+        reference, reference_time = run_model(load_model(model_paths[name]))
+        
+        for backend in args.backends:
+            if backend == "pytorch":
+                detections, elapsed = reference, reference_time
+            else:
+                model = load_exported_model(model_paths[name], backend.replace("-int8", ""), int8=backend.endswith("-int8"))
+                detections, elapsed = run_model(model)
+            
+            pairs, expected, found = match_detections(reference, detections, args.match_iou)
+            run = {
+                "model": name,
+                "backend": backend,
+                "ms_per_frame": round(elapsed / len(frames) * 1000, 2),
+                "speedup": round(reference_time / elapsed, 2),
+                "recall": round(len(pairs) / expected, 4) if expected else 1.0,
+                "precision": round(len(pairs) / found, 4) if found else 1.0,
+                "mean_iou": round(float(np.mean([iou for iou, _ in pairs])), 4) if pairs else None,
+                "max_confidence_delta": round(float(max((delta for _, delta in pairs), default=0.0)), 4)
+            }
+            report["runs"].append(run)
+            print(f"{name:<10} {backend:<12} {run['ms_per_frame']:>8} ms/frame  x{run['speedup']:<6} recall={run['recall']}  precision={run['precision']}  iou={run['mean_iou']}  conf_delta={run['max_confidence_delta']}")
+    
+    return report
+
+def bench_analytics(args):
+    from detect import start_detection
+    
+    report = {"benchmark": "analytics", "violation_type": args.violation_type, "runs": []}
+    summaries = {}
+    
+    for mode, render in (("video", True), ("analytics", False)):
+        work_dir = tempfile.mkdtemp(prefix="bench_")
+        progress = {"frames": 0}
+        try:
+            start = time.perf_counter()
+            start_detection(
+                work_dir, args.video, args.violation_type,
+                progress_callback=lambda done, _: progress.update(frames=done),
+                render=render, evidence=not args.no_evidence,
+                summary_callback=lambda summary, mode=mode: summaries.__setitem__(mode, summary)
+            )
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        run = {"mode": mode, "seconds": round(elapsed, 3), "fps": round(progress["frames"] / elapsed, 2), "counters": summaries[mode]["counters"]}
+        report["runs"].append(run)
+        print(f"mode={mode:<10} {run['fps']:>8} fps  counters={run['counters']}")
+    
+    # compare what happened where and when, ids depend on which tracks the run created
+    def events(summary):
+        return [(event["category"], event["frame_index"], event["bbox"]) for event in summary["events"]]
+    
+    report["speedup"] = round(report["runs"][0]["seconds"] / report["runs"][1]["seconds"], 2)
+    report["events_match"] = events(summaries["video"]) == events(summaries["analytics"]) and summaries["video"]["counters"] == summaries["analytics"]["counters"]
+    print(f"speedup={report['speedup']}x  match={report['events_match']}")
+    
+    return report
+
+class SyntheticResults:
+    # mimics the parts of YOLOv5 Detections the parsers touch: xyxy, names and pandas()
+    def __init__(self, raw, names):
+        self.xyxy = [raw]
+        self.names = names
+    
+    def pandas(self):
+        import pandas as pd
+        from types import SimpleNamespace
+        
+        columns = ["xmin", "ymin", "xmax", "ymax", "confidence", "class", "name"]
+        rows = [[*x[:5], int(x[5]), self.names[int(x[5])]] for x in self.xyxy[0].tolist()]
+        return SimpleNamespace(xyxy=[pd.DataFrame(rows, columns=columns)])
+
+def legacy_parse(results):
+    # the per-row pandas path the detectors used before detections.Detections
+    objects = results.pandas().xyxy[0]
+    detections = np.empty((0, 5))
+    for _, row in objects.iterrows():
+        xmin = int(row["xmin"])
+        ymin = int(row["ymin"])
+        xmax = int(row["xmax"])
+        ymax = int(row["ymax"])
+        confidence = float(f"{row['confidence']:.2f}")
+        class_id = int(row["class"])
+        
+        if confidence >= 0.5 and (class_id == 0 or class_id == 1):
+            coordinate_list = np.array([xmin, ymin, xmax, ymax, confidence])
+            detections = np.vstack([detections, coordinate_list])
+    return detections
+
+def bench_parse(args):
+    from detections import Detections
+    
+    rng = np.random.default_rng(args.seed)
+    names = {0: "car", 1: "motorcycle", 2: "green", 3: "red"}
+    report = {"benchmark": "parse", "iterations": args.iterations, "runs": []}
+    
+    for count in args.detections:
+        xy = rng.uniform(0, 1200, size=(count, 2))
+        wh = rng.uniform(10, 200, size=(count, 2))
+        raw = np.column_stack((xy, xy + wh, rng.uniform(0.2, 1.0, count), rng.integers(0, 4, count))).astype(np.float32)
+        results = SyntheticResults(raw, names)
+        
+        match = bool(np.array_equal(legacy_parse(results), Detections(results).select("vehicle")))
+        
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            legacy_parse(results)
+        legacy_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            Detections(results).select("vehicle")
+        vectorized_time = time.perf_counter() - start
+        
+        run = {
+            "detections": count,
+            "legacy_us": round(legacy_time / args.iterations * 1e6, 1),
+            "vectorized_us": round(vectorized_time / args.iterations * 1e6, 1),
+            "speedup": round(legacy_time / vectorized_time, 1),
+            "match": match
+        }
+        report["runs"].append(run)
+        print(f"detections={count:<4} legacy={run['legacy_us']:>9} us  vectorized={run['vectorized_us']:>7} us  speedup={run['speedup']}x  match={match}")
+    
+    return report
+
+# scripted scene for the stub-model pipeline benchmark, laid out like the line model expects:
+# one crosswalk across the road, vehicles driving through it and a traffic light in the corner
+SCENE_CROSSWALK = (100, 390, 1180, 410)
+SCENE_LIGHT = (1180, 40, 1210, 100)
+LINE_CLASSES = {0: "car", 1: "motorcycle", 2: "green", 3: "red"}
+CROSSWALK_CLASSES = {0: "crosswalk"}
+HELMET_CLASSES = {0: "helmet", 1: "no_helmet", 2: "rider"}
+
+# frame index drawn into every frame as black/white cells, read back by the stub models
+BARCODE_BITS = 16
+BARCODE_CELL = 16
+
+class Scene:
+    def __init__(self, frames, fps=15, size=(1280, 720), vehicles_per_second=1.0, riders_per_second=0.5, wrong_way_share=0.2, no_helmet_share=0.4, light_cycle=(90, 60), seed=0, clear_frames=5):
+        # every object is fixed up front from the seed, so any run of the same scene sees the same boxes
+        rng = np.random.default_rng(seed)
+        self.frames = frames
+        self.fps = fps
+        self.size = size
+        self.light_cycle = light_cycle
+        
+        # the first frames show an empty road so the crosswalk is found on frame 0
+        spawn_frames = np.arange(clear_frames, frames)
+        self.vehicles = self.spawn(rng, spawn_frames, vehicles_per_second / fps, wrong_way_share, (0, 1), (90, 140), (60, 90))
+        self.riders = self.spawn(rng, spawn_frames, riders_per_second / fps, 0.0, (1,), (40, 60), (80, 110))
+        self.no_helmet = rng.random(len(self.riders["start"])) < no_helmet_share
+    
+    def spawn(self, rng, spawn_frames, rate, wrong_way_share, classes, widths, heights):
+        counts = rng.poisson(rate, len(spawn_frames))
+        starts = np.repeat(spawn_frames, counts)
+        count = len(starts)
+        return {
+            "start": starts,
+            "x": rng.integers(150, self.size[0] - 250, count),
+            "speed": rng.uniform(4, 9, count),
+            "north": rng.random(count) >= wrong_way_share,
+            "width": rng.integers(*widths, count),
+            "height": rng.integers(*heights, count),
+            "class": rng.choice(classes, count)
+        }
+    
+    def boxes(self, objects, frame_index):
+        # (n, 4) xyxy of the objects on screen at this frame, and their row in objects
+        width, height = self.size
+        travelled = (frame_index - objects["start"]) * objects["speed"]
+        ymax = np.where(objects["north"], height - 1 - travelled, objects["height"] + travelled)
+        ymin = ymax - objects["height"]
+        visible = np.flatnonzero((frame_index >= objects["start"]) & (ymin >= 0) & (ymax < height))
+        xmin = objects["x"][visible]
+        boxes = np.column_stack((xmin, ymin[visible], xmin + objects["width"][visible], ymax[visible]))
+        return boxes.astype(np.float32), visible
+    
+    def light(self, frame_index):
+        green, red = self.light_cycle
+        return "green" if frame_index % (green + red) < green else "red"
+    
+    def detections(self, model, frame_index):
+        # (n, 6) rows of xmin, ymin, xmax, ymax, confidence, class in full-frame pixels
+        rows = []
+        if model == "crosswalk":
+            rows.append([*SCENE_CROSSWALK, 0.9, 0])
+        if model == "line":
+            boxes, visible = self.boxes(self.vehicles, frame_index)
+            rows.extend([*box, 0.9, cls] for box, cls in zip(boxes.tolist(), self.vehicles["class"][visible].tolist()))
+            boxes, _ = self.boxes(self.riders, frame_index)
+            rows.extend([*box, 0.9, 1] for box in boxes.tolist())
+            rows.append([*SCENE_LIGHT, 0.9, 2 if self.light(frame_index) == "green" else 3])
+        if model == "helmet":
+            boxes, visible = self.boxes(self.riders, frame_index)
+            for (xmin, ymin, xmax, ymax), no_helmet in zip(boxes.tolist(), self.no_helmet[visible].tolist()):
+                quarter = (xmax - xmin) / 4
+                rows.append([xmin, ymin, xmax, ymax, 0.9, 2])
+                rows.append([xmin + quarter, ymin, xmax - quarter, ymin + (ymax - ymin) / 4, 0.9, 1 if no_helmet else 0])
+        return np.array(rows, dtype=np.float32).reshape(-1, 6)
+    
+    def render(self, frame_index):
+        width, height = self.size
+        frame = np.full((height, width, 3), 70, dtype=np.uint8)
+        xmin, ymin, xmax, ymax = SCENE_CROSSWALK
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (230, 230, 230), -1)
+        cv2.rectangle(frame, SCENE_LIGHT[:2], SCENE_LIGHT[2:], (0, 200, 0) if self.light(frame_index) == "green" else (0, 0, 220), -1)
+        for objects, color in ((self.vehicles, (200, 120, 40)), (self.riders, (40, 160, 220))):
+            for box in self.boxes(objects, frame_index)[0].astype(int).tolist():
+                cv2.rectangle(frame, tuple(box[:2]), tuple(box[2:]), color, -1)
+        
+        # drawn last so no object covers it
+        left = (width - BARCODE_BITS * BARCODE_CELL) // 2
+        for bit in range(BARCODE_BITS):
+            value = 255 if frame_index >> bit & 1 else 0
+            frame[height - BARCODE_CELL:, left + bit * BARCODE_CELL:left + (bit + 1) * BARCODE_CELL] = value
+        return frame
+    
+    def write_video(self, video_path):
+        out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, self.size)
+        for i in range(self.frames):
+            out.write(self.render(i))
+        out.release()
+        return video_path
+    
+    def frame_index(self, image):
+        # images are full frames or bottom-aligned crops of them, the road trapezoid the line model sees
+        height, width = image.shape[:2]
+        left = (width - BARCODE_BITS * BARCODE_CELL) // 2
+        cells = image[height - BARCODE_CELL:, left:left + BARCODE_BITS * BARCODE_CELL].reshape(BARCODE_CELL, BARCODE_BITS, BARCODE_CELL, -1)
+        bits = cells[4:-4, :, 4:-4].mean(axis=(0, 2, 3)) > 127
+        offset = ((self.size[0] - width) // 2, self.size[1] - height)
+        return int(sum(1 << bit for bit in np.flatnonzero(bits))), offset
+
+class StubResults:
+    # the parts of YOLOv5 Detections the detectors touch: xyxy, names, tolist() and render()
+    def __init__(self, images, xyxy, names):
+        self.ims = images
+        self.xyxy = xyxy
+        self.names = names
+    
+    def tolist(self):
+        return [StubResults([image], [xyxy], self.names) for image, xyxy in zip(self.ims, self.xyxy)]
+    
+    def render(self):
+        rendered = []
+        for image, xyxy in zip(self.ims, self.xyxy):
+            image = image.copy()
+            for xmin, ymin, xmax, ymax in xyxy[:, :4].astype(int).tolist():
+                cv2.rectangle(image, (xmin, ymin), (xmax, ymax), (0, 255, 255), 2)
+            rendered.append(image)
+        return rendered
+
+class StubModel:
+    # stands in for a hub model, answers with the scene's scripted boxes for the frame it is shown
+    def __init__(self, scene, model, names, load=0):
+        self.scene = scene
+        self.model = model
+        self.names = names
+        
+        # ModelRunner calls a shallow copy carrying its own thresholds, a shared dict counts the calls of every copy
+        self.counter = {"calls": 0}
+        
+        # optional stand-in for inference cost: multi-threaded OpenCV filtering, bounded by cv2.setNumThreads
+        self.load = load
+    
+    @property
+    def calls(self):
+        return self.counter["calls"]
+    
+    def __call__(self, images, size=640):
+        self.counter["calls"] += 1
+        batch = images if isinstance(images, list) else [images]
+        xyxy = []
+        for image in batch:
+            for _ in range(self.load):
+                cv2.GaussianBlur(image, (0, 0), 8)
+            frame_index, (x, y) = self.scene.frame_index(image)
+            rows = self.scene.detections(self.model, frame_index)
+            
+            # crops only see what lies inside them, in their own pixels
+            height, width = image.shape[:2]
+            rows[:, [0, 2]] = np.clip(rows[:, [0, 2]] - x, 0, width)
+            rows[:, [1, 3]] = np.clip(rows[:, [1, 3]] - y, 0, height)
+            xyxy.append(rows[(rows[:, 2] > rows[:, 0]) & (rows[:, 3] > rows[:, 1])])
+        return StubResults(batch, xyxy, self.names)
+
+def install_stub_models(scene, load=0):
+    from model import model_registry, LINE_MODEL_PATH, CROSSWALK_MODEL_PATH, HELMET_MODEL_PATH
+    
+    stubs = {
+        LINE_MODEL_PATH: StubModel(scene, "line", LINE_CLASSES, load),
+        CROSSWALK_MODEL_PATH: StubModel(scene, "crosswalk", CROSSWALK_CLASSES, load),
+        HELMET_MODEL_PATH: StubModel(scene, "helmet", HELMET_CLASSES, load)
+    }
+    for path, stub in stubs.items():
+        model_registry.override(path, stub)
+    return stubs
+
+def remove_stub_models(stubs):
+    from model import model_registry
+    
+    for path in stubs:
+        model_registry.override(path, None)
+
+def measure_allocations(video_path, violation_type, frames, work_dir, render=True):
+    # python-heap bytes (numpy and OpenCV arrays included) per processed frame, traced separately
+    # because tracemalloc slows everything it watches
+    import tracemalloc
+    from detect import create_detector, process_frame
+    from snapshot_writer import SnapshotWriter
+    
+    decoded = read_frames(video_path, frames)
+    snapshot_writer = SnapshotWriter()
+    detect_violation = create_detector(violation_type, work_dir, snapshot_writer=snapshot_writer, render=render, annotate=("line", "helmet") if render else ())
+    
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    try:
+        for frame in decoded:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            process_frame(detect_violation, violation_type, frame, annotate=("line", "helmet") if render else ())
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(current - before)
+    finally:
+        tracemalloc.stop()
+        snapshot_writer.close()
+    
+    peaks = np.array(peaks) / 1024
+    return {
+        "frames": len(decoded),
+        "peak_kib_mean": round(float(peaks.mean()), 1) if len(peaks) else 0,
+        "peak_kib_p95": round(float(np.percentile(peaks, 95)), 1) if len(peaks) else 0,
+        "peak_kib_max": round(float(peaks.max()), 1) if len(peaks) else 0,
+        "retained_kib_per_frame": round(sum(retained) / 1024 / max(len(retained), 1), 2)
+    }
+
+def bench_pipeline(args):
+    from detect import start_detection
+    from timing import StageTimer, STAGES
+    
+    scene = Scene(args.frames, args.fps, vehicles_per_second=args.vehicles_per_second, riders_per_second=args.riders_per_second, seed=args.seed)
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    stubs = install_stub_models(scene)
+    try:
+        video_path = scene.write_video(os.path.join(work_dir, "scene.mp4"))
+        timer = StageTimer()
+        progress = {"frames": 0}
+        results = {}
+        
+        start = time.perf_counter()
+        start_detection(
+            os.path.join(work_dir, "run"), video_path, args.violation_type,
+            progress_callback=lambda done, _: progress.update(frames=done),
+            batch_size=args.batch_size, render=not args.analytics,
+            stats_callback=lambda stats: results.__setitem__("stats", stats),
+            summary_callback=lambda summary: results.__setitem__("summary", summary),
+            timer=timer
+        )
+        elapsed = time.perf_counter() - start
+        
+        frames = max(progress["frames"], 1)
+        busy = results["stats"]["busy_seconds"]
+        stages = timer.summary()
+        
+        # decode and encode have their own threads, everything else shares the processing thread
+        seconds = {"decode": busy["decode"]}
+        seconds.update({stage: stages.get(stage, {"seconds": 0.0})["seconds"] for stage in STAGES})
+        seconds["other"] = max(busy["process"] - sum(seconds[stage] for stage in STAGES), 0.0)
+        seconds["encode"] = busy["encode"]
+        
+        summary = results["summary"]
+        events = [(event["category"], event["frame_index"], event["bbox"]) for event in summary["events"]]
+        report = {
+            "benchmark": "pipeline",
+            "violation_type": args.violation_type,
+            "mode": "analytics" if args.analytics else "video",
+            "scene": {"frames": args.frames, "fps": args.fps, "vehicles": len(scene.vehicles["start"]), "riders": len(scene.riders["start"]), "seed": args.seed},
+            "frames_processed": progress["frames"],
+            "seconds": round(elapsed, 3),
+            "fps": round(progress["frames"] / elapsed, 2),
+            "stage_ms_per_frame": {stage: round(value / frames * 1000, 3) for stage, value in seconds.items()},
+            "model_calls": {stub.model: stub.calls for stub in stubs.values()},
+            "counters": summary["counters"],
+            "events": len(events),
+            "events_digest": hashlib.md5(json.dumps(events).encode()).hexdigest()
+        }
+        
+        if args.alloc_frames:
+            report["allocations"] = measure_allocations(video_path, args.violation_type, args.alloc_frames, os.path.join(work_dir, "alloc"), not args.analytics)
+        
+        print(f"fps={report['fps']}  " + "  ".join(f"{stage}={ms}ms" for stage, ms in report["stage_ms_per_frame"].items()))
+        print(f"counters={report['counters']}  events={report['events']}  digest={report['events_digest'][:12]}")
+        return report
+    finally:
+        remove_stub_models(stubs)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def bench_shard(args):
+    from detect import start_detection
+    
+    scene = Scene(args.frames, args.fps, vehicles_per_second=args.vehicles_per_second, riders_per_second=args.riders_per_second, seed=args.seed)
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    stubs = install_stub_models(scene)
+    report = {"benchmark": "shard", "violation_type": args.violation_type, "frames": args.frames, "runs": []}
+    summaries = {}
+    try:
+        video_path = scene.write_video(os.path.join(work_dir, "scene.mp4"))
+        
+        for shards in [1] + args.shards:
+            start = time.perf_counter()
+            # shard processes are spawned, so they install the same stub models on start
+            start_detection(
+                os.path.join(work_dir, f"run_{shards}"), video_path, args.violation_type,
+                render=not args.analytics, shards=shards, shard_workers=args.workers,
+                summary_callback=lambda summary, shards=shards: summaries.__setitem__(shards, summary),
+                shard_initializer=install_stub_models, shard_initargs=(scene,)
+            )
+            elapsed = time.perf_counter() - start
+            
+            # track ids differ between runs and a tracker warmed up mid-video smooths boxes a little
+            # differently, so events match on category and frame with boxes within a few pixels
+            events = sorted((event["category"], event["frame_index"], event["bbox"]) for event in summaries[shards]["events"])
+            reference = sorted((event["category"], event["frame_index"], event["bbox"]) for event in summaries[1]["events"])
+            same_events = [a[:2] for a in events] == [b[:2] for b in reference]
+            bbox_delta = max((int(np.abs(np.subtract(a[2], b[2])).max()) for a, b in zip(events, reference)), default=0) if same_events else None
+            run = {
+                "shards": shards,
+                "seconds": round(elapsed, 3),
+                "fps": round(args.frames / elapsed, 2),
+                "counters": summaries[shards]["counters"],
+                "events_match": same_events and bbox_delta <= args.bbox_tolerance,
+                "max_bbox_delta": bbox_delta
+            }
+            report["runs"].append(run)
+            print(f"shards={shards:<3} {run['fps']:>8} fps  counters={run['counters']}  match={run['events_match']}  max_bbox_delta={bbox_delta}")
+        return report
+    finally:
+        remove_stub_models(stubs)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_concurrently(run_detection, video_path, violation_type, jobs, concurrency, work_dir, render=True):
+    # a burst of jobs on the same clip, at most `concurrency` at a time like the JobManager runs them
+    from concurrent.futures import ThreadPoolExecutor
+    
+    frames = [0] * jobs
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(
+                run_detection, os.path.join(work_dir, f"job_{i}"), video_path, violation_type, render=render,
+                progress_callback=lambda done, _, i=i: frames.__setitem__(i, done)
+            )
+            for i in range(jobs)
+        ]
+        for future in futures:
+            future.result()
+    return time.perf_counter() - start, sum(frames)
+
+def bench_workers(args):
+    from detect import start_detection
+    from worker_pool import DetectionWorkerPool, available_cpus, configure_threads
+    
+    scene = Scene(args.frames, args.fps, vehicles_per_second=args.vehicles_per_second, riders_per_second=args.riders_per_second, seed=args.seed)
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    stubs = install_stub_models(scene, args.load)
+    cpus = available_cpus()
+    report = {"benchmark": "workers", "violation_type": args.violation_type, "frames": args.frames, "jobs": args.jobs, "cpus": cpus, "runs": []}
+    
+    def add_run(backend, workers, threads, elapsed, frames):
+        run = {
+            "backend": backend,
+            "workers": workers,
+            "threads": threads,
+            "seconds": round(elapsed, 3),
+            "total_fps": round(frames / elapsed, 2),
+            "fps_per_job": round(frames / elapsed / min(workers, args.jobs), 2)
+        }
+        report["runs"].append(run)
+        print(f"{backend:<8} workers={workers:<3} threads={threads:<3} {run['total_fps']:>8} fps total  {run['fps_per_job']:>8} fps per running job")
+    
+    try:
+        video_path = scene.write_video(os.path.join(work_dir, "scene.mp4"))
+        
+        # today's default: job threads in one process, every library pool sized to the whole machine
+        configure_threads(cpus)
+        elapsed, frames = run_concurrently(start_detection, video_path, args.violation_type, args.jobs, args.thread_workers, os.path.join(work_dir, "thread"), not args.analytics)
+        add_run("thread", args.thread_workers, cpus, elapsed, frames)
+        
+        for workers in args.workers:
+            pool = DetectionWorkerPool(workers=workers, threads=args.threads, pin_cores=args.pin_cores, warmup=False, initializer=install_stub_models, initargs=(scene, args.load))
+            try:
+                # worker start-up and model loading happen once per pool, not per job, so they stay out of the timing
+                for future in [pool.executor.submit(time.sleep, 0.5) for _ in range(pool.workers)]:
+                    future.result()
+                elapsed, frames = run_concurrently(pool.run_detection, video_path, args.violation_type, args.jobs, pool.workers, os.path.join(work_dir, f"process_{workers}"), not args.analytics)
+                add_run("process", pool.workers, pool.threads, elapsed, frames)
+            finally:
+                pool.shutdown()
+        return report
+    finally:
+        remove_stub_models(stubs)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def scene_detections(scene, frames, rng, miss_rate, jitter):
+    # per-frame (n, 5) vehicle detections with box noise and missed frames, what a real detector hands the tracker
+    stream = []
+    for frame_index in range(frames):
+        boxes, _ = scene.boxes(scene.vehicles, frame_index)
+        boxes = boxes[rng.random(len(boxes)) >= miss_rate].astype(np.float64)
+        boxes += rng.normal(0, jitter, boxes.shape)
+        stream.append(np.column_stack((boxes, np.full(len(boxes), 0.9))))
+    return stream
+
+def bench_tracker(args):
+    import sort
+    from tracker import Tracker
+    
+    report = {"benchmark": "tracker", "frames": args.frames, "runs": []}
+    for rate in args.vehicles_per_second:
+        rng = np.random.default_rng(args.seed)
+        scene = Scene(args.frames, vehicles_per_second=rate, seed=args.seed)
+        stream = scene_detections(scene, args.frames, rng, args.miss_rate, args.jitter)
+        
+        timings = {}
+        outputs = {}
+        for name, create in (("sort", lambda: sort.Sort(max_age=args.max_age, min_hits=3, iou_threshold=0.3)), ("tracker", lambda: Tracker(max_age=args.max_age, min_hits=3, iou_threshold=0.3))):
+            # Sort numbers tracks from a class-wide counter, restart it so both runs hand out the same ids
+            sort.KalmanBoxTracker.count = 0
+            tracker = create()
+            start = time.perf_counter()
+            results = [tracker.update(dets) for dets in stream]
+            timings[name] = time.perf_counter() - start
+            outputs[name] = results
+            live = len(tracker.trackers) if name == "sort" else len(tracker)
+        
+        same_tracks = all(np.array_equal(a[:, 4], b[:, 4]) for a, b in zip(outputs["sort"], outputs["tracker"]))
+        max_delta = max((float(np.abs(a[:, :4] - b[:, :4]).max()) for a, b in zip(outputs["sort"], outputs["tracker"]) if len(a)), default=0.0) if same_tracks else None
+        run = {
+            "vehicles_per_second": rate,
+            "detections_per_frame": round(sum(len(dets) for dets in stream) / args.frames, 1),
+            "live_tracks": live,
+            "sort_us": round(timings["sort"] / args.frames * 1e6, 1),
+            "tracker_us": round(timings["tracker"] / args.frames * 1e6, 1),
+            "speedup": round(timings["sort"] / timings["tracker"], 1),
+            "match": same_tracks and max_delta <= args.tolerance,
+            "max_bbox_delta": max_delta
+        }
+        report["runs"].append(run)
+        print(f"rate={rate:<5} dets/frame={run['detections_per_frame']:<6} sort={run['sort_us']:>9} us  tracker={run['tracker_us']:>8} us  speedup={run['speedup']}x  match={run['match']}  max_bbox_delta={max_delta}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Traffic violation detection benchmarks")
+    parser.add_argument("--output", help="write the JSON report to this path")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    batch_parser = subparsers.add_parser("batch", help="throughput of batched vs frame-by-frame inference")
+    batch_parser.add_argument("--video", required=True)
+    batch_parser.add_argument("--violation-type", choices=["line", "helmet"], default="helmet")
+    batch_parser.add_argument("--frames", type=int, default=120)
+    batch_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    batch_parser.set_defaults(func=bench_batch)
+    
+    backends_parser = subparsers.add_parser("backends", help="eager pytorch vs exported onnx/torchscript models, speed and detection parity")
+    backends_parser.add_argument("--video", required=True)
+    backends_parser.add_argument("--frames", type=int, default=120)
+    backends_parser.add_argument("--models", choices=["line", "crosswalk", "helmet"], nargs="+", default=["line", "crosswalk", "helmet"])
+    backends_parser.add_argument("--backends", choices=["pytorch", "onnx", "onnx-int8", "torchscript"], nargs="+", default=["pytorch", "onnx", "onnx-int8", "torchscript"])
+    backends_parser.add_argument("--min-confidence", type=float, default=0.5, help="boxes below this are left out of the parity check")
+    backends_parser.add_argument("--match-iou", type=float, default=0.5)
+    backends_parser.set_defaults(func=bench_backends)
+    
+    analytics_parser = subparsers.add_parser("analytics", help="annotated video vs render-free analytics run, with result parity")
+    analytics_parser.add_argument("--video", required=True)
+    analytics_parser.add_argument("--violation-type", choices=["line", "helmet", "all"], default="helmet")
+    analytics_parser.add_argument("--no-evidence", action="store_true", help="skip violation crops in both runs")
+    analytics_parser.set_defaults(func=bench_analytics)
+    
+    pipeline_parser = subparsers.add_parser("pipeline", help="end to end fps, per-stage latency and allocations on a scripted scene with stub models")
+    pipeline_parser.add_argument("--violation-type", choices=["line", "helmet", "all"], default="all")
+    pipeline_parser.add_argument("--frames", type=int, default=600)
+    pipeline_parser.add_argument("--fps", type=float, default=15)
+    pipeline_parser.add_argument("--vehicles-per-second", type=float, default=1.0)
+    pipeline_parser.add_argument("--riders-per-second", type=float, default=0.5)
+    pipeline_parser.add_argument("--batch-size", type=int, default=1)
+    pipeline_parser.add_argument("--analytics", action="store_true", help="render-free run, no drawing and no output video")
+    pipeline_parser.add_argument("--alloc-frames", type=int, default=100, help="frames traced for allocations, 0 to skip")
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser.set_defaults(func=bench_pipeline)
+    
+    shard_parser = subparsers.add_parser("shard", help="one long scripted video, single process vs time-segment shards, with result parity")
+    shard_parser.add_argument("--violation-type", choices=["line", "helmet", "all"], default="all")
+    shard_parser.add_argument("--frames", type=int, default=1800)
+    shard_parser.add_argument("--fps", type=float, default=15)
+    shard_parser.add_argument("--vehicles-per-second", type=float, default=1.0)
+    shard_parser.add_argument("--riders-per-second", type=float, default=0.5)
+    shard_parser.add_argument("--shards", type=int, nargs="+", default=[2, 4])
+    shard_parser.add_argument("--workers", type=int, help="shard processes, defaults to one per core")
+    shard_parser.add_argument("--analytics", action="store_true", help="render-free runs, no output video")
+    shard_parser.add_argument("--bbox-tolerance", type=int, default=4, help="pixels a violation box may move between runs")
+    shard_parser.add_argument("--seed", type=int, default=0)
+    shard_parser.set_defaults(func=bench_shard)
+    
+    workers_parser = subparsers.add_parser("workers", help="total fps of concurrent jobs, job threads vs a process pool as the worker count grows")
+    workers_parser.add_argument("--violation-type", choices=["line", "helmet", "all"], default="all")
+    workers_parser.add_argument("--frames", type=int, default=300)
+    workers_parser.add_argument("--fps", type=float, default=15)
+    workers_parser.add_argument("--vehicles-per-second", type=float, default=1.0)
+    workers_parser.add_argument("--riders-per-second", type=float, default=0.5)
+    workers_parser.add_argument("--jobs", type=int, default=8, help="videos submitted at once")
+    workers_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    workers_parser.add_argument("--threads", type=int, help="threads per worker, defaults to an equal share of the cores")
+    workers_parser.add_argument("--thread-workers", type=int, default=2, help="concurrent jobs on the thread backend")
+    workers_parser.add_argument("--pin-cores", action="store_true")
+    workers_parser.add_argument("--load", type=int, default=2, help="multi-threaded blur passes per stub inference, stands in for model cost")
+    workers_parser.add_argument("--analytics", action="store_true", help="render-free runs, no output video")
+    workers_parser.add_argument("--seed", type=int, default=0)
+    workers_parser.set_defaults(func=bench_workers)
+    
+    tracker_parser = subparsers.add_parser("tracker", help="per-frame tracker update, external SORT vs the built-in tracker, with output parity")
+    tracker_parser.add_argument("--frames", type=int, default=900)
+    tracker_parser.add_argument("--vehicles-per-second", type=float, nargs="+", default=[1, 4, 8, 16])
+    tracker_parser.add_argument("--miss-rate", type=float, default=0.1, help="share of boxes the detector misses each frame")
+    tracker_parser.add_argument("--jitter", type=float, default=2.0, help="box noise in pixels")
+    tracker_parser.add_argument("--max-age", type=int, default=180)
+    tracker_parser.add_argument("--tolerance", type=float, default=1e-6, help="pixels a track box may differ from SORT's")
+    tracker_parser.add_argument("--seed", type=int, default=0)
+    tracker_parser.set_defaults(func=bench_tracker)
+    
+    parse_parser = subparsers.add_parser("parse", help="per-frame detection parsing, pandas iterrows vs vectorized")
+    parse_parser.add_argument("--detections", type=int, nargs="+", default=[5, 20, 50, 100])
+    parse_parser.add_argument("--iterations", type=int, default=200)
+    parse_parser.add_argument("--seed", type=int, default=0)
+    parse_parser.set_defaults(func=bench_parse)
+    
+    resample_parser = subparsers.add_parser("resample", help="upload fps/size normalization, seek-per-frame vs sequential decode")
+    resample_parser.add_argument("--seconds", type=float, default=120)
+    resample_parser.add_argument("--source-fps", type=float, default=30)
+    resample_parser.add_argument("--source-size", type=int, nargs=2, default=[1920, 1080])
+    resample_parser.add_argument("--target-fps", type=float, default=15)
+    resample_parser.set_defaults(func=bench_resample)
+    
+    crossing_parser = subparsers.add_parser("crossing", help="newest-segment x crosswalk-area crossing tests as track count grows")
+    crossing_parser.add_argument("--tracks", type=int, nargs="+", default=[5, 20, 40, 80, 160])
+    crossing_parser.add_argument("--areas", type=int, default=4)
+    crossing_parser.add_argument("--iterations", type=int, default=500)
+    crossing_parser.add_argument("--seed", type=int, default=0)
+    crossing_parser.set_defaults(func=bench_crossing)
+    
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    
+    report = args.func(args)
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,177 @@
+import os
+import re
+import cv2
+import json
+import uuid
+import hashlib
+import logging
+import threading
+import numpy as np
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class CalibrationCache:
+    def __init__(self, cache_dir='./calibration', similarity_threshold=0.85, thumbnail_size=(64, 36), max_entries=256):
+        self.cache_dir = cache_dir
+        self.similarity_threshold = similarity_threshold
+        self.thumbnail_size = thumbnail_size
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        
+        # file name -> ((mtime, size), entry), so lookups only parse files that changed
+        self.loaded = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+    
+    def fingerprint(self, frame):
+        # blurred, normalized grayscale thumbnail: stable under passing traffic and exposure drift,
+        # but moves noticeably when the camera is re-aimed or the road layout changes
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(gray, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        thumbnail = cv2.GaussianBlur(thumbnail, (5, 5), 0).astype(np.float32)
+        thumbnail -= thumbnail.mean()
+        norm = np.linalg.norm(thumbnail)
+        return thumbnail / norm if norm else thumbnail
+    
+    def similarity(self, fingerprint, other):
+        # flat frames (all black, all grey) normalize to zeros and only match each other
+        if not fingerprint.any() or not other.any():
+            return 1.0 if not fingerprint.any() and not other.any() else 0.0
+        return float(np.sum(fingerprint * other))
+    
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', key)}.json")
+    
+    def entries(self):
+        files = [file for file in os.listdir(self.cache_dir) if file.endswith('.json')]
+        for file in set(self.loaded) - set(files):
+            del self.loaded[file]
+        
+        for file in files:
+            path = os.path.join(self.cache_dir, file)
+            try:
+                stat = os.stat(path)
+                version = (stat.st_mtime_ns, stat.st_size)
+                if file not in self.loaded or self.loaded[file][0] != version:
+                    with open(path) as f:
+                        self.loaded[file] = (version, json.load(f))
+            except (OSError, ValueError):
+                # removed or rewritten by another process while listing
+                continue
+            yield self.loaded[file][1]
+    
+    def touch(self, key):
+        # use order lives in the file's mtime, the least recently used entries are evicted first
+        path = self.path(key)
+        try:
+            os.utime(path)
+            stat = os.stat(path)
+        except OSError:
+            return
+        file = os.path.basename(path)
+        if file in self.loaded:
+            self.loaded[file] = ((stat.st_mtime_ns, stat.st_size), self.loaded[file][1])
+    
+    def evict(self):
+        if not self.max_entries:
+            return
+        paths = [os.path.join(self.cache_dir, file) for file in os.listdir(self.cache_dir) if file.endswith('.json')]
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+                logger.info(f"Calibration evicted: {os.path.basename(path)}")
+            except OSError:
+                pass
+    
+    def match(self, fingerprint, candidates):
+        best, best_score = None, -1.0
+        for entry in candidates:
+            score = self.similarity(fingerprint, np.array(entry['fingerprint'], dtype=np.float32))
+            if score > best_score:
+                best, best_score = entry, score
+        return best, best_score
+    
+    def lookup(self, fingerprint, camera_id=None):
+        with self.lock:
+            if camera_id:
+                try:
+                    with open(self.path(camera_id)) as f:
+                        candidates = [json.load(f)]
+                except (OSError, ValueError):
+                    # not stored yet, or removed by another process meanwhile
+                    return None
+            else:
+                candidates = list(self.entries())
+            
+            best, best_score = self.match(fingerprint, candidates)
+            if best is None:
+                return None
+            
+            if best_score < self.similarity_threshold:
+                if camera_id:
+                    # same camera but a different scene, the stored areas no longer apply
+                    logger.info(f"Calibration for camera {camera_id} invalidated, scene similarity {best_score:.2f}")
+                    try:
+                        os.remove(self.path(camera_id))
+                    except OSError:
+                        pass
+                return None
+            
+            self.touch(best['key'])
+            logger.info(f"Calibration cache hit: {best['key']} (similarity {best_score:.2f})")
+            return best
+    
+    def scene_key(self, fingerprint):
+        # anonymous scenes are named after their fingerprint, rounded so float noise doesn't fork them
+        digest = hashlib.sha256(np.round(np.asarray(fingerprint, dtype=np.float32), 3).tobytes()).hexdigest()
+        return f"scene_{digest[:16]}"
+    
+    def store(self, fingerprint, areas, camera_id=None):
+        fields = {
+            'camera_id': camera_id,
+            'fingerprint': fingerprint.tolist(),
+            'areas': [
+                {
+                    'coords': np.asarray(area['coords']).tolist(),
+                    'status_dir': area['status_dir'],
+                    'north_count': area['north_count'],
+                    'south_count': area['south_count']
+                }
+                for area in areas
+            ],
+            'created_at': datetime.now().strftime('%Y%m%d%H%M%S')
+        }
+        
+        with self.lock:
+            key = camera_id
+            if not key:
+                # a scene that's already stored is updated in place rather than stored again
+                best, best_score = self.match(fingerprint, [candidate for candidate in self.entries() if not candidate.get('camera_id')])
+                key = best['key'] if best is not None and best_score >= self.similarity_threshold else self.scene_key(fingerprint)
+            entry = {'key': key, **fields}
+            
+            # shard and pool processes read this directory too, so they only ever see whole files
+            path = self.path(key)
+            partial_path = os.path.join(self.cache_dir, f".{os.path.basename(path)}.{uuid.uuid4().hex}.partial")
+            try:
+                with open(partial_path, 'w') as f:
+                    json.dump(entry, f)
+                os.replace(partial_path, path)
+            finally:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+            self.evict()
+        
+        logger.info(f"Calibration stored: {key}")
+        return entry
+    
+    def invalidate(self, key):
+        with self.lock:
+            try:
+                os.remove(self.path(key))
+                return True
+            except FileNotFoundError:
+                return False
\ No newline at end of file
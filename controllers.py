@@ -1,7 +1,12 @@
 import os
-from flask import request, jsonify, send_from_directory
-from werkzeug.utils import secure_filename
-from detect import start_detection
+import hashlib
+from flask import request, jsonify, make_response, send_from_directory
+from werkzeug.utils import secure_filename, safe_join
+from werkzeug.exceptions import NotFound
+from jobs import QueueFullError, JOB_DONE, JOB_FAILED
+from pipeline import DROP_POLICIES
+from video_index import VIOLATION_CATEGORIES
+from model import file_hash
 
 NO_ID_ERROR = {
     'status': 'error',
@@ -9,7 +14,19 @@ NO_ID_ERROR = {
     'error_code': 400
 }
 
-def upload_video_controller(app_config, utils):
+JOB_NOT_FOUND_ERROR = {
+    'status': 'error',
+    'message': 'Job not found',
+    'error_code': 404
+}
+
+# one year, for /file URLs that carry the file's current version
+IMMUTABLE_MAX_AGE = 31536000
+
+DEFAULT_VIOLATIONS_PER_PAGE = 100
+MAX_VIOLATIONS_PER_PAGE = 1000
+
+def upload_video_controller(app_config, utils, normalize_fps=0):
     if 'file' not in request.files:
         response = {
             'status': 'error',
@@ -38,10 +55,51 @@ def upload_video_controller(app_config, utils):
     if file and utils.allowed_file(file.filename):
         filename = secure_filename(file.filename)
         uid, unique_name, created_at = utils.upload_process(filename)
+        
+        # saved under a temporary name first, the content hash decides whether this is a new upload
+        temp_file_path = os.path.join(app_config, f".{uid}.partial")
+        try:
+            content_hash = utils.save_and_hash(file, temp_file_path)
+        except Exception:
+            # client went away mid-upload
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+        
+        # a normalized upload is stored re-encoded, so the same bytes at another fps are a different video
+        if normalize_fps:
+            content_hash = f"{content_hash}@{normalize_fps}fps"
+        
+        existing = utils.find_upload_by_content(content_hash)
+        if existing:
+            os.remove(temp_file_path)
+            response = {
+                'status': 'success',
+                'message': 'File already uploaded',
+                'data': {
+                    'id': existing['id'],
+                    'filename': existing['filename'],
+                    'file_path': existing['video_path'].replace('\\', '/').replace(app_config, ''),
+                    'created_at': existing['created_at'],
+                    'deduplicated': True
+                }
+            }
+            return jsonify(response), 200
+        
         folder_name = os.path.join(app_config, uid)
         os.makedirs(folder_name, exist_ok=True)
         file_path = os.path.join(folder_name, f"{unique_name}")
-        file.save(file_path)
+        if normalize_fps:
+            # store the upload already at 1280x720 and the target fps so detection never resizes
+            try:
+                utils.save_and_resize(temp_file_path, file_path, new_fps=normalize_fps)
+            finally:
+                os.remove(temp_file_path)
+            video_hash = file_hash(file_path)
+        else:
+            os.replace(temp_file_path, file_path)
+            video_hash = content_hash
+        utils.register_upload(uid, folder_name, file_path, created_at, content_hash, video_hash)
         response = {
             'status': 'success',
             'message': 'File uploaded successfully',
@@ -49,7 +107,8 @@ def upload_video_controller(app_config, utils):
                 'id': uid,
                 'filename': unique_name,
                 'file_path': file_path.replace('\\', '/').replace(app_config, ''),
-                'created_at': created_at
+                'created_at': created_at,
+                'deduplicated': False
             }
         }
         return jsonify(response), 201
@@ -61,60 +120,218 @@ def upload_video_controller(app_config, utils):
     }
     return jsonify(response), 400
 
-def detect_line_violation_controller(app_config, utils):
+def detect_line_violation_controller(app_config, utils, jobs):
+    return submit_detection(app_config, utils, jobs, "line", "Line violation detection queued")
+
+def detect_helmet_violation_controller(app_config, utils, jobs):
+    return submit_detection(app_config, utils, jobs, "helmet", "Helmet violation detection queued")
+
+def detect_all_violation_controller(app_config, utils, jobs):
     data = request.form
+    options = {}
     
-    if 'id' not in data or data['id'] == '':
-        return jsonify(NO_ID_ERROR), 400
+    # comma separated analyses to draw on the output video, empty skips encoding altogether
+    if 'annotate' in data:
+        annotate = tuple(name for name in data['annotate'].split(',') if name)
+        if any(name not in ('line', 'helmet') for name in annotate):
+            response = {
+                'status': 'error',
+                'message': 'annotate must be a comma separated list of line, helmet',
+                'error_code': 400
+            }
+            return jsonify(response), 400
+        options['annotate'] = annotate
     
-    idx = data['id']
-    file_dir = utils.search_video_dir(app_config, idx)
-    video_input_path = utils.search_video(app_config, idx)
+    return submit_detection(app_config, utils, jobs, "all", "Line and helmet violation detection queued", options)
+
+def detection_options(data, options=None):
+    # fixed cameras reuse their crosswalk calibration and inference settings across videos
+    options = dict(options or {})
+    if data.get('camera_id'):
+        options['camera_id'] = data['camera_id']
     
-    if file_dir and video_input_path:
-        output_file_path = start_detection(file_dir, video_input_path, violation_type="line")
-        filename = os.path.basename(output_file_path)
+    # mode=analytics skips drawing and encoding, the result carries events and counters only
+    mode = data.get('mode', 'video')
+    evidence = data.get('evidence', 'true').lower()
+    if mode not in ('video', 'analytics') or evidence not in ('true', 'false'):
+        raise ValueError('mode must be video or analytics and evidence must be true or false')
+    if mode == 'analytics':
+        options['render'] = False
+    if evidence == 'false':
+        options['evidence'] = False
+    
+    # shards=N splits a long video into N time segments processed in parallel processes
+    if data.get('shards'):
+        try:
+            options['shards'] = int(data['shards'])
+        except ValueError:
+            raise ValueError('shards must be an integer')
+        if options['shards'] < 1:
+            raise ValueError('shards must be at least 1')
+    
+    # profile=true dumps a cProfile of the run and its stage timings next to the result video
+    profile = data.get('profile', 'false').lower()
+    if profile not in ('true', 'false'):
+        raise ValueError('profile must be true or false')
+    if profile == 'true':
+        if options.get('shards', 1) > 1:
+            raise ValueError('profile is not supported with shards, profile an unsharded run')
+        options['profile'] = True
+    
+    return options
+
+def stream_options(data):
+    options = {'stream': True}
+    
+    try:
+        if data.get('segment_seconds'):
+            options['segment_seconds'] = int(data['segment_seconds'])
+        if data.get('max_segments'):
+            options['max_segments'] = int(data['max_segments'])
+    except ValueError:
+        raise ValueError('segment_seconds and max_segments must be integers')
+    if options.get('segment_seconds', 1) <= 0 or options.get('max_segments', 0) < 0:
+        raise ValueError('segment_seconds must be positive and max_segments must not be negative')
+    
+    if data.get('drop_policy'):
+        if data['drop_policy'] not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {', '.join(DROP_POLICIES)}")
+        options['drop_policy'] = data['drop_policy']
+    
+    loop = data.get('loop', 'false').lower()
+    if loop not in ('true', 'false'):
+        raise ValueError('loop must be true or false')
+    options['loop'] = loop == 'true'
+    
+    return options
+
+def stream_source_allowed(source, allowed_sources):
+    # sources come from the request, so only configured URL schemes, path prefixes or local devices are opened
+    if source.isdigit():
+        return 'device' in allowed_sources
+    return any(prefix != 'device' and source.startswith(prefix) for prefix in allowed_sources)
+
+def detect_stream_controller(app_config, utils, streams, allowed_sources):
+    data = request.form
+    source = data.get('source', '').strip()
+    violation_type = data.get('violation_type', 'all')
+    
+    if not source:
         response = {
-            'status': 'success',
-            'message': 'Line violation detection success',
-            'data': {
-                'id': idx,
-                'filename': filename,
-                'output_file_path': output_file_path.replace('\\', '/').replace(app_config, '')
-            }
+            'status': 'error',
+            'message': 'No source provided',
+            'error_code': 400
         }
-        return jsonify(response), 201
-    else:
+        return jsonify(response), 400
+    
+    if not stream_source_allowed(source, allowed_sources):
         response = {
             'status': 'error',
-            'message': 'Video not found',
-            'error_code': 404
+            'message': 'Stream source is not allowed',
+            'error_code': 403
         }
-        return jsonify(response), 404
+        return jsonify(response), 403
+    
+    try:
+        if violation_type not in ('line', 'helmet', 'all'):
+            raise ValueError('violation_type must be line, helmet or all')
+        options = {**detection_options(data), **stream_options(data)}
+    except ValueError as e:
+        response = {
+            'status': 'error',
+            'message': str(e),
+            'error_code': 400
+        }
+        return jsonify(response), 400
+    
+    # a stream gets an id and folder like an upload, so violations and results are served the same way
+    uid, _, created_at = utils.upload_process('stream')
+    folder_name = os.path.join(app_config, uid)
+    os.makedirs(folder_name, exist_ok=True)
+    
+    try:
+        job, _ = streams.submit(uid, violation_type, folder_name, source, options)
+    except QueueFullError:
+        os.rmdir(folder_name)
+        response = {
+            'status': 'error',
+            'message': 'All stream workers are busy, stop a stream first',
+            'error_code': 503
+        }
+        return jsonify(response), 503, {'Retry-After': '30'}
+    
+    utils.register_stream(uid, folder_name, source, created_at)
+    response = {
+        'status': 'success',
+        'message': 'Stream detection started',
+        'data': job.to_dict()
+    }
+    return jsonify(response), 202, {'Location': f"/jobStatus?id={job.id}"}
 
-def detect_helmet_violation_controller(app_config, utils):
+def stop_job_controller(jobs, streams):
+    job_id = request.form.get('id')
+    
+    if not job_id:
+        return jsonify(NO_ID_ERROR), 400
+    
+    job = jobs.get(job_id) or streams.get(job_id)
+    if not job:
+        return jsonify(JOB_NOT_FOUND_ERROR), 404
+    
+    job.stop()
+    response = {
+        'status': 'success',
+        'message': 'Job stopping',
+        'data': job.to_dict()
+    }
+    return jsonify(response), 202, {'Location': f"/jobStatus?id={job.id}"}
+
+def submit_detection(app_config, utils, jobs, violation_type, message, options=None):
     data = request.form
     
     if 'id' not in data or data['id'] == '':
         return jsonify(NO_ID_ERROR), 400
     
+    try:
+        options = detection_options(data, options)
+    except ValueError as e:
+        response = {
+            'status': 'error',
+            'message': str(e),
+            'error_code': 400
+        }
+        return jsonify(response), 400
+    
     idx = data['id']
+    if utils.is_stream(idx):
+        # a live source would never finish as a file job, streams run through /detectStream
+        response = {
+            'status': 'error',
+            'message': 'Id belongs to a live stream, not an uploaded video',
+            'error_code': 400
+        }
+        return jsonify(response), 400
+    
     file_dir = utils.search_video_dir(app_config, idx)
     video_input_path = utils.search_video(app_config, idx)
     
     if file_dir and video_input_path:
-        output_file_path = start_detection(file_dir, video_input_path, violation_type="helmet")
-        filename = os.path.basename(output_file_path)
+        try:
+            job, created = jobs.submit(idx, violation_type, file_dir, video_input_path, options)
+        except QueueFullError:
+            response = {
+                'status': 'error',
+                'message': 'Detection queue is full, try again later',
+                'error_code': 503
+            }
+            return jsonify(response), 503, {'Retry-After': '30'}
+        
         response = {
             'status': 'success',
-            'message': 'Helmet violation detection success',
-            'data': {
-                'id': idx,
-                'filename': filename,
-                'output_file_path': output_file_path.replace('\\', '/').replace(app_config, '')
-            }
+            'message': message if created else 'Detection already in progress',
+            'data': job.to_dict()
         }
-        return jsonify(response), 201
+        return jsonify(response), 202, {'Location': f"/jobStatus?id={job.id}"}
     else:
         response = {
             'status': 'error',
@@ -123,13 +340,138 @@ def detect_helmet_violation_controller(app_config, utils):
         }
         return jsonify(response), 404
 
+def get_job_status_controller(jobs, streams):
+    job_id = request.args.get('id')
+    
+    if not job_id:
+        return jsonify(NO_ID_ERROR), 400
+    
+    job = jobs.get(job_id) or streams.get(job_id)
+    if not job:
+        return jsonify(JOB_NOT_FOUND_ERROR), 404
+    
+    response = {
+        'status': 'success',
+        'message': 'Get job status success',
+        'data': job.to_dict()
+    }
+    return jsonify(response), 200
+
+def get_job_result_controller(app_config, jobs, streams, utils):
+    job_id = request.args.get('id')
+    
+    if not job_id:
+        return jsonify(NO_ID_ERROR), 400
+    
+    job = jobs.get(job_id) or streams.get(job_id)
+    if not job:
+        return jsonify(JOB_NOT_FOUND_ERROR), 404
+    
+    if job.state == JOB_FAILED:
+        response = {
+            'status': 'error',
+            'message': f"Detection failed: {job.error}",
+            'error_code': 500
+        }
+        return jsonify(response), 500
+    
+    if job.state != JOB_DONE:
+        response = {
+            'status': 'pending',
+            'message': 'Detection still in progress',
+            'data': job.to_dict()
+        }
+        return jsonify(response), 202
+    
+    output_file_path = job.output_file_path
+    profile = (job.pipeline_stats or {}).get('profile')
+    
+    version = None
+    if output_file_path:
+        try:
+            version = utils.file_version(output_file_path)
+        except OSError:
+            # removed since the job finished: cache invalidation, a rerun or manual cleanup
+            response = {
+                'status': 'error',
+                'message': 'Result file no longer exists, run detection again',
+                'error_code': 404
+            }
+            return jsonify(response), 404
+    
+    response = {
+        'status': 'success',
+        'message': 'Get job result success',
+        'data': {
+            'job_id': job.id,
+            'id': job.video_id,
+            'violation_type': job.violation_type,
+            'filename': os.path.basename(output_file_path) if output_file_path else None,
+            'output_file_path': output_file_path.replace('\\', '/').replace(app_config, '') if output_file_path else None,
+            'version': version,
+            'summary': summarize_for_response(job.summary, app_config),
+            'profile': {name: path.replace('\\', '/').replace(app_config, '') for name, path in profile.items()} if profile else None
+        }
+    }
+    return jsonify(response), 200
+
+def summarize_for_response(summary, app_config):
+    if not summary:
+        return summary
+    
+    events = [
+        {**event, 'file_path': event['file_path'].replace('\\', '/').replace(app_config, '') if event['file_path'] else None}
+        for event in summary['events']
+    ]
+    return {**summary, 'events': events}
+
+def parse_violation_query():
+    types = request.args.get('type')
+    categories = [category.strip() for category in types.split(',') if category.strip()] if types else None
+    if categories and any(category not in VIOLATION_CATEGORIES for category in categories):
+        raise ValueError(f"type must be one of {', '.join(VIOLATION_CATEGORIES)}")
+    
+    try:
+        start_time = float(request.args['start']) if request.args.get('start') else None
+        end_time = float(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        raise ValueError("start and end must be video times in seconds")
+    
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', DEFAULT_VIOLATIONS_PER_PAGE))
+    except ValueError:
+        raise ValueError("page and per_page must be integers")
+    if page < 1 or not 1 <= per_page <= MAX_VIOLATIONS_PER_PAGE:
+        raise ValueError(f"page must be at least 1 and per_page between 1 and {MAX_VIOLATIONS_PER_PAGE}")
+    
+    return categories, start_time, end_time, page, per_page
+
 def get_captured_violations_controller(app_config, utils):
     idx = request.args.get('id')
     
     if not idx:
         return jsonify(NO_ID_ERROR), 400
     
-    result = utils.get_captured_violations(app_config, idx)
+    try:
+        categories, start_time, end_time, page, per_page = parse_violation_query()
+    except ValueError as e:
+        response = {
+            'status': 'error',
+            'message': str(e),
+            'error_code': 400
+        }
+        return jsonify(response), 400
+    
+    # the manifest version changes on every write, so a matching tag means nothing to re-read
+    version = utils.captured_violations_version(idx)
+    etag = hashlib.md5(f"{idx}:{version}:{categories}:{start_time}:{end_time}:{page}:{per_page}".encode()).hexdigest()
+    if version and request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+    
+    result = utils.get_captured_violations(app_config, idx, categories, start_time, end_time, page, per_page)
     
     if result:
         response = {
@@ -137,10 +479,18 @@ def get_captured_violations_controller(app_config, utils):
             'message': 'Get captured violations success',
             'data': {
                 'id': idx,
-                'violations': result
+                'violations': result['violations'],
+                'pagination': {
+                    'page': page,
+                    'per_page': per_page,
+                    'total': result['total']
+                }
             }
         }
-        return jsonify(response), 201
+        response = make_response(jsonify(response), 200)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     
     response = {
         'status': 'error',
@@ -149,7 +499,7 @@ def get_captured_violations_controller(app_config, utils):
     }
     return jsonify(response), 404
 
-def get_file(app_config):
+def get_file(app_config, utils):
     filename = request.args.get('file')
     
     if not filename:
@@ -159,12 +509,74 @@ def get_file(app_config):
             'error_code': 400
         }
         return jsonify(response), 400
+    
+    # paths handed out by the other endpoints start with a slash, relative to the uploads folder
+    filename = filename.lstrip('/')
+    
+    # uploads are written relative to the working directory, not the app's root path
+    upload_dir = os.path.abspath(app_config)
+    file_path = safe_join(upload_dir, filename)
     try:
-        return send_from_directory(app_config, filename)
-    except FileNotFoundError:
+        version = utils.file_version(file_path) if file_path else None
+        
+        # conditional=True answers Range with 206 and If-None-Match / If-Modified-Since with 304
+        response = send_from_directory(upload_dir, filename, conditional=True, etag=True)
+    except (NotFound, OSError):
         response = {
             'status': 'error',
             'message': 'File not found',
             'error_code': 404
         }
-        return jsonify(response), 404
\ No newline at end of file
+        return jsonify(response), 404
+    
+    # a URL pinned to the current version never changes content, anything else revalidates
+    if request.args.get('v') == version:
+        response.headers['Cache-Control'] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def invalidate_cache_controller(utils, result_cache):
+    if result_cache is None:
+        response = {
+            'status': 'error',
+            'message': 'Result cache is disabled',
+            'error_code': 400
+        }
+        return jsonify(response), 400
+    
+    # no id drops every entry, violation_type narrows it to one analysis
+    data = request.form
+    violation_type = data.get('violation_type') or None
+    if violation_type and violation_type not in ('line', 'helmet', 'all'):
+        response = {
+            'status': 'error',
+            'message': 'violation_type must be line, helmet or all',
+            'error_code': 400
+        }
+        return jsonify(response), 400
+    
+    video_hash = None
+    if data.get('id'):
+        upload = utils.index.get_upload(data['id'])
+        if not upload:
+            response = {
+                'status': 'error',
+                'message': 'Video not found',
+                'error_code': 404
+            }
+            return jsonify(response), 404
+        video_hash = result_cache.video_hash(data['id'], upload['video_path'])
+    
+    removed = result_cache.invalidate(video_hash, violation_type)
+    response = {
+        'status': 'success',
+        'message': 'Result cache invalidated',
+        'data': {'removed': removed, **result_cache.stats()}
+    }
+    return jsonify(response), 200
+
+def get_metrics_controller(registry):
+    response = make_response(registry.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
\ No newline at end of file
@@ -0,0 +1,38 @@
+import numpy as np
+from collections import namedtuple
+
+CrossingEvent = namedtuple("CrossingEvent", ["track_id", "area_index", "direction"])
+
+def ccw(a, b, c):
+    return (c[..., 1] - a[..., 1]) * (b[..., 0] - a[..., 0]) > (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0])
+
+def intersect_matrix(starts, ends, line_starts, line_ends):
+    # (tracks, areas) bool matrix: segments cross when each one's endpoints lie on opposite sides of the other
+    p1 = starts[:, None, :]
+    p2 = ends[:, None, :]
+    q1 = line_starts[None, :, :]
+    q2 = line_ends[None, :, :]
+    return (ccw(p1, q1, q2) != ccw(p2, q1, q2)) & (ccw(p1, p2, q1) != ccw(p1, p2, q2))
+
+def directions(starts, ends):
+    # image y grows downwards, so moving up the frame is North
+    return np.where(starts[:, 1] > ends[:, 1], "North", np.where(starts[:, 1] < ends[:, 1], "South", ""))
+
+def find_crossings(track_ids, starts, ends, areas):
+    if len(track_ids) == 0 or not areas:
+        return []
+    
+    starts = np.asarray(starts, dtype=np.int64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.int64).reshape(-1, 2)
+    line_starts = np.array([area["coords"][0] for area in areas], dtype=np.int64)
+    line_ends = np.array([area["coords"][1] for area in areas], dtype=np.int64)
+    
+    hits = intersect_matrix(starts, ends, line_starts, line_ends)
+    track_directions = directions(starts, ends)
+    
+    # nonzero walks the matrix row by row, so events come out in track order then area order
+    track_index, area_index = np.nonzero(hits)
+    return [
+        CrossingEvent(int(track_ids[t]), int(a), str(track_directions[t]))
+        for t, a in zip(track_index.tolist(), area_index.tolist())
+    ]
\ No newline at end of file
@@ -1,43 +1,202 @@
 import os
 import cv2
+import json
+import time
+import cProfile
 import logging
 import cvzone
 from detect_line_violation import DetectLineViolation
 from detect_helmet_violation import DetectHelmetViolation
+from detect_all_violation import DetectAllViolation
+from pipeline import FramePipeline
+from inference import resolve_settings
+from faststart import make_faststart
+from snapshot_writer import SnapshotWriter
+from stream import StreamCapture, FrameRangeCapture, SegmentWriter
+from timing import StageTimer, NULL_TIMER
+from metrics import DetectionMetrics
 
 logger = logging.getLogger(__name__)
 
-def start_detection(file_dir, video_input_path, violation_type):
-    capture = cv2.VideoCapture(video_input_path)
+# how often (in written frames) pipeline stats are reported while a video runs
+STATS_INTERVAL = 30
+
+# violation events a stream keeps in memory for its live summary
+STREAM_EVENT_HISTORY = 500
+
+def start_detection(file_dir, video_input_path, violation_type, progress_callback=None, batch_size=1, queue_size=8, stats_callback=None, index=None, annotate=("line", "helmet"), encode=True, calibration_cache=None, camera_id=None, jpeg_quality=95, render=True, evidence=True, summary_callback=None, inference_config=None, stop_event=None, stream=False, loop=False, segment_seconds=300, max_segments=12, drop_policy=None, timer=None, profile=False, frame_range=None, track_callback=None, shards=1, shard_workers=None, shard_initializer=None, shard_initargs=(), shard_executor=None, shard_threads=None):
+    if shards > 1 and not stream:
+        # each shard profiles its own process, there is no single profile of the run to dump
+        if profile:
+            raise ValueError("profile is not supported with shards > 1")
+        
+        # one process per time segment, merged back into a single result
+        from sharding import start_sharded_detection
+        return start_sharded_detection(
+            file_dir, video_input_path, violation_type, shards, shard_workers,
+            progress_callback=progress_callback, stats_callback=stats_callback, summary_callback=summary_callback,
+            index=index, calibration_cache=calibration_cache, camera_id=camera_id, stop_event=stop_event,
+            batch_size=batch_size, queue_size=queue_size, annotate=annotate, encode=encode, jpeg_quality=jpeg_quality,
+            render=render, evidence=evidence, inference_config=inference_config, initializer=shard_initializer, initargs=shard_initargs,
+            executor=shard_executor, threads=shard_threads
+        )
+    
+    if stream:
+        # live source: reconnects when the feed drops, drops frames rather than fall behind
+        capture = StreamCapture(video_input_path, loop=loop, cancel_event=stop_event)
+        drop_policy = drop_policy or "drop_oldest"
+    elif frame_range:
+        capture = FrameRangeCapture(video_input_path, *frame_range)
+        drop_policy = drop_policy or "block"
+    else:
+        capture = cv2.VideoCapture(video_input_path)
+        drop_policy = drop_policy or "block"
     
     fps = capture.get(cv2.CAP_PROP_FPS)
+    total_frames = 0 if stream else int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
     
     video_id = os.path.basename(file_dir)
     
     result_dir = os.path.join(file_dir, 'results')
     os.makedirs(result_dir, exist_ok=True)
     
-    if violation_type == "line":
-        output_file_path = os.path.join(result_dir, f"{video_id}_line_result.mp4")
-        detect_violation = DetectLineViolation(file_dir)
-    if violation_type == "helmet":
-        output_file_path = os.path.join(result_dir, f"{video_id}_helmet_result.mp4")
-        detect_violation = DetectHelmetViolation(file_dir)
+    # analytics only: inference, tracking and rules, no drawing and no output video
+    if not render:
+        annotate = ()
+        encode = False
     
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_file_path, fourcc, fps, (1280, 720))
-        
-    while True:
-        ret, frame = capture.read()
+    # with dropped frames a frame count no longer maps onto the source clock
+    detector_fps = None if stream else fps
+    
+    # per-model input size, thresholds and ROI, camera overrides on top of the defaults
+    inference_settings = resolve_settings(inference_config, camera_id)
+    
+    # per-stage timings and counters, also exported on /metrics
+    timer = timer or StageTimer(DetectionMetrics(violation_type))
+    
+    # violation snapshots are cropped here and encoded on a small thread pool
+    snapshot_writer = SnapshotWriter(jpeg_quality=jpeg_quality, timer=timer)
+    
+    output_file_path = os.path.join(result_dir, f"{video_id}_{violation_type}_result.mp4")
+    detect_violation = create_detector(violation_type, file_dir, index, calibration_cache, camera_id, snapshot_writer, detector_fps, render, evidence, inference_settings, annotate, timer)
+    
+    if violation_type == "all":
+        # nothing to draw means nothing worth encoding
+        encode = encode and bool(annotate)
+    
+    if stream:
+        detect_violation.keep_recent_events(STREAM_EVENT_HISTORY)
+    
+    if track_callback:
+        detect_violation.set_track_callback(track_callback)
+    
+    if encode and stream:
+        # rolling segments instead of one endless mp4, the newest closed one is the current result
+        prefix = os.path.splitext(os.path.basename(output_file_path))[0]
+        on_segment = (lambda path: index.add_result(video_id, violation_type, path)) if index else None
+        out = SegmentWriter(result_dir, prefix, fps, segment_seconds=segment_seconds, max_segments=max_segments, on_segment=on_segment)
+    elif encode:
+        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+        out = cv2.VideoWriter(output_file_path, fourcc, fps, (1280, 720))
+    else:
+        output_file_path = None
+        out = None
+    
+    def process_batch(frames):
+        # one model call for the whole batch, rules and tracking still run frame by frame in order
+        batch_results = detect_violation.infer_batch(frames) if batch_size > 1 else None
         
-        if not ret:
-            logger.error("Failed to open frame")
-            break
+        for i, frame in enumerate(frames):
+            results = batch_results[i] if batch_results else None
+            start = time.perf_counter()
+            processed_frame = process_frame(detect_violation, violation_type, frame, results, annotate)
+            timer.record("frame", time.perf_counter() - start)
+            timer.count("frames")
+            yield processed_frame
+    
+    def on_frame_written(processed_frames):
+        if progress_callback:
+            progress_callback(processed_frames, total_frames)
+        if stats_callback and processed_frames % STATS_INTERVAL == 0:
+            stats_callback(pipeline.stats())
+        if stream and summary_callback and processed_frames % STATS_INTERVAL == 0:
+            summary_callback(detect_violation.summary())
+    
+    # decode and encode run on their own threads, inference and annotation stay on this one
+    pipeline = FramePipeline(capture, out, batch_size=batch_size, queue_size=queue_size, on_frame_written=on_frame_written, drop_policy=drop_policy, cancel_event=stop_event, timer=timer)
+    
+    # optional cProfile of the processing thread, where inference, tracking and rules run
+    profiler = cProfile.Profile() if profile else None
+    try:
+        if profiler:
+            profiler.enable()
+        pipeline.run(process_batch)
+    finally:
+        if profiler:
+            profiler.disable()
+        capture.release()
+        if out is not None:
+            out.release()
         
-        frame = cv2.resize(frame, (1280, 720))
+        # every pending snapshot is on disk before the result is reported
+        snapshot_writer.close()
+    
+    if snapshot_writer.errors:
+        # events and index rows would point at evidence that isn't on disk, so the run fails
+        # and its violations are dropped rather than reported, indexed or cached
+        if index:
+            index.clear_violations(video_id, list(detect_violation.summary()["counters"]))
+        raise IOError(f"{len(snapshot_writer.errors)} violation snapshots failed to write, first: {snapshot_writer.errors[0]}")
+    
+    pipeline_stats = pipeline.stats()
+    pipeline_stats["stages"] = timer.summary()
+    if profiler:
+        pipeline_stats["profile"] = dump_profile(profiler, timer, pipeline_stats, os.path.join(result_dir, f"{video_id}_{violation_type}_profile"))
+    logger.info(f"Pipeline stats: {pipeline_stats}")
+    if stats_callback:
+        stats_callback(pipeline_stats)
+    
+    if summary_callback:
+        summary_callback(detect_violation.summary())
+    
+    if stream and out is not None:
+        # segments are finalized and indexed as they close
+        return out.path
+    
+    if output_file_path:
+        make_faststart(output_file_path)
+    
+    if index and output_file_path:
+        index.add_result(video_id, violation_type, output_file_path)
+    
+    return output_file_path
+
+def dump_profile(profiler, timer, pipeline_stats, path_prefix):
+    # <prefix>.prof loads in pstats/snakeviz, <prefix>.json holds the stage timings and counters of the run
+    profiler.dump_stats(f"{path_prefix}.prof")
+    with open(f"{path_prefix}.json", "w") as f:
+        json.dump({"stages": timer.summary(), "counters": getattr(timer, "counters", {}), "pipeline": pipeline_stats}, f, indent=2)
+    
+    logger.info(f"Profile written to {path_prefix}.prof")
+    return {"stats": f"{path_prefix}.prof", "summary": f"{path_prefix}.json"}
+
+def create_detector(violation_type, file_dir, index=None, calibration_cache=None, camera_id=None, snapshot_writer=None, fps=None, render=True, evidence=True, inference_settings=None, annotate=("line", "helmet"), timer=None):
+    timer = timer or NULL_TIMER
+    if violation_type == "line":
+        return DetectLineViolation(file_dir, index, calibration_cache, camera_id, snapshot_writer, fps, render, evidence, inference_settings, timer)
+    if violation_type == "helmet":
+        return DetectHelmetViolation(file_dir, index, snapshot_writer, fps, render, evidence, inference_settings, timer)
+    if violation_type == "all":
+        return DetectAllViolation(file_dir, index, calibration_cache, camera_id, snapshot_writer, fps, annotate, evidence, inference_settings, timer)
+    raise ValueError(f"Unknown violation type: {violation_type}")
+
+def process_frame(detect_violation, violation_type, frame, results=None, annotate=("line", "helmet")):
+    if violation_type == "line":
+        processed_frame = detect_violation.start_detect(frame, results)
+        if not detect_violation.render:
+            return processed_frame
         
-        if violation_type == "line":
-            processed_frame = detect_violation.start_detect(frame)
+        with detect_violation.timer.stage("draw"):
             draw_detected_areas(processed_frame, detect_violation.area)
             if detect_violation.crosswalk_dir_check:
                 if detect_violation.traffic_light_status == "Red":
@@ -47,17 +206,29 @@ def start_detection(file_dir, video_input_path, violation_type):
                 else:
                     box_color = (0, 0, 0)
                 cvzone.putTextRect(processed_frame, f"Traffic light status: {detect_violation.traffic_light_status}, L: {detect_violation.traffic_light_violator_counter}, W: {detect_violation.wrong_way_violator_counter}", (25, 60), scale=1, thickness=1, offset=3, colorR=box_color)
+    
+    if violation_type == "helmet":
+        processed_frame = detect_violation.start_detect(frame, results)
+        if not detect_violation.render:
+            return processed_frame
         
-        if violation_type == "helmet":
-            processed_frame = detect_violation.start_detect(frame)
+        with detect_violation.timer.stage("draw"):
             cvzone.putTextRect(processed_frame, f"Violation Counter: {detect_violation.helmet_violation_counter}", (25, 60), scale=1, thickness=1, offset=3)
-        
-        out.write(processed_frame)
     
-    capture.release()
-    out.release()
+    if violation_type == "all":
+        line_results, helmet_results = detect_violation.infer(frame, results)
+        
+        line_frame = process_frame(detect_violation.line, "line", frame, line_results)
+        processed_frame = line_frame if "line" in annotate else frame
+        
+        # the helmet detector draws on its own copy, so a skipped analysis leaves no marks
+        helmet_frame = detect_violation.helmet.start_detect(processed_frame, helmet_results)
+        if "helmet" in annotate:
+            processed_frame = helmet_frame
+            with detect_violation.timer.stage("draw"):
+                cvzone.putTextRect(processed_frame, f"Helmet Violation Counter: {detect_violation.helmet.helmet_violation_counter}", (25, 140), scale=1, thickness=1, offset=3)
     
-    return output_file_path
+    return processed_frame
 
 def draw_detected_areas(frame, areas):
     if areas:
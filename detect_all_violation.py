@@ -0,0 +1,48 @@
+import logging
+from detect_line_violation import DetectLineViolation
+from detect_helmet_violation import DetectHelmetViolation
+from timing import NULL_TIMER
+
+logger = logging.getLogger(__name__)
+
+class DetectAllViolation:
+    def __init__(self, file_dir, index=None, calibration_cache=None, camera_id=None, snapshot_writer=None, fps=None, annotate=("line", "helmet"), evidence=True, inference_settings=None, timer=NULL_TIMER):
+        # both analyses share the decoded frame, each keeps its own tracker and violation folder
+        # and only draws when it is annotated on the output
+        self.line = DetectLineViolation(file_dir, index, calibration_cache, camera_id, snapshot_writer, fps, "line" in annotate, evidence, inference_settings, timer)
+        self.helmet = DetectHelmetViolation(file_dir, index, snapshot_writer, fps, "helmet" in annotate, evidence, inference_settings, timer)
+        self.timer = timer
+    
+    def infer_batch(self, frames):
+        line_results = self.line.infer_batch(frames)
+        helmet_results = self.helmet.infer_batch(frames)
+        
+        return [(line_results[i] if line_results else None, helmet_results[i]) for i in range(len(frames))]
+    
+    def infer(self, frame, results=None):
+        line_results, helmet_results = results if results else (None, None)
+        
+        # helmet inference always sees the clean frame, never the line annotations
+        if helmet_results is None:
+            helmet_results = self.helmet.helmet_model(frame.copy())
+        
+        return line_results, helmet_results
+    
+    def set_track_callback(self, callback):
+        self.line.track_callback = callback
+        self.helmet.track_callback = callback
+    
+    def keep_recent_events(self, max_events):
+        self.line.keep_recent_events(max_events)
+        self.helmet.keep_recent_events(max_events)
+    
+    def summary(self):
+        line_summary = self.line.summary()
+        helmet_summary = self.helmet.summary()
+        
+        return {
+            "counters": {**line_summary["counters"], **helmet_summary["counters"]},
+            "traffic_light_status": line_summary["traffic_light_status"],
+            "areas": line_summary["areas"],
+            "events": sorted(line_summary["events"] + helmet_summary["events"], key=lambda event: event["frame_index"])
+        }
\ No newline at end of file
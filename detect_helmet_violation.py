@@ -2,27 +2,53 @@ import os
 import cv2
 import logging
 import cvzone
-import numpy as np
-from datetime import datetime
-from sort import Sort
-from model import load_model
+from collections import deque
+from detections import Detections
+from tracker import Tracker
+from inference import ModelRunner
+from timing import NULL_TIMER
+from frame_log import FrameLog
+from model import get_model, HELMET_MODEL_PATH
 
 logger = logging.getLogger(__name__)
 
 class DetectHelmetViolation:
-    def __init__(self, file_dir):
-        # Load custom trained model
-        self.helmet_model = load_model("./model/helm_test_best50.pt")
+    def __init__(self, file_dir, index=None, snapshot_writer=None, fps=None, render=True, evidence=True, inference_settings=None, timer=NULL_TIMER):
+        # Borrow custom trained model from the process-wide registry, run with its own settings
+        self.helmet_model = ModelRunner(get_model(HELMET_MODEL_PATH), (inference_settings or {}).get("helmet"), timer)
+        
+        # per-stage timings for benchmarks, a no-op unless a StageTimer is passed in
+        self.timer = timer
+        
+        # sampled per-frame debug records, formatted only when emitted
+        self.frame_log = FrameLog(logger)
+        
+        # called with (tracker name, frame index, tracker results) after every tracker update
+        self.track_callback = None
         
         # Initialize tracker
-        self.tracker = Sort(max_age=180, min_hits=3, iou_threshold=0.3)
+        self.tracker = Tracker(max_age=180, min_hits=3, iou_threshold=0.3)
         
-        # Initialize list of violator ID & counter
+        # Initialize set of violator ID & counter
         self.helmet_violation_counter = 0
-        self.helmet_violator_id_list = []
+        self.helmet_violator_id_list = set()
+        
+        # Position in the video, advanced at the top of start_detect
+        self.frame_index = -1
+        self.fps = fps
+        
+        # render=False keeps only inference, tracking and rules, evidence=False skips the crops
+        self.render = render
+        self.evidence = evidence
+        self.events = []
         
         self.file_dir = file_dir
+        self.index = index
+        self.snapshot_writer = snapshot_writer
         self.create_folder()
+        
+        if self.index:
+            self.index.clear_violations(os.path.basename(self.file_dir), ['helmet'])
     
     def create_folder(self):
         self.traffic_violation_dir = os.path.join(self.file_dir, 'traffic_violation')
@@ -30,58 +56,55 @@ class DetectHelmetViolation:
         self.helmet_violation_dir = os.path.join(self.traffic_violation_dir, 'helmet')
         os.makedirs(self.helmet_violation_dir, exist_ok=True)
     
-    def start_detect(self, frame):
-        processed_frame = self.detect_object(frame.copy())
+    def start_detect(self, frame, results=None):
+        self.frame_index += 1
+        processed_frame = self.detect_object(frame.copy() if self.render else frame, results)
         return processed_frame
     
-    def detect_object(self, frame):
-        results = self.helmet_model(frame.copy())
-        objects = results.pandas().xyxy[0]
+    def infer_batch(self, frames):
+        # split the batched Detections back into single-image results, in frame order
+        return self.helmet_model(frames).tolist()
+    
+    def detect_object(self, frame, results=None):
+        if results is None:
+            results = self.helmet_model(frame.copy())
+        with self.timer.stage("parse"):
+            objects = Detections(results)
+            
+            # Use YOLO bounding box
+            # yolo_processed_frame = results.render()[0]
+            
+            rider_detections, no_helmet_detections = self.get_detections(objects)
+        
+        with self.timer.stage("track"):
+            tracker_results = self.tracker.update(rider_detections)
         
-        # Use YOLO bounding box
-        # yolo_processed_frame = results.render()[0]
+        self.timer.count("detections", len(objects))
+        self.timer.count("tracks", len(tracker_results))
         
-        rider_detections, no_helmet_detections = self.get_detections(objects)
-        tracker_results = self.tracker.update(rider_detections)
+        if self.track_callback:
+            self.track_callback("helmet", self.frame_index, tracker_results)
         
-        logger.info(f"Rider Detection : \n{rider_detections}\n")
-        logger.info(f"No-helm Detection : \n{no_helmet_detections}\n")
-        logger.info(f"Tracker Results : \n{tracker_results}\n")
+        self.frame_log.debug(self.frame_index, "helmet.detections", riders=rider_detections, no_helmet=no_helmet_detections, tracks=tracker_results)
         
-        processed_frame = self.draw_bounding_box(frame.copy(), tracker_results)
-        processed_frame = self.check_helmet_violation(processed_frame, tracker_results, no_helmet_detections)
+        if self.render:
+            with self.timer.stage("draw"):
+                processed_frame = self.draw_bounding_box(frame.copy(), tracker_results)
+        else:
+            processed_frame = frame
+        
+        with self.timer.stage("rules"):
+            processed_frame = self.check_helmet_violation(processed_frame, tracker_results, no_helmet_detections)
+            self.evict_dropped_tracks()
         
         return processed_frame
-
+    
     def get_detections(self, objects):
-        rider_detections = np.empty((0, 5))
-        no_helmet_detections = np.empty((0, 5))
-        
-        for _, row in objects.iterrows():
-            xmin = int(row["xmin"])
-            ymin = int(row["ymin"])
-            xmax = int(row["xmax"])
-            ymax = int(row["ymax"])
-            confidence = float(f"{row['confidence']:.2f}")
-            class_id = int(row["class"])
-            name = row["name"]
-            
-            if confidence >= 0.7 and class_id == 2:
-                logger.info(f"Class: ({class_id}){name}")
-                logger.info(f"Confidence: {confidence}\n")
-                
-                coordinate_list = np.array([xmin, ymin, xmax, ymax, confidence])
-                rider_detections = np.vstack([rider_detections, coordinate_list])
-            
-            if confidence >= 0.8 and class_id == 1:
-                logger.info(f"Class: ({class_id}){name}")
-                logger.info(f"Confidence: {confidence}\n")
-                
-                coordinate_list = np.array([xmin, ymin, xmax, ymax, confidence])
-                no_helmet_detections = np.vstack([no_helmet_detections, coordinate_list])
+        rider_detections = objects.select("rider")
+        no_helmet_detections = objects.select("no_helmet")
         
         return rider_detections, no_helmet_detections
-
+    
     def draw_bounding_box(self, frame, tracker_results):
         for result in tracker_results:
             xmin, ymin, xmax, ymax, idx = map(int, result)
@@ -101,29 +124,76 @@ class DetectHelmetViolation:
                 if rxmin <= cx <= rxmax and rymin <= cy <= rymax:
                     if idx not in self.helmet_violator_id_list:
                         self.helmet_violation_counter += 1
-                        self.helmet_violator_id_list.append(idx)
-                        cv2.rectangle(frame, (rxmin, rymin), (rxmax, rymax), (0, 0, 255), 2)
-                        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 0, 255), 2)
-                        self.capture_violation(frame.copy(), (rxmin, rymin, rxmax, rymax))
-                        logger.info(f"Helmet violation detected! Rider ID: {idx}\nTotal Violations: {self.helmet_violation_counter}\nViolator list: {self.helmet_violator_id_list}\n")
-    
-            
+                        self.helmet_violator_id_list.add(idx)
+                        if self.render:
+                            with self.timer.stage("draw"):
+                                cv2.rectangle(frame, (rxmin, rymin), (rxmax, rymax), (0, 0, 255), 2)
+                                cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 0, 255), 2)
+                        with self.timer.stage("capture"):
+                            self.capture_violation(frame, (rxmin, rymin, rxmax, rymax), idx)
+                        logger.info("Helmet violation: rider %d at frame %d, total %d", idx, self.frame_index, self.helmet_violation_counter, extra={"event": "violation.helmet", "frame_index": self.frame_index, "track_id": idx})
+        
+        
         return frame
     
-    def capture_violation(self, frame, bbox, padding = 20):
+    def evict_dropped_tracks(self):
+        # the tracker never reuses an id, so a dropped rider can't violate again under the same id
+        self.helmet_violator_id_list.difference_update(self.tracker.pop_ended())
+    
+    def capture_violation(self, frame, bbox, track_id, padding = 20):
         rxmin, rymin, rxmax, rymax = bbox
         xmin = max(rxmin - padding, 0)
         ymin = max(rymin - padding, 0)
         xmax = min(rxmax + padding, frame.shape[1])
         ymax = min(rymax + padding, frame.shape[0])
         
-        timestamp = datetime.now().strftime("%H.%M.%S")
-        
+        # a rider is captured at most once, so frame + track id never collide
         violation_directory = self.helmet_violation_dir
-        image_filename = f"{timestamp}_{self.helmet_violation_counter}.jpg"
-            
+        image_filename = f"{self.frame_index:06d}_{track_id}.jpg"
+        
         image_output_path = os.path.join(violation_directory, image_filename)
-        cropped_frame = frame[ymin:ymax, xmin:xmax]
-        cv2.imwrite(image_output_path, cropped_frame)
+        if not self.evidence:
+            image_output_path = None
+        elif self.snapshot_writer:
+            # encoding and disk I/O happen off the detection thread
+            self.snapshot_writer.submit(frame, (xmin, ymin, xmax, ymax), image_output_path)
+        else:
+            cropped_frame = frame[ymin:ymax, xmin:xmax]
+            cv2.imwrite(image_output_path, cropped_frame)
+        
+        event = {
+            "category": "helmet",
+            "track_id": int(track_id),
+            "frame_index": self.frame_index,
+            "video_time": round(self.frame_index / self.fps, 3) if self.fps else None,
+            "bbox": [int(v) for v in bbox],
+            "traffic_light": None,
+            "file_path": image_output_path
+        }
+        self.events.append(event)
+        self.timer.count("violations", category=event["category"])
         
-        logger.info("Violation captured!")
\ No newline at end of file
+        if self.index:
+            self.index.add_violation(
+                os.path.basename(self.file_dir), 'helmet', image_output_path or "",
+                filename=image_filename,
+                track_id=event["track_id"],
+                frame_index=event["frame_index"],
+                video_time=event["video_time"],
+                bbox=event["bbox"]
+            )
+    
+    def summary(self):
+        return {
+            "counters": {
+                "helmet": self.helmet_violation_counter
+            },
+            "events": list(self.events)
+        }
+    
+    def set_track_callback(self, callback):
+        self.track_callback = callback
+    
+    def keep_recent_events(self, max_events):
+        # long-running streams keep only the newest events in memory, the index keeps them all
+        self.events = deque(self.events, maxlen=max_events)
\ No newline at end of file
@@ -3,25 +3,43 @@ import cv2
 import logging
 import cvzone
 import numpy as np
-from datetime import datetime
-from sort import Sort
-from model import load_model
+from collections import deque
+from crossing import find_crossings
+from detections import Detections
+from tracker import Tracker
+from inference import ModelRunner
+from timing import NULL_TIMER
+from frame_log import FrameLog
+from model import get_model, LINE_MODEL_PATH, CROSSWALK_MODEL_PATH
 
 logger = logging.getLogger(__name__)
 
+# trail points kept per track for drawing and direction
+TRAIL_LENGTH = 32
+
 class DetectLineViolation:
-    def __init__(self, file_dir):
-        # Load custom trained model
-        self.line_model = load_model("./model/line_test_best100.pt")
-        self.crosswalk_model = load_model("./model/yolov5_crosswalk_best50.pt")
+    def __init__(self, file_dir, index=None, calibration_cache=None, camera_id=None, snapshot_writer=None, fps=None, render=True, evidence=True, inference_settings=None, timer=NULL_TIMER):
+        # Borrow custom trained models from the process-wide registry, each run with its own settings
+        inference_settings = inference_settings or {}
+        self.line_model = ModelRunner(get_model(LINE_MODEL_PATH), inference_settings.get("line"), timer)
+        self.crosswalk_model = ModelRunner(get_model(CROSSWALK_MODEL_PATH), inference_settings.get("crosswalk"), timer)
+        
+        # per-stage timings for benchmarks, a no-op unless a StageTimer is passed in
+        self.timer = timer
+        
+        # sampled per-frame debug records, formatted only when emitted
+        self.frame_log = FrameLog(logger)
+        
+        # called with (tracker name, frame index, tracker results) after every tracker update
+        self.track_callback = None
         
         # Initialize tracker
-        self.tracker = Sort(max_age=180, min_hits=3, iou_threshold=0.3)
+        self.tracker = Tracker(max_age=180, min_hits=3, iou_threshold=0.3)
         
         # Initialize area for boundary detection
         self.area = []
         
-        # Initialize trails dictionary
+        # Initialize trails dictionary, one fixed-size ring buffer per live track
         self.trails = {}
         
         # initialize crosswalk direction check flag
@@ -30,18 +48,38 @@ class DetectLineViolation:
         # initialize traffic light status
         self.traffic_light_status = "Unknown"
         
-        # Initialize list of violator ID & counter
-        self.traffic_light_violator_list = []
+        # Initialize set of violator ID & counter
+        self.traffic_light_violator_list = set()
         self.traffic_light_violator_counter = 0
-        self.wrong_way_violator_list = []
+        self.wrong_way_violator_list = set()
         self.wrong_way_violator_counter = 0
         
-        # Initialize list of clear vehicle
-        self.traffic_light_clear_list = []
+        # Initialize set of clear vehicle
+        self.traffic_light_clear_list = set()
+        
+        # Calibration cache for fixed cameras, looked up on the first frame
+        self.calibration_cache = calibration_cache
+        self.camera_id = camera_id
+        self.scene_fingerprint = None
+        self.calibration_loaded = False
+        
+        # Position in the video, advanced at the top of start_detect
+        self.frame_index = -1
+        self.fps = fps
+        
+        # render=False keeps only inference, tracking and rules, evidence=False skips the crops
+        self.render = render
+        self.evidence = evidence
+        self.events = []
         
         self.file_dir = file_dir
+        self.index = index
+        self.snapshot_writer = snapshot_writer
         self.create_folder()
         
+        if self.index:
+            self.index.clear_violations(os.path.basename(self.file_dir), ["traffic_line", "wrong_way"])
+    
     def create_folder(self):
         self.traffic_violation_dir = os.path.join(self.file_dir, 'traffic_violation')
         os.makedirs(self.traffic_violation_dir, exist_ok=True)
@@ -51,22 +89,61 @@ class DetectLineViolation:
         
         os.makedirs(self.traffic_line_violation_dir, exist_ok=True)
         os.makedirs(self.wrong_way_violation_dir, exist_ok=True)
+    
+    def start_detect(self, frame, results=None):
+        self.frame_index += 1
+        self.check_calibration_cache(frame)
         
-    def start_detect(self, frame):
         if not self.area:
-            logger.info("=== Detecting crosswalk boundary ===")
+            self.frame_log.debug(self.frame_index, "calibration.searching")
             
-            trapezoid_frame = self.crop_to_trapezoid(frame.copy())
-            processed_frame = self.check_crosswalk(trapezoid_frame, frame.copy())
+            processed_frame = self.check_crosswalk(frame, frame.copy() if self.render else frame)
             
-            cvzone.putTextRect(processed_frame, "Detecting Crosswalk Boundary...", (10, 10), scale=1, thickness=1)
+            if self.render:
+                with self.timer.stage("draw"):
+                    cvzone.putTextRect(processed_frame, "Detecting Crosswalk Boundary...", (10, 10), scale=1, thickness=1)
             
             return processed_frame
         else:
-            processed_frame = self.detect_object(frame.copy())
+            processed_frame = self.detect_object(frame.copy() if self.render else frame, results)
             return processed_frame
     
-    def crop_to_trapezoid(self, frame):
+    def check_calibration_cache(self, frame):
+        if self.calibration_cache is None or self.scene_fingerprint is not None:
+            return
+        
+        self.scene_fingerprint = self.calibration_cache.fingerprint(frame)
+        entry = self.calibration_cache.lookup(self.scene_fingerprint, self.camera_id)
+        if entry:
+            # known scene: reuse the areas and directions and start enforcing from this frame
+            self.area = [
+                {
+                    "coords": np.array(area["coords"], dtype=np.int32),
+                    "north_count": area["north_count"],
+                    "south_count": area["south_count"],
+                    "status_dir": area["status_dir"],
+                    "counted_idx": set()
+                }
+                for area in entry["areas"]
+            ]
+            self.crosswalk_dir_check = True
+            self.calibration_loaded = True
+            logger.info("Crosswalk calibration loaded from cache (%s)", entry["key"], extra={"event": "calibration.cached", "frame_index": self.frame_index})
+    
+    def save_calibration(self):
+        if self.calibration_cache is None or self.scene_fingerprint is None or self.calibration_loaded:
+            return
+        self.calibration_cache.store(self.scene_fingerprint, self.area, self.camera_id)
+    
+    def infer_batch(self, frames):
+        self.check_calibration_cache(frames[0])
+        
+        # calibration picks the model input per frame, so only batch once the areas are known
+        if not self.area:
+            return None
+        return self.line_model(frames).tolist()
+    
+    def trapezoid_roi(self, frame):
         height, width = frame.shape[:2]
         region_of_interest_vertices = [
             (0, height),
@@ -75,139 +152,110 @@ class DetectLineViolation:
             (width, height)
         ]
         
-        mask = np.zeros((height, width), dtype=np.uint8)
-        
-        cv2.fillPoly(mask, np.array([region_of_interest_vertices], np.int32), 255)
-        masked_frame = cv2.bitwise_and(frame, frame, mask=mask)
-        
-        return masked_frame
+        return np.array(region_of_interest_vertices, np.int32)
     
-    def check_crosswalk(self, crop_frame, real_frame):
-        results = self.line_model(crop_frame)
-        objects = results.pandas().xyxy[0]
-        processed_frame = results.render()[0]
+    def check_crosswalk(self, frame, real_frame):
+        # only the road trapezoid is sent through the model, cropped to its bounding rect
+        results = self.line_model(frame, roi=self.trapezoid_roi(frame))
+        objects = Detections(results)
+        processed_frame = results.render()[0] if self.render else real_frame
         
-        logger.info(f"Detected objects : \n{objects}\n")
+        self.frame_log.debug(self.frame_index, "calibration.road", objects=objects.to_array)
         
-        if objects is None or len(objects) == 0:
-            logger.info("=== Road is clear ===")
+        if len(objects) == 0:
+            self.frame_log.debug(self.frame_index, "calibration.road_clear")
             processed_frame = self.detect_crosswalk(real_frame)
         
         return processed_frame
     
     def detect_crosswalk(self, frame):
         results = self.crosswalk_model(frame.copy())
-        objects = results.pandas().xyxy[0]
-        
-        for _, row in objects.iterrows():
-            xmin = int(row["xmin"])
-            ymin = int(row["ymin"])
-            xmax = int(row["xmax"])
-            ymax = int(row["ymax"])
-            confidence = float(f"{row['confidence']:.2f}")
-            class_id = int(row["class"])
-            name = row["name"]
+        objects = Detections(results)
+        mask = objects.mask("crosswalk")
+        
+        for (xmin, ymin, xmax, ymax), confidence, class_id in zip(objects.boxes[mask].tolist(), objects.confidences[mask].tolist(), objects.class_ids[mask].tolist()):
+            cy = (ymin + ymax) // 2
             
-            if confidence >= 0.5:
-                cy = (ymin + ymax) // 2
-                
-                self.area.append({
-                    "coords": np.array([
-                        [xmin, cy],
-                        [xmax, cy]
-                    ], dtype=np.int32),
-                    "north_count": 0,
-                    "south_count": 0,
-                    "status_dir": "Undefined",
-                    "counted_idx": set()
-                })
-                
-                logger.info(f"Class: ({class_id}){name}")
-                logger.info(f"Confidence: {confidence}")
-                logger.info(f"\nDetected Crosswalk: \n{self.area}\n")
-                
-                cv2.circle(frame, (xmin, cy), 5, (0, 0, 255), -1)
-                cv2.circle(frame, (xmax, cy), 5, (0, 0, 255), -1)
-                
+            self.area.append({
+                "coords": np.array([
+                    [xmin, cy],
+                    [xmax, cy]
+                ], dtype=np.int32),
+                "north_count": 0,
+                "south_count": 0,
+                "status_dir": "Undefined",
+                "counted_idx": set()
+            })
+            
+            logger.info("Crosswalk detected at frame %d: class %s (%d), confidence %.2f, line %s", self.frame_index, objects.name(class_id), class_id, confidence, self.area[-1]["coords"].tolist(), extra={"event": "calibration.crosswalk", "frame_index": self.frame_index})
+            
+            if not self.render:
+                continue
+            
+            cv2.circle(frame, (xmin, cy), 5, (0, 0, 255), -1)
+            cv2.circle(frame, (xmax, cy), 5, (0, 0, 255), -1)
+        
         return frame
     
-    def detect_object(self, frame):
+    def detect_object(self, frame, line_results=None):
         # line model detection
-        line_results = self.line_model(frame.copy())
-        line_objects = line_results.pandas().xyxy[0]
+        if line_results is None:
+            line_results = self.line_model(frame.copy())
+        with self.timer.stage("parse"):
+            line_objects = Detections(line_results)
+            detections = self.set_tracker(line_objects)
         
-        detections = self.set_tracker(line_objects)
-        tracker_results = self.tracker.update(detections)
+        with self.timer.stage("track"):
+            tracker_results = self.tracker.update(detections)
         
-        logger.info(f"Detection : \n{detections}\n")
-        logger.info(f"Tracker Results : \n{tracker_results}\n")
+        self.timer.count("detections", len(line_objects))
+        self.timer.count("tracks", len(tracker_results))
         
-        # check traffic light status
-        frame = self.check_traffic_light_status(line_objects, frame)
+        if self.track_callback:
+            self.track_callback("line", self.frame_index, tracker_results)
         
-        processed_frame = self.draw_bounding_box(frame, tracker_results)
+        self.frame_log.debug(self.frame_index, "line.detections", vehicles=detections, tracks=tracker_results)
+        
+        # check traffic light status, drawing inside the rules is timed on its own
+        with self.timer.stage("rules"):
+            frame = self.check_traffic_light_status(line_objects, frame)
+            processed_frame = self.draw_bounding_box(frame, tracker_results)
         
         return processed_frame
     
     def set_tracker(self, objects):
-        detections = np.empty((0, 5)) # Initialize empty array
-        
-        for _, row in objects.iterrows():
-            xmin = int(row["xmin"])
-            ymin = int(row["ymin"])
-            xmax = int(row["xmax"])
-            ymax = int(row["ymax"])
-            confidence = float(f"{row['confidence']:.2f}")
-            class_id = int(row["class"])
-            name = row["name"]
-            
-            if confidence >= 0.5 and (class_id == 0 or class_id == 1):
-                logger.info(f"Class: ({class_id}){name}")
-                logger.info(f"Confidence: {confidence}\n")
-                
-                coordinate_list = np.array([xmin, ymin, xmax, ymax, confidence])
-                detections = np.vstack([detections, coordinate_list])
-        
-        return detections
+        return objects.select("vehicle")
     
     def check_traffic_light_status(self, objects, frame):
         if self.crosswalk_dir_check:
             green_count, red_count, green_confidence_sum, red_confidence_sum, frame = self.count_traffic_lights(objects, frame)
             self.update_traffic_light_status(green_count, red_count, green_confidence_sum, red_confidence_sum)
-            logger.info(f"Traffic Light Status: {self.traffic_light_status}")
-            cvzone.putTextRect(frame, f"G: {green_count} {green_confidence_sum}, R: {red_count} {red_confidence_sum}", (25, 100), scale=1, thickness=1, offset=3)
-
+            self.frame_log.debug(self.frame_index, "line.traffic_light", status=self.traffic_light_status, green=green_count, red=red_count)
+            if self.render:
+                with self.timer.stage("draw"):
+                    cvzone.putTextRect(frame, f"G: {green_count} {green_confidence_sum}, R: {red_count} {red_confidence_sum}", (25, 100), scale=1, thickness=1, offset=3)
+        
         return frame
     
     def count_traffic_lights(self, objects, frame):
-        green_count = 0
-        red_count = 0
-        green_confidence_sum = 0.0
-        red_confidence_sum = 0.0
-
-        for _, row in objects.iterrows():
-            xmin = int(row["xmin"])
-            ymin = int(row["ymin"])
-            xmax = int(row["xmax"])
-            ymax = int(row["ymax"])
-            confidence = float(f"{row['confidence']:.2f}")
-            class_id = int(row["class"])
-            name = row["name"]
-
-            if confidence >= 0.75:
-                if class_id == 2:
-                    green_count += 1
-                    green_confidence_sum += confidence
-                    logger.info("Green light detected")
-                    cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 255, 0), 2)
-                    cvzone.putTextRect(frame, f"{name}", (max(0, xmin), max(35, ymin)), scale=0.8, thickness=1, offset=3)
-                if class_id == 3:
-                    red_count += 1
-                    red_confidence_sum += confidence
-                    logger.info("Red light detected")
-                    cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 0, 255), 2)
-                    cvzone.putTextRect(frame, f"{name}", (max(0, xmin), max(35, ymin)), scale=0.8, thickness=1, offset=3)
-
+        green_mask = objects.mask("green_light")
+        red_mask = objects.mask("red_light")
+        
+        green_count = int(green_mask.sum())
+        red_count = int(red_mask.sum())
+        green_confidence_sum = sum(objects.confidences[green_mask].tolist(), 0.0)
+        red_confidence_sum = sum(objects.confidences[red_mask].tolist(), 0.0)
+        
+        if not self.render:
+            return green_count, red_count, green_confidence_sum, red_confidence_sum, frame
+        
+        with self.timer.stage("draw"):
+            for i in np.flatnonzero(green_mask | red_mask):
+                xmin, ymin, xmax, ymax = objects.boxes[i].tolist()
+                box_color = (0, 255, 0) if green_mask[i] else (0, 0, 255)
+                cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), box_color, 2)
+                cvzone.putTextRect(frame, f"{objects.name(objects.class_ids[i])}", (max(0, xmin), max(35, ymin)), scale=0.8, thickness=1, offset=3)
+        
         return green_count, red_count, green_confidence_sum, red_confidence_sum, frame
     
     def update_traffic_light_status(self, green_count, red_count, green_confidence_sum, red_confidence_sum):
@@ -219,119 +267,167 @@ class DetectLineViolation:
             else:
                 green_avg_confidence = green_confidence_sum / green_count
                 red_avg_confidence = red_confidence_sum / red_count
-
+                
                 if green_avg_confidence > red_avg_confidence:
                     self.traffic_light_status = "Green"
                 elif red_avg_confidence > green_avg_confidence:
                     self.traffic_light_status = "Red"
                 else:
                     self.traffic_light_status = "Unknown"
-
-                logger.info(f"Traffic detected same value, count the average confidence. Results: Green: {green_avg_confidence}, Red: {red_avg_confidence}")
+                
+                self.frame_log.debug(self.frame_index, "line.traffic_light_tie", green_confidence=green_avg_confidence, red_confidence=red_avg_confidence)
         else:
             self.traffic_light_status = "Unknown"
     
     def draw_bounding_box(self, frame, tracker_results):
+        tracks = []
         for result in tracker_results:
             xmin, ymin, xmax, ymax, idx = map(int, result)
+            trail = self.update_trails(idx, int(xmin + xmax) // 2, ymax)
+            tracks.append(((xmin, ymin, xmax, ymax), idx, trail))
+        
+        # newest movement segment of every track against every area line in one call,
+        # older segments were already tested on earlier frames
+        moving = [(idx, trail) for _, idx, trail in tracks if len(trail) >= 2]
+        events = find_crossings([idx for idx, _ in moving], [trail[-2] for _, trail in moving], [trail[-1] for _, trail in moving], self.area)
+        
+        crossings = {}
+        for event in events:
+            crossings.setdefault(event.track_id, []).append(event)
+        
+        for bbox, idx, trail in tracks:
+            xmin, ymin, xmax, ymax = bbox
             
             # calculate center of bounding box
             cx = int(xmin + xmax) // 2
             cy = int(ymin + ymax) // 2
             
-            cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (255, 0, 0), 2)
-            cv2.circle(frame, (cx, cy), 2, (255, 0, 0), -1)
-            cvzone.putTextRect(frame, f"{idx}", (max(0, xmin), max(35, ymin)), scale=0.8, thickness=1, offset=3)
+            if self.render:
+                with self.timer.stage("draw"):
+                    cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (255, 0, 0), 2)
+                    cv2.circle(frame, (cx, cy), 2, (255, 0, 0), -1)
+                    cvzone.putTextRect(frame, f"{idx}", (max(0, xmin), max(35, ymin)), scale=0.8, thickness=1, offset=3)
+                    
+                    # draw trails
+                    for i in range(1, len(trail)):
+                        thickness = int(np.sqrt(64 / float(len(trail) - i)) * 1.5)
+                        thickness = max(1, min(thickness, 10))
+                        
+                        cv2.line(frame, trail[i-1], trail[i], (255, 0, 0), thickness)
             
-            self.update_trails(idx, cx, ymax)
+            if len(trail) < 2:
+                continue
             
-            # draw trails
-            if idx in self.trails:
-                for i in range(1, len(self.trails[idx])):
-                    thickness = int(np.sqrt(64 / float(len(self.trails[idx]) - i)) * 1.5)
-                    thickness = max(1, min(thickness, 10))
-                    
-                    cv2.line(frame, self.trails[idx][i-1], self.trails[idx][i], (255, 0, 0), thickness)
-                    
+            if self.render:
+                with self.timer.stage("draw"):
                     # get object direction
-                    obj_dir = self.get_direction(self.trails[idx][i-1], self.trails[idx][i])
+                    obj_dir = self.get_direction(trail[-2], trail[-1])
                     
                     cvzone.putTextRect(frame, f"{obj_dir}", (xmax, ymin), scale=0.8, thickness=1, offset=3)
-                    
-                    if self.crosswalk_dir_check is False:
-                        for area in self.area:
-                            if area["status_dir"] == "Undefined":
-                                if self.do_lines_intersect(self.trails[idx][i-1], self.trails[idx][i], area["coords"][0], area["coords"][1]):
-                                    if idx not in area["counted_idx"]:
-                                        if obj_dir == "North":
-                                            area["north_count"] += 1
-                                        elif obj_dir == "South":
-                                            area["south_count"] += 1
-                                        
-                                        area["counted_idx"].add(idx)
-                                        
-                                        if area["north_count"] >= 5:
-                                            area["status_dir"] = "North"
-                                        elif area["south_count"] >= 5:
-                                            area["status_dir"] = "South"
-                                        
-                                        logger.info(f"Area: {area['coords']}, North Count: {area['north_count']}, South Count: {area['south_count']}, Status: {area['status_dir']}")
-
-                        if all(area["status_dir"] != "Undefined" for area in self.area):
-                            self.crosswalk_dir_check = True
-                            logger.info("All areas have defined directions.")
-                    
-                    if self.crosswalk_dir_check:
-                        for area in self.area:
-                            # check traffic light violation
-                            if area["status_dir"] == "North":
-                                if self.do_lines_intersect(self.trails[idx][i-1], self.trails[idx][i], area["coords"][0], area["coords"][1]):
-                                    if self.traffic_light_status == "Red":
-                                        if idx not in self.traffic_light_violator_list and idx not in self.traffic_light_clear_list:
-                                            cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 0, 255), 2)
-                                            cv2.circle(frame, (cx, cy), 2, (0, 0, 255), -1)
-                                            self.traffic_light_violator_list.append(idx)
-                                            self.traffic_light_violator_counter += 1
-                                            self.capture_violation(frame.copy(), (xmin, ymin, xmax, ymax), "traffic_line")
-                                            logger.info(f"Violator detected! ID: {idx}\nTotal Violator: {self.traffic_light_violator_counter}\nViolator list: {self.traffic_light_violator_list}\n")
-                                    if self.traffic_light_status == "Green":
-                                        if idx not in self.traffic_light_clear_list and idx not in self.traffic_light_violator_list:
-                                            cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 255, 0), 2)
-                                            cv2.circle(frame, (cx, cy), 2, (0, 255, 0), -1)
-                                            self.traffic_light_clear_list.append(idx)
-                            
-                            # check wrong way violation
-                            if obj_dir == "North":
-                                if area["status_dir"] == "South":
-                                    if self.do_lines_intersect(self.trails[idx][i-1], self.trails[idx][i], area["coords"][0], area["coords"][1]):
-                                        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 0, 255), 2)
-                                        cv2.circle(frame, (cx, cy), 2, (0, 0, 255), -1)
-                                        if idx not in self.wrong_way_violator_list:
-                                            self.wrong_way_violator_list.append(idx)
-                                            self.wrong_way_violator_counter += 1
-                                            self.capture_violation(frame.copy(), (xmin, ymin, xmax, ymax), "wrong_way")
-                                            logger.info("South line violated!")
-                                            logger.info(f"Wrong way violator detected! ID: {idx}\nTotal Violator: {self.wrong_way_violator_counter}\nViolator list: {self.wrong_way_violator_list}\n")
-                            
-                            if obj_dir == "South":
-                                if area["status_dir"] == "North":
-                                    if self.do_lines_intersect(self.trails[idx][i-1], self.trails[idx][i], area["coords"][0], area["coords"][1]):
-                                        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 0, 255), 2)
-                                        cv2.circle(frame, (cx, cy), 2, (0, 0, 255), -1)
-                                        if idx not in self.wrong_way_violator_list:
-                                            self.wrong_way_violator_list.append(idx)
-                                            self.wrong_way_violator_counter += 1
-                                            self.capture_violation(frame.copy(), (xmin, ymin, xmax, ymax), "wrong_way")
-                                            logger.info("North line violated!")
-                                            logger.info(f"Wrong way violator detected! ID: {idx}\nTotal Violator: {self.wrong_way_violator_counter}\nViolator list: {self.wrong_way_violator_list}\n")
             
+            track_crossings = crossings.get(idx, [])
+            
+            if self.crosswalk_dir_check is False:
+                for event in track_crossings:
+                    self.count_area_direction(self.area[event.area_index], event)
+                
+                if all(area["status_dir"] != "Undefined" for area in self.area):
+                    self.crosswalk_dir_check = True
+                    logger.info("Crosswalk directions calibrated at frame %d: %s", self.frame_index, [area["status_dir"] for area in self.area], extra={"event": "calibration.done", "frame_index": self.frame_index})
+                    self.save_calibration()
+            
+            if self.crosswalk_dir_check:
+                for event in track_crossings:
+                    area = self.area[event.area_index]
+                    self.check_traffic_light_violation(frame, area, event, bbox)
+                    self.check_wrong_way_violation(frame, area, event, bbox)
+        
+        self.evict_dropped_tracks()
+        
         return frame
     
+    def count_area_direction(self, area, event):
+        idx = event.track_id
+        if area["status_dir"] == "Undefined" and idx not in area["counted_idx"]:
+            if event.direction == "North":
+                area["north_count"] += 1
+            elif event.direction == "South":
+                area["south_count"] += 1
+            
+            area["counted_idx"].add(idx)
+            
+            if area["north_count"] >= 5:
+                area["status_dir"] = "North"
+            elif area["south_count"] >= 5:
+                area["status_dir"] = "South"
+            
+            logger.info("Area %s crossed by track %d: north %d, south %d, status %s", area["coords"].tolist(), idx, area["north_count"], area["south_count"], area["status_dir"], extra={"event": "calibration.crossing", "frame_index": self.frame_index})
+    
+    def check_traffic_light_violation(self, frame, area, event, bbox):
+        if area["status_dir"] != "North":
+            return
+        
+        idx = event.track_id
+        xmin, ymin, xmax, ymax = bbox
+        cx = int(xmin + xmax) // 2
+        cy = int(ymin + ymax) // 2
+        
+        if self.traffic_light_status == "Red":
+            if idx not in self.traffic_light_violator_list and idx not in self.traffic_light_clear_list:
+                if self.render:
+                    with self.timer.stage("draw"):
+                        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 0, 255), 2)
+                        cv2.circle(frame, (cx, cy), 2, (0, 0, 255), -1)
+                self.traffic_light_violator_list.add(idx)
+                self.traffic_light_violator_counter += 1
+                with self.timer.stage("capture"):
+                    self.capture_violation(frame, bbox, "traffic_line", idx)
+                logger.info("Traffic light violation: track %d at frame %d, total %d", idx, self.frame_index, self.traffic_light_violator_counter, extra={"event": "violation.traffic_line", "frame_index": self.frame_index, "track_id": idx})
+        if self.traffic_light_status == "Green":
+            if idx not in self.traffic_light_clear_list and idx not in self.traffic_light_violator_list:
+                if self.render:
+                    with self.timer.stage("draw"):
+                        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 255, 0), 2)
+                        cv2.circle(frame, (cx, cy), 2, (0, 255, 0), -1)
+                self.traffic_light_clear_list.add(idx)
+    
+    def check_wrong_way_violation(self, frame, area, event, bbox):
+        # moving against the learned direction of the crossed area
+        if not ((event.direction == "North" and area["status_dir"] == "South") or (event.direction == "South" and area["status_dir"] == "North")):
+            return
+        
+        idx = event.track_id
+        xmin, ymin, xmax, ymax = bbox
+        cx = int(xmin + xmax) // 2
+        cy = int(ymin + ymax) // 2
+        
+        if self.render:
+            with self.timer.stage("draw"):
+                cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 0, 255), 2)
+                cv2.circle(frame, (cx, cy), 2, (0, 0, 255), -1)
+        if idx not in self.wrong_way_violator_list:
+            self.wrong_way_violator_list.add(idx)
+            self.wrong_way_violator_counter += 1
+            with self.timer.stage("capture"):
+                self.capture_violation(frame, bbox, "wrong_way", idx)
+            logger.info("Wrong way violation: track %d at frame %d against %s, total %d", idx, self.frame_index, area["status_dir"], self.wrong_way_violator_counter, extra={"event": "violation.wrong_way", "frame_index": self.frame_index, "track_id": idx})
+    
     def update_trails(self, idx, cx, ymax):
         if idx not in self.trails:
-            self.trails[idx] = []
+            self.trails[idx] = deque(maxlen=TRAIL_LENGTH)
         self.trails[idx].append((cx, ymax))
-        
+        return self.trails[idx]
+    
+    def evict_dropped_tracks(self):
+        # the tracker never reuses an id, so per-track state for the ones it dropped can go
+        for idx in self.tracker.pop_ended():
+            self.trails.pop(idx, None)
+            self.traffic_light_clear_list.discard(idx)
+            self.traffic_light_violator_list.discard(idx)
+            self.wrong_way_violator_list.discard(idx)
+            for area in self.area:
+                area["counted_idx"].discard(idx)
+    
     def get_direction(self, p1, p2):
         direction = ""
         
@@ -342,29 +438,70 @@ class DetectLineViolation:
         
         return direction
     
-    def do_lines_intersect(self, p1, p2, q1, q2):
-        def ccw(a, b, c):
-            return (c[1] - a[1]) * (b[0] - a[0]) > (b[1] - a[1]) * (c[0] - a[0])
-        return ccw(p1, q1, q2) != ccw(p2, q1, q2) and ccw(p1, p2, q1) != ccw(p1, p2, q2)
-    
-    def capture_violation(self, frame, bbox, violation, padding = 250):
+    def capture_violation(self, frame, bbox, violation, track_id, padding = 250):
         rxmin, rymin, rxmax, rymax = bbox
         xmin = max(rxmin - padding, 0)
         ymin = max(rymin - padding, 0)
         xmax = min(rxmax + padding, frame.shape[1])
         ymax = min(rymax + padding, frame.shape[0])
         
-        timestamp = datetime.now().strftime("%H.%M.%S")
-        
         if violation == "traffic_line":
             violation_directory = self.traffic_line_violation_dir
-            image_filename = f"{timestamp}_{self.traffic_light_violator_counter}.jpg"
         if violation == "wrong_way":
             violation_directory = self.wrong_way_violation_dir
-            image_filename = f"{timestamp}_{self.wrong_way_violator_counter}.jpg"
-            
-        image_output_path = os.path.join(violation_directory, image_filename)
-        cropped_frame = frame[ymin:ymax, xmin:xmax]
-        cv2.imwrite(image_output_path, cropped_frame)
         
-        logger.info("Violation captured!")
\ No newline at end of file
+        # a track is captured at most once per category, so frame + track id never collide
+        image_filename = f"{self.frame_index:06d}_{track_id}.jpg"
+        image_output_path = os.path.join(violation_directory, image_filename)
+        if not self.evidence:
+            image_output_path = None
+        elif self.snapshot_writer:
+            # encoding and disk I/O happen off the detection thread
+            self.snapshot_writer.submit(frame, (xmin, ymin, xmax, ymax), image_output_path)
+        else:
+            cropped_frame = frame[ymin:ymax, xmin:xmax]
+            cv2.imwrite(image_output_path, cropped_frame)
+        
+        event = {
+            "category": violation,
+            "track_id": int(track_id),
+            "frame_index": self.frame_index,
+            "video_time": round(self.frame_index / self.fps, 3) if self.fps else None,
+            "bbox": [int(v) for v in bbox],
+            "traffic_light": self.traffic_light_status,
+            "file_path": image_output_path
+        }
+        self.events.append(event)
+        self.timer.count("violations", category=event["category"])
+        
+        if self.index:
+            self.index.add_violation(
+                os.path.basename(self.file_dir), violation, image_output_path or "",
+                filename=image_filename,
+                track_id=event["track_id"],
+                frame_index=event["frame_index"],
+                video_time=event["video_time"],
+                bbox=event["bbox"],
+                traffic_light=event["traffic_light"]
+            )
+    
+    def summary(self):
+        return {
+            "counters": {
+                "traffic_line": self.traffic_light_violator_counter,
+                "wrong_way": self.wrong_way_violator_counter
+            },
+            "traffic_light_status": self.traffic_light_status,
+            "areas": [
+                {"coords": area["coords"].tolist(), "status_dir": area["status_dir"]}
+                for area in self.area
+            ],
+            "events": list(self.events)
+        }
+    
+    def set_track_callback(self, callback):
+        self.track_callback = callback
+    
+    def keep_recent_events(self, max_events):
+        # long-running streams keep only the newest events in memory, the index keeps them all
+        self.events = deque(self.events, maxlen=max_events)
\ No newline at end of file
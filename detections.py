@@ -0,0 +1,50 @@
+import numpy as np
+
+# Per-purpose class filter and confidence threshold, one place for every model
+# classes=None accepts any class the model emits
+DETECTION_THRESHOLDS = {
+    "vehicle": {"classes": (0, 1), "confidence": 0.5},
+    "green_light": {"classes": (2,), "confidence": 0.75},
+    "red_light": {"classes": (3,), "confidence": 0.75},
+    "crosswalk": {"classes": None, "confidence": 0.5},
+    "rider": {"classes": (2,), "confidence": 0.7},
+    "no_helmet": {"classes": (1,), "confidence": 0.8}
+}
+
+def to_numpy(results, index=0):
+    # results.xyxy holds one (n, 6) tensor per image: xmin, ymin, xmax, ymax, confidence, class
+    detections = results.xyxy[index]
+    if hasattr(detections, "cpu"):
+        detections = detections.cpu().numpy()
+    return np.asarray(detections, dtype=np.float64).reshape(-1, 6)
+
+class Detections:
+    def __init__(self, results, index=0):
+        raw = to_numpy(results, index)
+        
+        # integer pixel boxes and confidence rounded to 2 decimals, same as the thresholds expect
+        self.boxes = raw[:, :4].astype(int)
+        self.confidences = np.round(raw[:, 4], 2)
+        self.class_ids = raw[:, 5].astype(int)
+        self.names = getattr(results, "names", {})
+    
+    def __len__(self):
+        return len(self.class_ids)
+    
+    def mask(self, rule):
+        threshold = DETECTION_THRESHOLDS[rule]
+        mask = self.confidences >= threshold["confidence"]
+        if threshold["classes"] is not None:
+            mask &= np.isin(self.class_ids, threshold["classes"])
+        return mask
+    
+    def select(self, rule):
+        # (n, 5) float array of xmin, ymin, xmax, ymax, confidence, ready for Tracker.update
+        mask = self.mask(rule)
+        return np.column_stack((self.boxes[mask], self.confidences[mask])).astype(np.float64).reshape(-1, 5)
+    
+    def name(self, class_id):
+        return self.names.get(class_id, str(class_id)) if isinstance(self.names, dict) else self.names[class_id]
+    
+    def to_array(self):
+        return np.column_stack((self.boxes, self.confidences, self.class_ids))
\ No newline at end of file
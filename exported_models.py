@@ -0,0 +1,288 @@
+import os
+import ast
+import sys
+import json
+import shutil
+import logging
+import argparse
+import subprocess
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+YOLOV5_DIR = "./yolov5"
+EXPORT_DIR = "./model/exported"
+
+# pytorch is the hub checkout run eagerly, the others are exported once per weights file and cached
+BACKENDS = ("pytorch", "onnx", "torchscript")
+EXTENSIONS = {"onnx": ".onnx", "torchscript": ".torchscript"}
+
+# traced TorchScript graphs keep the input shape they were exported with
+EXPORT_SIZE = 640
+
+# yolov5 non_max_suppression defaults
+MAX_WH = 7680
+MAX_NMS = 30000
+
+def exported_path(weights_path, backend, int8=False, export_dir=EXPORT_DIR, size=EXPORT_SIZE):
+    from model import file_hash
+    
+    # named by the weights hash, so replaced weights are exported again instead of served stale
+    stem = os.path.splitext(os.path.basename(weights_path))[0]
+    suffix = "_int8" if int8 else ""
+    return os.path.join(export_dir, f"{stem}_{file_hash(weights_path)[:12]}_{size}{suffix}{EXTENSIONS[backend]}")
+
+def export_model(weights_path, backend, int8=False, export_dir=EXPORT_DIR, size=EXPORT_SIZE):
+    if backend not in EXTENSIONS:
+        raise ValueError(f"Unknown export backend: {backend}")
+    if int8 and backend != "onnx":
+        raise ValueError("INT8 quantization is only available for the onnx backend")
+    
+    target = exported_path(weights_path, backend, int8, export_dir, size)
+    if os.path.exists(target):
+        return target
+    
+    if int8:
+        import onnx
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        
+        # dynamic quantization of the fp32 export: int8 weights, activations quantized per call, no calibration set
+        source = export_model(weights_path, backend, export_dir=export_dir, size=size)
+        partial_path = f"{target}.partial"
+        quantize_dynamic(source, partial_path, weight_type=QuantType.QUInt8)
+        
+        # names and stride live in the metadata, which the quantizer doesn't carry over
+        quantized = onnx.load(partial_path)
+        del quantized.metadata_props[:]
+        quantized.metadata_props.extend(onnx.load(source).metadata_props)
+        onnx.save(quantized, partial_path)
+        os.replace(partial_path, target)
+        logger.info(f"Quantized {source} to {target}")
+        return target
+    
+    os.makedirs(export_dir, exist_ok=True)
+    weights_path = os.path.abspath(weights_path)
+    
+    # the checkout's own exporter: fused model, export-mode Detect head, names and stride in the metadata
+    command = [sys.executable, "export.py", "--weights", weights_path, "--include", backend, "--imgsz", str(size), "--device", "cpu"]
+    if backend == "onnx":
+        # dynamic height and width so frames keep the letterboxed shape the hub model would use
+        command.append("--dynamic")
+    logger.info(f"Exporting {weights_path} to {backend}")
+    subprocess.run(command, cwd=YOLOV5_DIR, check=True)
+    
+    # written next to the weights, moved under its cache name
+    shutil.move(os.path.splitext(weights_path)[0] + EXTENSIONS[backend], target)
+    
+    logger.info(f"Exported {weights_path} to {target}")
+    return target
+
+def make_divisible(value, divisor):
+    return int(np.ceil(value / divisor) * divisor)
+
+def letterbox(image, shape, color=(114, 114, 114)):
+    # resize keeping the aspect ratio and pad to shape (height, width), like yolov5 with auto=False
+    height, width = image.shape[:2]
+    ratio = min(shape[0] / height, shape[1] / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    pad_width, pad_height = (shape[1] - new_width) / 2, (shape[0] - new_height) / 2
+    
+    if (width, height) != (new_width, new_height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_height - 0.1)), int(round(pad_height + 0.1))
+    left, right = int(round(pad_width - 0.1)), int(round(pad_width + 0.1))
+    return cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+
+def scale_boxes(input_shape, boxes, image_shape):
+    # boxes from letterboxed input pixels back to the original image, clipped to it
+    gain = min(input_shape[0] / image_shape[0], input_shape[1] / image_shape[1])
+    pad_x = (input_shape[1] - image_shape[1] * gain) / 2
+    pad_y = (input_shape[0] - image_shape[0] * gain) / 2
+    boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - pad_x) / gain, 0, image_shape[1])
+    boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - pad_y) / gain, 0, image_shape[0])
+    return boxes
+
+def nms(boxes, scores, iou_threshold):
+    # greedy, highest score first, same overlap rule as torchvision.ops.nms
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while len(order):
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        width = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        height = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        intersection = width * height
+        iou = intersection / (areas[i] + areas[rest] - intersection)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+def non_max_suppression(prediction, conf, iou, max_det, classes=None, agnostic=False):
+    # prediction: (batch, anchors, 5 + classes) of xywh, objectness, class scores, returns (n, 6) per image
+    output = []
+    for x in prediction:
+        x = x[x[:, 4] > conf]
+        if not len(x):
+            output.append(np.zeros((0, 6), dtype=np.float32))
+            continue
+        
+        scores = x[:, 5:] * x[:, 4:5]
+        class_ids = scores.argmax(1)
+        confidences = scores[np.arange(len(x)), class_ids]
+        boxes = np.column_stack((x[:, 0] - x[:, 2] / 2, x[:, 1] - x[:, 3] / 2, x[:, 0] + x[:, 2] / 2, x[:, 1] + x[:, 3] / 2))
+        
+        detections = np.column_stack((boxes, confidences, class_ids)).astype(np.float32)
+        detections = detections[confidences > conf]
+        if classes is not None:
+            detections = detections[np.isin(detections[:, 5], classes)]
+        detections = detections[np.argsort(-detections[:, 4], kind="stable")[:MAX_NMS]]
+        
+        # boxes of different classes are moved apart so one pass suppresses per class
+        offsets = detections[:, 5:6] * (0 if agnostic else MAX_WH)
+        keep = nms(detections[:, :4] + offsets, detections[:, 4], iou)[:max_det]
+        output.append(detections[keep])
+    return output
+
+def class_color(class_id):
+    palette = ((56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207), (10, 249, 72), (23, 204, 146), (134, 219, 61))
+    return palette[int(class_id) % len(palette)]
+
+class ExportedResults:
+    # the parts of the hub model's Detections the detectors use: xyxy, names, tolist() and render()
+    def __init__(self, images, xyxy, names):
+        self.images = images
+        self.xyxy = xyxy
+        self.names = names
+    
+    def tolist(self):
+        return [ExportedResults([image], [xyxy], self.names) for image, xyxy in zip(self.images, self.xyxy)]
+    
+    def render(self):
+        rendered = []
+        for image, detections in zip(self.images, self.xyxy):
+            image = image.copy()
+            for xmin, ymin, xmax, ymax, confidence, class_id in detections:
+                color = class_color(class_id)
+                label = f"{self.names.get(int(class_id), int(class_id))} {confidence:.2f}"
+                cv2.rectangle(image, (int(xmin), int(ymin)), (int(xmax), int(ymax)), color, 2)
+                cv2.putText(image, label, (int(xmin), max(int(ymin) - 4, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+            rendered.append(image)
+        return rendered
+
+def parse_names(names):
+    names = ast.literal_eval(names) if isinstance(names, str) else names
+    return dict(enumerate(names)) if isinstance(names, list) else {int(k): v for k, v in names.items()}
+
+def thread_budget():
+    # the worker pool's budget (worker_pool.configure_threads), otherwise the runtime's own default
+    threads = os.environ.get("OMP_NUM_THREADS")
+    return int(threads) if threads else None
+
+class OnnxSession:
+    def __init__(self, path):
+        import onnxruntime
+        
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if thread_budget():
+            options.intra_op_num_threads = thread_budget()
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.stride = int(metadata.get("stride", 32))
+        self.names = parse_names(metadata.get("names", "{}"))
+        
+        # symbolic height/width when exported with --dynamic
+        height, width = self.session.get_inputs()[0].shape[2:]
+        self.shape = (height, width) if isinstance(height, int) and isinstance(width, int) else None
+    
+    def __call__(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class TorchScriptSession:
+    def __init__(self, path):
+        import torch
+        
+        extra_files = {"config.txt": ""}
+        self.module = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+        self.module.eval()
+        
+        config = json.loads(extra_files["config.txt"] or "{}")
+        self.stride = int(config.get("stride", 32))
+        self.names = parse_names(config.get("names", {}))
+        self.shape = tuple(config["shape"][2:]) if "shape" in config else (EXPORT_SIZE, EXPORT_SIZE)
+    
+    def __call__(self, batch):
+        import torch
+        
+        with torch.no_grad():
+            prediction = self.module(torch.from_numpy(batch))
+        if isinstance(prediction, (list, tuple)):
+            prediction = prediction[0]
+        return prediction.numpy()
+
+class ExportedModel:
+    # drop-in for the hub AutoShape model: same call, same conf/iou/max_det attributes, same result shape
+    def __init__(self, session):
+        self.session = session
+        self.names = session.names
+        self.conf = 0.25
+        self.iou = 0.45
+        self.max_det = 1000
+        self.classes = None
+        self.agnostic = False
+    
+    def input_shape(self, images, size):
+        if self.session.shape:
+            return self.session.shape
+        
+        # the hub model's rule: longest side to size, both sides up to a multiple of the stride
+        shapes = []
+        for image in images:
+            gain = size / max(image.shape[:2])
+            shapes.append((int(image.shape[0] * gain), int(image.shape[1] * gain)))
+        return tuple(make_divisible(value, self.session.stride) for value in np.max(shapes, axis=0))
+    
+    def __call__(self, images, size=640):
+        batch = images if isinstance(images, list) else [images]
+        shape = self.input_shape(batch, size)
+        
+        # channels go in as given, the hub model doesn't reorder numpy frames either
+        inputs = np.stack([letterbox(image[..., :3], shape) for image in batch]).transpose(0, 3, 1, 2)
+        inputs = np.ascontiguousarray(inputs, dtype=np.float32) / 255
+        
+        prediction = self.session(inputs)
+        detections = non_max_suppression(prediction, self.conf, self.iou, self.max_det, self.classes, self.agnostic)
+        for image, rows in zip(batch, detections):
+            scale_boxes(shape, rows[:, :4], image.shape[:2])
+        return ExportedResults(batch, detections, self.names)
+
+def load_exported_model(weights_path, backend, int8=False, export_dir=EXPORT_DIR):
+    path = export_model(weights_path, backend, int8, export_dir)
+    session = OnnxSession(path) if backend == "onnx" else TorchScriptSession(path)
+    logger.info(f"Model {weights_path} running on {backend}{' int8' if int8 else ''}: {path}")
+    return ExportedModel(session)
+
+def main():
+    from model import MODEL_PATHS
+    
+    parser = argparse.ArgumentParser(description="Export the detection models ahead of the first job")
+    parser.add_argument("--backend", choices=list(EXTENSIONS), nargs="+", default=["onnx"])
+    parser.add_argument("--int8", action="store_true", help="also write dynamically quantized onnx models")
+    parser.add_argument("--export-dir", default=EXPORT_DIR)
+    parser.add_argument("weights", nargs="*", default=MODEL_PATHS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    
+    for weights_path in args.weights:
+        for backend in args.backend:
+            print(export_model(weights_path, backend, export_dir=args.export_dir))
+            if args.int8 and backend == "onnx":
+                print(export_model(weights_path, backend, int8=True, export_dir=args.export_dir))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,115 @@
+import os
+import shutil
+import struct
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# atoms inside moov that can hold an stco/co64 chunk offset table
+CONTAINER_ATOMS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+def read_atoms(f, start, end):
+    # (type, offset, size) of every atom between start and end, without reading payloads
+    atoms = []
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, atom_type = struct.unpack(">I4s", f.read(8))
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+        elif size == 0:
+            size = end - offset
+        if size < 8 or offset + size > end:
+            raise ValueError(f"Malformed atom {atom_type!r} at {offset}")
+        atoms.append((atom_type, offset, size))
+        offset += size
+    return atoms
+
+def patch_chunk_offsets(moov, shift):
+    # walk the moov tree in place and move every chunk offset by shift bytes
+    def walk(start, end):
+        offset = start
+        while offset + 8 <= end:
+            size, atom_type = struct.unpack_from(">I4s", moov, offset)
+            header = 8
+            if size == 1:
+                size = struct.unpack_from(">Q", moov, offset + 8)[0]
+                header = 16
+            if size < header or offset + size > end:
+                raise ValueError(f"Malformed atom {atom_type!r} in moov")
+            
+            if atom_type in CONTAINER_ATOMS:
+                walk(offset + header, offset + size)
+            elif atom_type in (b"stco", b"co64"):
+                count = struct.unpack_from(">I", moov, offset + header + 4)[0]
+                entries = offset + header + 8
+                if atom_type == b"stco":
+                    values = struct.unpack_from(f">{count}I", moov, entries)
+                    if values and max(values) + shift > 0xFFFFFFFF:
+                        raise ValueError("Chunk offsets overflow stco after moving moov")
+                    struct.pack_into(f">{count}I", moov, entries, *(value + shift for value in values))
+                else:
+                    values = struct.unpack_from(f">{count}Q", moov, entries)
+                    struct.pack_into(f">{count}Q", moov, entries, *(value + shift for value in values))
+            offset += size
+    
+    walk(0, len(moov))
+
+def make_faststart(path):
+    # move moov in front of mdat so players can start before the whole file is downloaded,
+    # a file this can't safely rewrite is left as it is
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        try:
+            atoms = read_atoms(f, 0, file_size)
+        except ValueError as e:
+            logger.warning(f"Skipping fast-start for {path}: {e}")
+            return False
+        types = [atom[0] for atom in atoms]
+        if b"moov" not in types or b"mdat" not in types:
+            return False
+        
+        moov_index = types.index(b"moov")
+        mdat_index = types.index(b"mdat")
+        if moov_index < mdat_index:
+            return False
+        
+        _, moov_offset, moov_size = atoms[moov_index]
+        _, mdat_offset, _ = atoms[mdat_index]
+        
+        f.seek(moov_offset)
+        moov = bytearray(f.read(moov_size))
+        
+        # everything from the first mdat up to the old moov slides down by the moov size
+        try:
+            patch_chunk_offsets(moov, moov_size)
+        except (ValueError, struct.error) as e:
+            logger.warning(f"Skipping fast-start for {path}: {e}")
+            return False
+        
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".faststart")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                f.seek(0)
+                copy_range(f, out, mdat_offset)
+                out.write(moov)
+                copy_range(f, out, moov_offset - mdat_offset)
+                f.seek(moov_offset + moov_size)
+                copy_range(f, out, file_size - moov_offset - moov_size)
+        except Exception:
+            os.remove(temp_path)
+            raise
+    
+    shutil.copymode(path, temp_path)
+    os.replace(temp_path, path)
+    logger.info(f"Moved moov to the front of {path}")
+    return True
+
+def copy_range(src, dst, length, chunk_size=1024 * 1024):
+    while length > 0:
+        chunk = src.read(min(chunk_size, length))
+        if not chunk:
+            raise IOError("Unexpected end of file while copying atoms")
+        dst.write(chunk)
+        length -= len(chunk)
\ No newline at end of file
@@ -1,12 +1,18 @@
 import os
 import cv2
 import uuid
+import hashlib
 from datetime import datetime
+from faststart import make_faststart
+from video_index import VideoIndex, VIOLATION_CATEGORIES
 
 class FileUtils:
-    def __init__(self):
-        self.UPLOAD_FOLDER = './uploads'
+    def __init__(self, upload_folder='./uploads', index_path='./uploads_index.sqlite3'):
+        self.UPLOAD_FOLDER = upload_folder
         self.ALLOWED_EXTENSIONS = {'mp4'}
+        
+        # kept outside the uploads folder so /file can't serve it
+        self.index = VideoIndex(index_path)
     
     def create_uploads_dir(self):
         uploads_dir = os.path.join(self.UPLOAD_FOLDER)
@@ -24,67 +30,126 @@ class FileUtils:
         filename = f"{unique_id}_{name}_{timestamp}.mp4"
         return unique_id, filename, timestamp
     
-    def save_and_resize(self, temp_file_path, file_path, new_fps=15):
+    def save_and_hash(self, file, file_path, chunk_size=1024 * 1024):
+        # hashed while it streams to disk, so dedupe costs no second read of the upload
+        sha = hashlib.sha256()
+        with open(file_path, 'wb') as f:
+            for chunk in iter(lambda: file.stream.read(chunk_size), b''):
+                sha.update(chunk)
+                f.write(chunk)
+        return sha.hexdigest()
+    
+    def find_upload_by_content(self, content_hash):
+        for upload in self.index.find_uploads_by_content(content_hash):
+            if os.path.exists(upload['video_path']):
+                return upload
+        return None
+    
+    def save_and_resize(self, temp_file_path, file_path, new_fps=15, frame_size=(1280, 720)):
         capture = cv2.VideoCapture(temp_file_path)
         fourcc = cv2.VideoWriter_fourcc(*"mp4v")
         original_fps = capture.get(cv2.CAP_PROP_FPS)
-        out = cv2.VideoWriter(file_path, fourcc, new_fps, (1280, 720))
+        out = cv2.VideoWriter(file_path, fourcc, new_fps, frame_size)
         
         frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
         duration = frame_count / original_fps
         new_frame_count = int(duration * new_fps)
         
-        for i in range(new_frame_count):
-            capture.set(cv2.CAP_PROP_POS_FRAMES, i * original_fps / new_fps)
-            ret, frame = capture.read()
-            if not ret:
+        # decode sequentially and keep a source frame for every output timestamp that falls
+        # inside its display interval, instead of seeking (and re-decoding a GOP) per output frame
+        written = 0
+        source_index = 0
+        while written < new_frame_count:
+            if not capture.grab():
                 break
-            frame = cv2.resize(frame, (1280, 720))
-            out.write(frame)
+            
+            frame_end = (source_index + 1) / original_fps
+            if written / new_fps < frame_end:
+                ret, frame = capture.retrieve()
+                if not ret:
+                    break
+                if (frame.shape[1], frame.shape[0]) != frame_size:
+                    frame = cv2.resize(frame, frame_size)
+                
+                # upsampling repeats the frame for every output timestamp it covers
+                while written < new_frame_count and written / new_fps < frame_end:
+                    out.write(frame)
+                    written += 1
+            
+            source_index += 1
         
         capture.release()
         out.release()
+        make_faststart(file_path)
+        
+        return written
+    
+    def probe_video(self, video_path):
+        capture = cv2.VideoCapture(video_path)
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        metadata = {
+            'fps': fps,
+            'frame_count': frame_count,
+            'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'duration': frame_count / fps if fps else None
+        }
+        capture.release()
+        return metadata
+    
+    def register_upload(self, id, upload_dir, video_path, created_at, content_hash=None, video_hash=None):
+        self.index.add_upload(id, upload_dir, video_path, created_at, self.probe_video(video_path), content_hash, video_hash)
+    
+    def register_stream(self, id, stream_dir, source, created_at):
+        # live sources aren't probed, opening them here would race the detection job for the feed
+        self.index.add_upload(id, stream_dir, source, created_at, is_stream=True)
+    
+    def is_stream(self, id):
+        upload = self.index.get_upload(id)
+        if not upload:
+            return False
+        if upload.get('is_stream') is None:
+            # indexed before streams were marked, a stream's path is its source rather than a file
+            return not os.path.isfile(upload['video_path'])
+        return bool(upload['is_stream'])
     
     def search_video_dir(self, app_config, id):
-        for root, dirs, _ in os.walk(app_config):
-            for dir_name in dirs:
-                if dir_name == id:
-                    return os.path.join(root, dir_name)
-        return None
+        upload = self.index.get_upload(id)
+        return upload['dir'] if upload else None
     
     def search_video(self, app_config, id):
-        for root, _, files in os.walk(app_config):
-            for file in files:
-                if file.endswith('.mp4'):
-                    file_id = file.split('_')[0]
-                    if file_id == id:
-                        return os.path.join(root, file)
-        return None
+        upload = self.index.get_upload(id)
+        return upload['video_path'] if upload else None
     
-    def get_captured_violations(self, app_config, id):
-        violation_dir = self.search_video_dir(app_config, id)
-        if not violation_dir:
+    def get_captured_violations(self, app_config, id, categories=None, start_time=None, end_time=None, page=1, per_page=None):
+        if not self.index.get_upload(id):
             return None
         
-        traffic_violation_dir = os.path.join(violation_dir, 'traffic_violation')
-        if not os.path.exists(traffic_violation_dir):
+        offset = (page - 1) * per_page if per_page else 0
+        records, total = self.index.query_violations(id, categories, start_time, end_time, per_page, offset)
+        if not total and not self.index.get_results(id):
             return None
         
-        violations = {
-            'helmet': [],
-            'traffic_line': [],
-            'wrong_way': []
-        }
+        violations = {category: [] for category in (categories or VIOLATION_CATEGORIES)}
         
-        for category in violations.keys():
-            category_dir = os.path.join(traffic_violation_dir, category)
-            if os.path.exists(category_dir):
-                for file in os.listdir(category_dir):
-                    if file.endswith('.jpg'):
-                        file_path = os.path.join(category_dir, file)
-                        violations[category].append({
-                            'filename': file,
-                            'file_path': file_path.replace('\\', '/').replace(app_config, '')
-                        })
+        for record in records:
+            violations[record['category']].append({
+                'filename': record['filename'],
+                'file_path': record['file_path'].replace('\\', '/').replace(app_config, '') if record['file_path'] else None,
+                'track_id': record['track_id'],
+                'frame_index': record['frame_index'],
+                'video_time': record['video_time'],
+                'bbox': record['bbox'],
+                'traffic_light': record['traffic_light']
+            })
         
-        return violations
\ No newline at end of file
+        return {'violations': violations, 'total': total}
+    
+    def captured_violations_version(self, id):
+        return self.index.manifest_version(id)
+    
+    def file_version(self, file_path):
+        # changes whenever a rerun rewrites the file, so a URL carrying it can be cached forever
+        stat = os.stat(file_path)
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
\ No newline at end of file
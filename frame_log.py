@@ -0,0 +1,37 @@
+import logging
+import numpy as np
+
+# per-frame records are kept for one frame in this many, violations and milestones are always logged
+FRAME_LOG_EVERY = 30
+
+def configure_frame_logging(every):
+    global FRAME_LOG_EVERY
+    FRAME_LOG_EVERY = max(1, int(every))
+
+def render_value(value):
+    # callables are evaluated here, so costly fields are only built for records that get emitted
+    if callable(value):
+        value = value()
+    return value.tolist() if isinstance(value, np.ndarray) else value
+
+class LazyFields:
+    # formatted only if a handler actually emits the record
+    def __init__(self, fields):
+        self.fields = fields
+    
+    def __str__(self):
+        return " ".join(f"{name}={render_value(value)}" for name, value in self.fields.items())
+
+class FrameLog:
+    # structured per-frame debug records for one detector: event name, frame index and fields,
+    # the fields also ride on the record (record.event, record.fields) for structured handlers
+    def __init__(self, logger, every=None):
+        self.logger = logger
+        self.every = every
+    
+    def enabled(self, frame_index):
+        return frame_index % (self.every or FRAME_LOG_EVERY) == 0 and self.logger.isEnabledFor(logging.DEBUG)
+    
+    def debug(self, frame_index, event, **fields):
+        if self.enabled(frame_index):
+            self.logger.debug("%s frame=%d %s", event, frame_index, LazyFields(fields), extra={"event": event, "frame_index": frame_index, "fields": fields})
\ No newline at end of file
@@ -0,0 +1,143 @@
+import cv2
+import copy
+import json
+import logging
+import numpy as np
+from detections import to_numpy
+from timing import NULL_TIMER
+
+logger = logging.getLogger(__name__)
+
+# YOLOv5 AutoShape defaults, used for any model or setting the config leaves out
+DEFAULT_SETTINGS = {"size": 640, "conf": 0.25, "iou": 0.45, "max_det": 1000, "roi": None}
+
+# config sections, one per model the detectors load
+MODEL_NAMES = ("line", "crosswalk", "helmet")
+
+class InferenceSettings:
+    def __init__(self, size=640, conf=0.25, iou=0.45, max_det=1000, roi=None):
+        self.size = int(size)
+        self.conf = float(conf)
+        self.iou = float(iou)
+        self.max_det = int(max_det)
+        
+        # polygon in full-frame pixels, the model only sees its bounding rect
+        self.roi = np.array(roi, dtype=np.int32).reshape(-1, 2) if roi is not None else None
+        
+        if self.size <= 0 or self.max_det <= 0 or not 0 <= self.conf <= 1 or not 0 <= self.iou <= 1:
+            raise ValueError(f"Invalid inference settings: {self.to_dict()}")
+        if self.roi is not None and len(self.roi) < 3:
+            raise ValueError("roi must be a polygon of at least 3 points")
+    
+    @classmethod
+    def from_dict(cls, values):
+        unknown = set(values) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown inference settings: {', '.join(sorted(unknown))}")
+        return cls(**{**DEFAULT_SETTINGS, **values})
+    
+    def to_dict(self):
+        return {
+            "size": self.size,
+            "conf": self.conf,
+            "iou": self.iou,
+            "max_det": self.max_det,
+            "roi": self.roi.tolist() if self.roi is not None else None
+        }
+
+def load_inference_config(path=None):
+    # {"default": {"line": {...}, ...}, "cameras": {"<camera_id>": {"line": {...}, ...}}}
+    if not path:
+        return {"default": {}, "cameras": {}}
+    
+    with open(path) as f:
+        config = json.load(f)
+    
+    config = {"default": config.get("default", {}), "cameras": config.get("cameras", {})}
+    for name, sections in [("default", config["default"]), *config["cameras"].items()]:
+        unknown = set(sections) - set(MODEL_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown models in inference config {name}: {', '.join(sorted(unknown))}")
+        for values in sections.values():
+            InferenceSettings.from_dict(values)
+    
+    logger.info(f"Inference config loaded from {path}: {len(config['cameras'])} cameras")
+    return config
+
+def resolve_settings(config, camera_id=None):
+    # camera sections override the defaults key by key, per model
+    config = config or {}
+    camera = config.get("cameras", {}).get(camera_id, {}) if camera_id else {}
+    return {
+        name: InferenceSettings.from_dict({**config.get("default", {}).get(name, {}), **camera.get(name, {})})
+        for name in MODEL_NAMES
+    }
+
+def roi_rect(roi, frame_shape):
+    height, width = frame_shape[:2]
+    x, y, w, h = cv2.boundingRect(roi)
+    xmin, ymin = max(x, 0), max(y, 0)
+    xmax, ymax = min(x + w, width), min(y + h, height)
+    if xmax <= xmin or ymax <= ymin:
+        raise ValueError(f"roi {roi.tolist()} lies outside the {width}x{height} frame")
+    return xmin, ymin, xmax, ymax
+
+def crop_to_roi(frame, roi, rect):
+    xmin, ymin, xmax, ymax = rect
+    crop = frame[ymin:ymax, xmin:xmax]
+    
+    # pixels inside the rect but outside the polygon are blanked, same as the old full-frame mask
+    mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+    cv2.fillPoly(mask, [roi - (xmin, ymin)], 255)
+    return cv2.bitwise_and(crop, crop, mask=mask)
+
+def with_settings(model, settings):
+    # AutoShape reads conf/iou/max_det off the module, a shallow copy shares the weights but
+    # carries its own thresholds, so runners never change the shared model or wait on each other
+    configured = copy.copy(model)
+    configured.conf = settings.conf
+    configured.iou = settings.iou
+    configured.max_det = settings.max_det
+    return configured
+
+class RoiResults:
+    # model results on ROI crops with boxes shifted back into full-frame pixels
+    def __init__(self, results, frames, rect):
+        self.results = results
+        self.frames = frames
+        self.rect = rect
+        self.names = results.names
+        
+        offset = np.array([rect[0], rect[1], rect[0], rect[1], 0, 0], dtype=np.float64)
+        self.xyxy = [to_numpy(results, i) + offset for i in range(len(frames))]
+    
+    def tolist(self):
+        return [RoiResults(results, [frame], self.rect) for results, frame in zip(self.results.tolist(), self.frames)]
+    
+    def render(self):
+        xmin, ymin, xmax, ymax = self.rect
+        rendered = []
+        for frame, crop in zip(self.frames, self.results.render()):
+            full = frame.copy()
+            full[ymin:ymax, xmin:xmax] = crop
+            rendered.append(full)
+        return rendered
+
+class ModelRunner:
+    def __init__(self, model, settings=None, timer=NULL_TIMER):
+        self.settings = settings or InferenceSettings()
+        self.model = with_settings(model, self.settings)
+        self.timer = timer
+    
+    def __call__(self, frames, roi=None):
+        # frames is one image or a list of same-sized images, like the hub model takes
+        batch = frames if isinstance(frames, list) else [frames]
+        roi = roi if roi is not None else self.settings.roi
+        
+        rect = roi_rect(roi, batch[0].shape) if roi is not None else None
+        inputs = [crop_to_roi(frame, roi, rect) for frame in batch] if rect else batch
+        
+        with self.timer.stage("inference"):
+            results = self.model(inputs if isinstance(frames, list) else inputs[0], size=self.settings.size)
+        
+        return RoiResults(results, batch, rect) if rect else results
\ No newline at end of file
@@ -0,0 +1,208 @@
+import uuid
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+class QueueFullError(Exception):
+    pass
+
+class DetectionJob:
+    def __init__(self, video_id, violation_type, file_dir, video_input_path, options=None):
+        self.id = uuid.uuid4().hex
+        self.video_id = video_id
+        self.violation_type = violation_type
+        self.file_dir = file_dir
+        self.video_input_path = video_input_path
+        self.options = options or {}
+        
+        self.state = JOB_QUEUED
+        self.processed_frames = 0
+        self.total_frames = 0
+        self.output_file_path = None
+        self.error = None
+        self.pipeline_stats = None
+        self.summary = None
+        
+        # result cache entry this run fills when it finishes, and whether it was served from one
+        self.cache_key = None
+        self.cached = False
+        
+        # set by stop() to end a stream, or a file run early, after the frames already queued
+        self.stop_event = threading.Event()
+        
+        self.created_at = datetime.now().strftime('%Y%m%d%H%M%S')
+        self.started_at = None
+        self.finished_at = None
+    
+    @property
+    def progress(self):
+        if self.state == JOB_DONE:
+            return 100.0
+        if not self.total_frames:
+            return 0.0
+        return round(min(self.processed_frames / self.total_frames, 1.0) * 100, 2)
+    
+    def update_progress(self, processed_frames, total_frames):
+        self.processed_frames = processed_frames
+        self.total_frames = total_frames
+    
+    def update_pipeline_stats(self, pipeline_stats):
+        self.pipeline_stats = pipeline_stats
+    
+    def update_summary(self, summary):
+        self.summary = summary
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'id': self.video_id,
+            'violation_type': self.violation_type,
+            'options': self.options,
+            'state': self.state,
+            'progress': self.progress,
+            'processed_frames': self.processed_frames,
+            'total_frames': self.total_frames,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'pipeline': self.pipeline_stats,
+            'counters': self.summary['counters'] if self.summary else None,
+            'stopped': self.stop_event.is_set(),
+            'cached': self.cached,
+            'error': self.error
+        }
+
+class JobManager:
+    def __init__(self, run_detection, max_workers=2, max_queue_size=8, max_history=500, result_cache=None):
+        self.run_detection = run_detection
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.max_history = max_history
+        self.result_cache = result_cache
+        
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="detection")
+        
+        # cache hits only copy files, they get their own threads instead of waiting behind detection
+        self.replay_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="replay")
+        
+        # running + waiting jobs are bounded so a burst of submits can't pile up forever
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+        
+        self.jobs = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+    
+    def submit(self, video_id, violation_type, file_dir, video_input_path, options=None):
+        with self.lock:
+            job_id = self.in_flight.get((video_id, violation_type))
+            if job_id:
+                return self.jobs[job_id], False
+        
+        # the same video, models and settings already ran: replay the stored result instead of detecting
+        cache_key = self.result_cache.key(video_id, video_input_path, violation_type, options or {}) if self.result_cache else None
+        cached = cache_key is not None and self.result_cache.contains(cache_key)
+        
+        with self.lock:
+            job_id = self.in_flight.get((video_id, violation_type))
+            if job_id:
+                return self.jobs[job_id], False
+            
+            # a replay takes no detection slot, it only needs one if it has to fall back to detecting
+            if not cached and not self.slots.acquire(blocking=False):
+                raise QueueFullError("Detection queue is full")
+            
+            self.prune_history()
+            
+            job = DetectionJob(video_id, violation_type, file_dir, video_input_path, options)
+            job.cache_key = cache_key
+            job.cached = cached
+            self.jobs[job.id] = job
+            self.in_flight[(video_id, violation_type)] = job.id
+        
+        if cached:
+            logger.info(f"Job {job.id} replaying the cached result for video {video_id} ({violation_type})")
+            self.replay_executor.submit(self.replay, job)
+        else:
+            logger.info(f"Job {job.id} queued for video {video_id} ({violation_type})")
+            self.executor.submit(self.run, job)
+        return job, True
+    
+    def replay(self, job):
+        job.state = JOB_RUNNING
+        job.started_at = datetime.now().strftime('%Y%m%d%H%M%S')
+        
+        try:
+            result = self.result_cache.replay(job.cache_key, job.video_id, job.violation_type, job.file_dir)
+        except Exception:
+            logger.exception(f"Result cache replay failed for video {job.video_id}")
+            result = None
+        
+        if result is None:
+            # evicted or invalidated since submit, or its files went missing: detect after all
+            job.cached = False
+            if self.slots.acquire(blocking=False):
+                job.state = JOB_QUEUED
+                logger.info(f"Job {job.id} queued for video {job.video_id} ({job.violation_type}), cached result unavailable")
+                self.executor.submit(self.run, job)
+                return
+            job.error = "Cached result unavailable and the detection queue is full"
+            job.state = JOB_FAILED
+        else:
+            job.output_file_path, summary, pipeline_stats = result
+            job.update_summary(summary)
+            job.update_pipeline_stats(pipeline_stats)
+            job.state = JOB_DONE
+            logger.info(f"Job {job.id} served from the result cache for video {job.video_id} ({job.violation_type})")
+        
+        job.finished_at = datetime.now().strftime('%Y%m%d%H%M%S')
+        with self.lock:
+            self.in_flight.pop((job.video_id, job.violation_type), None)
+    
+    def run(self, job):
+        job.state = JOB_RUNNING
+        job.started_at = datetime.now().strftime('%Y%m%d%H%M%S')
+        
+        try:
+            job.output_file_path = self.run_detection(job.file_dir, job.video_input_path, job.violation_type, progress_callback=job.update_progress, stats_callback=job.update_pipeline_stats, summary_callback=job.update_summary, stop_event=job.stop_event, **job.options)
+            job.state = JOB_DONE
+            logger.info(f"Job {job.id} done: {job.output_file_path}")
+            
+            # a stopped run only covers part of the video
+            if job.cache_key and job.summary is not None and not job.stop_event.is_set():
+                try:
+                    self.result_cache.store(job.cache_key, job.file_dir, job.output_file_path, job.summary, job.pipeline_stats)
+                except Exception:
+                    logger.exception(f"Job {job.id} result not cached")
+        except Exception as e:
+            job.error = str(e)
+            job.state = JOB_FAILED
+            logger.exception(f"Job {job.id} failed")
+        finally:
+            job.finished_at = datetime.now().strftime('%Y%m%d%H%M%S')
+            with self.lock:
+                self.in_flight.pop((job.video_id, job.violation_type), None)
+            self.slots.release()
+    
+    def prune_history(self):
+        # jobs dict keeps insertion order, so the oldest finished jobs go first
+        finished = [job_id for job_id, job in self.jobs.items() if job.state in (JOB_DONE, JOB_FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self.jobs[job_id]
+    
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+    
+    def shutdown(self, wait=True):
+        self.replay_executor.shutdown(wait=wait)
+        self.executor.shutdown(wait=wait)
\ No newline at end of file
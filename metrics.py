@@ -0,0 +1,160 @@
+import bisect
+import threading
+
+# seconds, from sub-millisecond rule checks up to a slow batched inference
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+    
+    def drain(self):
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+    
+    def merge(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{format_labels(list(zip(self.labelnames, key)))} {format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        
+        # label values -> [per-bucket counts (last one is +Inf), sum, count], made cumulative on render
+        self.series = {}
+        self.lock = threading.Lock()
+    
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+    
+    def drain(self):
+        with self.lock:
+            series, self.series = self.series, {}
+        return series
+    
+    def merge(self, series):
+        with self.lock:
+            for key, (counts, total, count) in series.items():
+                merged = self.series.get(key)
+                if merged is None:
+                    merged = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self.series.items())
+        for key, (counts, total, count) in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else format_value(float(bound))
+                lines.append(f"{self.name}_bucket{format_labels(labels + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+    
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+    
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+    
+    def histogram(self, name, help_text, labelnames=(), buckets=STAGE_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+    
+    def drain(self):
+        # what a worker process observed since the last drain, shipped to the parent and merged there
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.drain() for metric in metrics}
+    
+    def merge(self, snapshot):
+        for name, values in snapshot.items():
+            metric = self.metrics.get(name)
+            if metric is not None:
+                metric.merge(values)
+    
+    def render(self):
+        # Prometheus text exposition format 0.0.4
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram("detection_stage_seconds", "Time per call spent in each detection stage, nested stages excluded", ["violation_type", "stage"])
+frame_seconds = metrics.histogram("detection_frame_seconds", "Processing time per frame, inference to annotation", ["violation_type"])
+detection_counters = {
+    "frames": metrics.counter("detection_frames_total", "Frames processed", ["violation_type"]),
+    "detections": metrics.counter("detection_objects_total", "Boxes returned by the models, before the per-rule thresholds", ["violation_type"]),
+    "tracks": metrics.counter("detection_tracked_objects_total", "Tracked boxes returned by SORT, summed over frames", ["violation_type"]),
+    "violations": metrics.counter("detection_violations_total", "Violations captured", ["violation_type", "category"])
+}
+
+class DetectionMetrics:
+    # one per job, feeds the process-wide registry with the job's violation type as a label
+    def __init__(self, violation_type):
+        self.violation_type = violation_type
+    
+    def observe_stage(self, name, seconds):
+        if name == "frame":
+            frame_seconds.observe(seconds, violation_type=self.violation_type)
+        else:
+            stage_seconds.observe(seconds, violation_type=self.violation_type, stage=name)
+    
+    def count(self, name, value=1, **labels):
+        counter = detection_counters.get(name)
+        if counter is not None:
+            counter.inc(value, violation_type=self.violation_type, **labels)
\ No newline at end of file
@@ -1,7 +1,42 @@
-import torch
+import os
 import pathlib
+import hashlib
+import logging
+import threading
+import numpy as np
+from contextlib import nullcontext
+from exported_models import load_exported_model, BACKENDS, EXPORT_DIR
+
+logger = logging.getLogger(__name__)
+
+LINE_MODEL_PATH = "./model/line_test_best100.pt"
+CROSSWALK_MODEL_PATH = "./model/yolov5_crosswalk_best50.pt"
+HELMET_MODEL_PATH = "./model/helm_test_best50.pt"
+
+MODEL_PATHS = [LINE_MODEL_PATH, CROSSWALK_MODEL_PATH, HELMET_MODEL_PATH]
+
+# runtime the weights are served with, set from the app config and again in every spawned worker
+MODEL_BACKEND = {"backend": "pytorch", "int8": False, "export_dir": EXPORT_DIR}
+
+def configure_model_backend(backend="pytorch", int8=False, export_dir=EXPORT_DIR):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {backend}")
+    if int8 and backend != "onnx":
+        raise ValueError("INT8 quantization is only available for the onnx backend")
+    
+    if (backend, int8, export_dir) != (MODEL_BACKEND["backend"], MODEL_BACKEND["int8"], MODEL_BACKEND["export_dir"]):
+        MODEL_BACKEND.update(backend=backend, int8=int8, export_dir=export_dir)
+        
+        # models already loaded belong to the previous backend
+        model_registry.evict()
 
 def load_model(path):
+    if MODEL_BACKEND["backend"] != "pytorch":
+        return load_exported_model(path, MODEL_BACKEND["backend"], MODEL_BACKEND["int8"], MODEL_BACKEND["export_dir"])
+    
+    # imported here so stub-model benchmarks run without torch installed
+    import torch
+    
     pathlib.PosixPath = pathlib.WindowsPath
     
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -10,4 +45,117 @@ def load_model(path):
     
     print(f"Model is running on: {device}")
     
-    return model
\ No newline at end of file
+    return model
+
+def file_hash(path, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class ModelRegistry:
+    def __init__(self, loader=load_model):
+        self.loader = loader
+        
+        # (abs path, file hash) -> loaded model
+        self.models = {}
+        
+        # abs path -> (mtime, size, file hash), avoids re-hashing unchanged weights
+        self.hashes = {}
+        
+        # abs path -> model object served instead of the weights on disk (stub models for benchmarks)
+        self.overrides = {}
+        
+        self.lock = threading.Lock()
+    
+    def key(self, path):
+        abs_path = os.path.abspath(path)
+        stat = os.stat(abs_path)
+        
+        cached = self.hashes.get(abs_path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return abs_path, cached[2]
+        
+        digest = file_hash(abs_path)
+        self.hashes[abs_path] = (stat.st_mtime, stat.st_size, digest)
+        return abs_path, digest
+    
+    def get(self, path):
+        with self.lock:
+            override = self.overrides.get(os.path.abspath(path))
+            if override is not None:
+                return override
+            
+            key = self.key(path)
+            model = self.models.get(key)
+            if model is None:
+                # weights changed on disk, drop the stale entry for this path
+                self.drop_path(key[0])
+                logger.info(f"Loading model {key[0]} ({key[1][:12]})")
+                model = self.loader(path)
+                self.models[key] = model
+            return model
+    
+    def fingerprint(self, path):
+        # what the result cache keys on: the weights hash, or the identity of an override
+        with self.lock:
+            override = self.overrides.get(os.path.abspath(path))
+            if override is not None:
+                return f"override:{id(override):x}"
+            return self.key(path)[1]
+    
+    def reload(self, path):
+        with self.lock:
+            abs_path = os.path.abspath(path)
+            self.drop_path(abs_path)
+            self.hashes.pop(abs_path, None)
+        return self.get(path)
+    
+    def evict(self, path=None):
+        with self.lock:
+            if path is None:
+                self.models.clear()
+                self.hashes.clear()
+                return
+            abs_path = os.path.abspath(path)
+            self.drop_path(abs_path)
+            self.hashes.pop(abs_path, None)
+    
+    def override(self, path, model):
+        with self.lock:
+            if model is None:
+                self.overrides.pop(os.path.abspath(path), None)
+            else:
+                self.overrides[os.path.abspath(path)] = model
+    
+    def drop_path(self, abs_path):
+        for key in [key for key in self.models if key[0] == abs_path]:
+            logger.info(f"Evicting model {key[0]} ({key[1][:12]})")
+            del self.models[key]
+    
+    def warmup(self, paths=MODEL_PATHS, frame_size=(1280, 720)):
+        # exported models run without torch installed
+        try:
+            import torch
+            no_grad = torch.no_grad
+        except ImportError:
+            no_grad = nullcontext
+        
+        width, height = frame_size
+        dummy_frame = np.zeros((height, width, 3), dtype=np.uint8)
+        
+        for path in paths:
+            model = self.get(path)
+            with no_grad():
+                model(dummy_frame)
+            logger.info(f"Model {path} warmed up")
+    
+    def loaded(self):
+        with self.lock:
+            return [{"path": key[0], "hash": key[1]} for key in self.models]
+
+model_registry = ModelRegistry()
+
+def get_model(path):
+    return model_registry.get(path)
\ No newline at end of file
@@ -0,0 +1,209 @@
+import cv2
+import time
+import queue
+import logging
+import threading
+from timing import NULL_TIMER
+
+logger = logging.getLogger(__name__)
+
+END_OF_STREAM = object()
+
+# what decode does when processing falls behind: wait (files), or drop frames to stay live (streams)
+DROP_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+class FramePipeline:
+    def __init__(self, capture, writer, frame_size=(1280, 720), batch_size=1, queue_size=8, on_frame_written=None, drop_policy="block", cancel_event=None, timer=NULL_TIMER):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {', '.join(DROP_POLICIES)}")
+        
+        self.capture = capture
+        self.writer = writer
+        self.frame_size = frame_size
+        self.batch_size = batch_size
+        self.on_frame_written = on_frame_written
+        self.drop_policy = drop_policy
+        
+        # set from outside to end the run cleanly, queued frames are still processed and written
+        self.cancel_event = cancel_event or threading.Event()
+        
+        # decode -> process holds batches, process -> encode holds single frames
+        self.decode_queue = queue.Queue(maxsize=queue_size)
+        self.encode_queue = queue.Queue(maxsize=queue_size * batch_size)
+        
+        self.stop_event = threading.Event()
+        self.errors = []
+        self.frames_written = 0
+        self.frames_dropped = 0
+        
+        # decode and encode times also go to the run's stage timer, process is timed per frame by the caller
+        self.timer = timer
+        self.busy_seconds = {"decode": 0.0, "process": 0.0, "encode": 0.0}
+        self.depth_stats = {name: {"sum": 0, "samples": 0, "max": 0} for name in ("decode", "encode")}
+        self.stats_lock = threading.Lock()
+    
+    def put(self, q, item):
+        # bounded put that gives up once another stage has failed
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def get(self, q):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return END_OF_STREAM
+    
+    def offer(self, frames):
+        if self.drop_policy == "block":
+            return self.put(self.decode_queue, frames)
+        
+        try:
+            self.decode_queue.put_nowait(frames)
+            return True
+        except queue.Full:
+            pass
+        
+        if self.drop_policy == "drop_newest":
+            dropped = frames
+        else:
+            # decode is the only producer, so the slot freed here is still free for the put below
+            try:
+                dropped = self.decode_queue.get_nowait()
+            except queue.Empty:
+                dropped = []
+            self.decode_queue.put_nowait(frames)
+        
+        with self.stats_lock:
+            self.frames_dropped += len(dropped)
+        return True
+    
+    def fail(self, error):
+        logger.exception(f"Pipeline stage failed: {error}")
+        self.errors.append(error)
+        self.stop_event.set()
+    
+    def record(self, stage, busy_seconds):
+        with self.stats_lock:
+            self.busy_seconds[stage] += busy_seconds
+        if stage != "process":
+            self.timer.record(stage, busy_seconds)
+    
+    def sample_depths(self):
+        with self.stats_lock:
+            for name, depth in self.queue_depths().items():
+                stats = self.depth_stats[name]
+                stats["sum"] += depth
+                stats["samples"] += 1
+                stats["max"] = max(stats["max"], depth)
+    
+    def decode(self):
+        try:
+            end_of_stream = False
+            while not end_of_stream and not self.stop_event.is_set() and not self.cancel_event.is_set():
+                start = time.perf_counter()
+                frames = []
+                while len(frames) < self.batch_size:
+                    ret, frame = self.capture.read()
+                    
+                    if not ret:
+                        if getattr(self.capture, "exhausted", False):
+                            logger.debug("End of frame range")
+                        else:
+                            logger.error("Failed to open frame")
+                        end_of_stream = True
+                        break
+                    
+                    # uploads normalized at upload time are already the right size
+                    if (frame.shape[1], frame.shape[0]) != self.frame_size:
+                        frame = cv2.resize(frame, self.frame_size)
+                    frames.append(frame)
+                self.record("decode", time.perf_counter() - start)
+                
+                if frames and not self.offer(frames):
+                    break
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.put(self.decode_queue, END_OF_STREAM)
+    
+    def encode(self):
+        try:
+            while True:
+                frame = self.get(self.encode_queue)
+                if frame is END_OF_STREAM:
+                    break
+                
+                if self.writer is not None:
+                    start = time.perf_counter()
+                    self.writer.write(frame)
+                    self.record("encode", time.perf_counter() - start)
+                self.frames_written += 1
+                
+                if self.on_frame_written:
+                    self.on_frame_written(self.frames_written)
+        except Exception as e:
+            self.fail(e)
+    
+    def run(self, process_batch):
+        decode_thread = threading.Thread(target=self.decode, name="pipeline-decode", daemon=True)
+        encode_thread = threading.Thread(target=self.encode, name="pipeline-encode", daemon=True)
+        decode_thread.start()
+        encode_thread.start()
+        
+        try:
+            while True:
+                frames = self.get(self.decode_queue)
+                if frames is END_OF_STREAM:
+                    break
+                
+                # a full decode queue means processing is the bottleneck, a full encode queue means encoding is
+                self.sample_depths()
+                
+                # process_batch may be a generator, so leave out the time spent blocked on the encode queue
+                start = time.perf_counter()
+                blocked = 0.0
+                for processed_frame in process_batch(frames):
+                    put_start = time.perf_counter()
+                    if not self.put(self.encode_queue, processed_frame):
+                        break
+                    blocked += time.perf_counter() - put_start
+                self.record("process", time.perf_counter() - start - blocked)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.put(self.encode_queue, END_OF_STREAM)
+            decode_thread.join()
+            encode_thread.join()
+        
+        if self.errors:
+            raise self.errors[0]
+        
+        return self.frames_written
+    
+    def queue_depths(self):
+        return {
+            "decode": self.decode_queue.qsize(),
+            "encode": self.encode_queue.qsize()
+        }
+    
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "frames_dropped": self.frames_dropped,
+                "busy_seconds": {stage: round(seconds, 3) for stage, seconds in self.busy_seconds.items()},
+                "queues": {
+                    name: {
+                        "depth": self.queue_depths()[name],
+                        "avg_depth": round(stats["sum"] / stats["samples"], 2) if stats["samples"] else 0,
+                        "max_depth": stats["max"]
+                    }
+                    for name, stats in self.depth_stats.items()
+                }
+            }
\ No newline at end of file
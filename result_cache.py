@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from model import model_registry, file_hash, MODEL_PATHS, MODEL_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# bumped whenever what a run produces changes shape, older entries then simply stop matching
+CACHE_FORMAT = 1
+
+# runs that are about something other than their result
+UNCACHED_OPTIONS = ("profile", "stream")
+
+def json_default(value):
+    # numpy scalars in summaries and stats
+    return value.item() if hasattr(value, "item") else str(value)
+
+def tree_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+class ResultCache:
+    # finished detection runs keyed by video content, violation type, model weights and settings,
+    # stored as copies (reruns overwrite the upload's files in place) and evicted least recently used
+    def __init__(self, cache_dir, max_bytes, index=None, settings=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index = index
+        
+        # app-wide settings that change results but aren't job options (jpeg quality, inference config)
+        self.settings = settings or {}
+        
+        # key -> {"video_hash", "violation_type", "size", "last_used"}, oldest use first
+        self.entries = {}
+        
+        # video path -> (mtime, size, hash) for uploads indexed without a video hash
+        self.video_hashes = {}
+        
+        # key -> replays copying out of the entry right now, eviction leaves those alone
+        self.pinned = {}
+        
+        # invalidated keys still pinned, the last replay out of each removes its directory
+        self.doomed = set()
+        self.lock = threading.Lock()
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load()
+    
+    def path(self, key):
+        return os.path.join(self.cache_dir, key)
+    
+    def load(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = self.path(name)
+            if name.startswith("."):
+                # a store that didn't finish
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            try:
+                with open(os.path.join(entry_dir, "entry.json")) as f:
+                    entry = json.load(f)
+                last_used = os.path.getmtime(os.path.join(entry_dir, "entry.json"))
+            except (OSError, ValueError):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            entries.append((last_used, name, {"video_hash": entry["video_hash"], "violation_type": entry["violation_type"], "size": tree_size(entry_dir), "last_used": last_used}))
+        
+        for _, name, entry in sorted(entries):
+            self.entries[name] = entry
+        logger.info(f"Result cache {self.cache_dir}: {len(self.entries)} entries, {self.total_bytes() / 1e6:.1f} MB")
+    
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.entries.values())
+    
+    def video_hash(self, video_id, video_input_path):
+        upload = self.index.get_upload(video_id) if self.index else None
+        if upload and upload.get("video_hash"):
+            return upload["video_hash"]
+        
+        stat = os.stat(video_input_path)
+        cached = self.video_hashes.get(video_input_path)
+        if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        digest = file_hash(video_input_path)
+        self.video_hashes[video_input_path] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+    
+    def key(self, video_id, video_input_path, violation_type, options):
+        # None when the run shouldn't be cached or its inputs can't be fingerprinted
+        if any(options.get(name) for name in UNCACHED_OPTIONS):
+            return None
+        try:
+            config = {
+                "format": CACHE_FORMAT,
+                "violation_type": violation_type,
+                "video": self.video_hash(video_id, video_input_path),
+                "models": {os.path.basename(path): model_registry.fingerprint(path) for path in MODEL_PATHS},
+                "model_backend": MODEL_BACKEND,
+                "settings": self.settings,
+                "options": options
+            }
+        except OSError as e:
+            logger.warning(f"Result cache skipped for {video_id}: {e}")
+            return None
+        digest = hashlib.sha256(json.dumps(config, sort_keys=True, default=json_default).encode()).hexdigest()
+        return {"key": digest, "video_hash": config["video"], "violation_type": violation_type}
+    
+    def contains(self, cache_key):
+        with self.lock:
+            return cache_key["key"] in self.entries
+    
+    def replay(self, cache_key, video_id, violation_type, file_dir):
+        # copies a stored run into the video's folder and index, returns (output path, summary, stats) or None
+        with self.lock:
+            if cache_key["key"] not in self.entries:
+                return None
+            entry_dir = self.path(cache_key["key"])
+            with open(os.path.join(entry_dir, "entry.json")) as f:
+                entry = json.load(f)
+            
+            # use order lives in the entry's mtime, so it survives restarts
+            os.utime(os.path.join(entry_dir, "entry.json"))
+            self.entries[cache_key["key"]] = {**self.entries.pop(cache_key["key"]), "last_used": time.time()}
+            self.pinned[cache_key["key"]] = self.pinned.get(cache_key["key"], 0) + 1
+        
+        # the copies run without the lock, other lookups and stores go on meanwhile
+        try:
+            events = []
+            for event in entry["summary"]["events"]:
+                file_path = None
+                if event["file_path"]:
+                    file_path = os.path.join(file_dir, event["file_path"])
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    shutil.copyfile(os.path.join(entry_dir, "evidence", event["file_path"]), file_path)
+                events.append({**event, "file_path": file_path})
+            
+            output_file_path = None
+            if entry["output"]:
+                result_dir = os.path.join(file_dir, "results")
+                os.makedirs(result_dir, exist_ok=True)
+                output_file_path = os.path.join(result_dir, f"{video_id}_{violation_type}_result.mp4")
+                shutil.copyfile(os.path.join(entry_dir, entry["output"]), output_file_path)
+        finally:
+            with self.lock:
+                self.pinned[cache_key["key"]] -= 1
+                if not self.pinned[cache_key["key"]]:
+                    del self.pinned[cache_key["key"]]
+                    if cache_key["key"] in self.doomed:
+                        self.doomed.discard(cache_key["key"])
+                        shutil.rmtree(entry_dir, ignore_errors=True)
+        
+        summary = {**entry["summary"], "events": events}
+        if self.index:
+            self.index.clear_violations(video_id, list(summary["counters"]))
+            for event in events:
+                self.index.add_violation(
+                    video_id, event["category"], event["file_path"] or "",
+                    filename=f"{event['frame_index']:06d}_{event['track_id']}.jpg",
+                    track_id=event["track_id"],
+                    frame_index=event["frame_index"],
+                    video_time=event["video_time"],
+                    bbox=event["bbox"],
+                    traffic_light=event["traffic_light"]
+                )
+            if output_file_path:
+                self.index.add_result(video_id, violation_type, output_file_path)
+        
+        logger.info(f"Result cache hit {cache_key['key'][:12]} for {video_id} ({violation_type})")
+        return output_file_path, summary, {**entry["pipeline_stats"], "cached": True}
+    
+    def store(self, cache_key, file_dir, output_file_path, summary, pipeline_stats):
+        # built under a hidden name and renamed into place, so a crash never leaves half an entry
+        partial_dir = os.path.join(self.cache_dir, f".{cache_key['key']}.{uuid.uuid4().hex}")
+        os.makedirs(os.path.join(partial_dir, "evidence"))
+        
+        events = []
+        for event in summary["events"]:
+            relative_path = None
+            if event["file_path"] and os.path.exists(event["file_path"]):
+                relative_path = os.path.relpath(event["file_path"], file_dir)
+                target = os.path.join(partial_dir, "evidence", relative_path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(event["file_path"], target)
+            events.append({**event, "file_path": relative_path})
+        
+        output = None
+        if output_file_path:
+            output = "result.mp4"
+            shutil.copyfile(output_file_path, os.path.join(partial_dir, output))
+        
+        entry = {
+            **cache_key,
+            "created_at": time.strftime('%Y%m%d%H%M%S'),
+            "output": output,
+            "summary": {**summary, "events": events},
+            "pipeline_stats": {name: value for name, value in (pipeline_stats or {}).items() if name != "profile"}
+        }
+        with open(os.path.join(partial_dir, "entry.json"), "w") as f:
+            json.dump(entry, f, default=json_default)
+        
+        with self.lock:
+            if cache_key["key"] in self.pinned:
+                # a replay is still copying out of the old entry, this run simply isn't cached
+                shutil.rmtree(partial_dir, ignore_errors=True)
+                logger.info(f"Result cache store {cache_key['key'][:12]} skipped, entry in use")
+                return
+            entry_dir = self.path(cache_key["key"])
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(partial_dir, entry_dir)
+            self.entries.pop(cache_key["key"], None)
+            self.entries[cache_key["key"]] = {"video_hash": cache_key["video_hash"], "violation_type": cache_key["violation_type"], "size": tree_size(entry_dir), "last_used": time.time()}
+            self.evict()
+        logger.info(f"Result cache stored {cache_key['key'][:12]} ({cache_key['violation_type']}), {self.total_bytes() / 1e6:.1f} MB in use")
+    
+    def evict(self):
+        # least recently used first, until the cache fits its budget again
+        total = self.total_bytes()
+        for key in list(self.entries):
+            if total <= self.max_bytes:
+                break
+            if key in self.pinned:
+                # being replayed, it goes on a later store if it's still the oldest
+                continue
+            total -= self.entries.pop(key)["size"]
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            logger.info(f"Result cache evicted {key[:12]}")
+    
+    def invalidate(self, video_hash=None, violation_type=None):
+        with self.lock:
+            keys = [
+                key for key, entry in self.entries.items()
+                if (video_hash is None or entry["video_hash"] == video_hash) and (violation_type is None or entry["violation_type"] == violation_type)
+            ]
+            for key in keys:
+                del self.entries[key]
+                if key in self.pinned:
+                    # replays read entry.json before pinning, without it a restart drops the directory
+                    self.doomed.add(key)
+                    try:
+                        os.remove(os.path.join(self.path(key), "entry.json"))
+                    except FileNotFoundError:
+                        pass
+                    continue
+                shutil.rmtree(self.path(key), ignore_errors=True)
+        logger.info(f"Result cache invalidated {len(keys)} entries")
+        return len(keys)
+    
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.total_bytes(), "max_bytes": self.max_bytes}
\ No newline at end of file
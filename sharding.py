@@ -0,0 +1,407 @@
+import os
+import cv2
+import queue
+import shutil
+import logging
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from calibration import CalibrationCache
+from faststart import make_faststart
+from worker_pool import configure_threads
+
+logger = logging.getLogger(__name__)
+
+# frames a shard decodes before the part it owns, long enough for SORT to confirm the tracks it inherits
+DEFAULT_OVERLAP_SECONDS = 2.0
+
+# mean IoU over the shared frames for two tracks on either side of a boundary to be the same object
+STITCH_MIN_IOU = 0.5
+
+# how often (in frames) a shard reports progress back to the parent
+SHARD_PROGRESS_INTERVAL = 15
+
+def plan_shards(total_frames, shards, overlap):
+    # each shard owns [start, end) and decodes from read_start, the overlap only warms up its tracker
+    length = -(-total_frames // max(shards, 1))
+    return [
+        {"index": i, "read_start": max(0, start - overlap), "start": start, "end": min(start + length, total_frames)}
+        for i, start in enumerate(range(0, total_frames, length))
+    ]
+
+class ForwardingCalibration(CalibrationCache):
+    # the first shard's calibration cache, hands the areas to the parent as soon as they are known
+    def __init__(self, cache_dir, messages, max_entries=None):
+        super().__init__(cache_dir, max_entries=max_entries)
+        self.messages = messages
+    
+    def lookup(self, fingerprint, camera_id=None):
+        entry = super().lookup(fingerprint, camera_id)
+        if entry:
+            self.messages.put(("calibration", entry))
+        return entry
+    
+    def store(self, fingerprint, areas, camera_id=None):
+        entry = super().store(fingerprint, areas, camera_id)
+        self.messages.put(("calibration", entry))
+        return entry
+
+class PresetCalibration:
+    # what later shards get instead of a cache: the first shard's areas, applied from their first frame
+    def __init__(self, entry):
+        self.entry = entry
+    
+    def fingerprint(self, frame):
+        return np.zeros(1, dtype=np.float32)
+    
+    def lookup(self, fingerprint, camera_id=None):
+        return self.entry
+    
+    def store(self, fingerprint, areas, camera_id=None):
+        return self.entry
+
+def run_shard(task):
+    from detect import start_detection
+    
+    # every shard gets an equal slice of the cores, so the pool doesn't oversubscribe the machine
+    configure_threads(task["threads"])
+    messages = task["messages"]
+    
+    if task["calibration"]:
+        calibration_cache = PresetCalibration(task["calibration"])
+    elif task["calibration_dir"]:
+        calibration_cache = ForwardingCalibration(task["calibration_dir"], messages, task["calibration_max_entries"])
+    else:
+        calibration_cache = None
+    
+    # tracks seen in the frames shared with the neighbouring shards, for stitching ids afterwards
+    tracks = {}
+    def on_tracks(tracker, frame_index, tracker_results):
+        frame = task["read_start"] + frame_index
+        if any(low <= frame < high for low, high in task["windows"]):
+            tracks.setdefault(tracker, {})[frame] = np.asarray(tracker_results)[:, :5].tolist()
+    
+    def on_progress(processed_frames, total_frames):
+        if processed_frames % SHARD_PROGRESS_INTERVAL == 0 or processed_frames == total_frames:
+            messages.put(("progress", task["index"], processed_frames))
+    
+    result = {"index": task["index"], "tracks": tracks}
+    output_file_path = start_detection(
+        task["file_dir"], task["video_input_path"], task["violation_type"],
+        progress_callback=on_progress,
+        stats_callback=lambda stats: result.__setitem__("stats", stats),
+        summary_callback=lambda summary: result.__setitem__("summary", summary),
+        calibration_cache=calibration_cache, camera_id=task["camera_id"], stop_event=task["stop_event"],
+        frame_range=(task["read_start"], task["end"]), track_callback=on_tracks, **task["options"]
+    )
+    result["output_file_path"] = output_file_path
+    messages.put(("progress", task["index"], task["end"] - task["read_start"]))
+    return result
+
+def iou_matrix(a, b):
+    xmin = np.maximum(a[:, None, 0], b[None, :, 0])
+    ymin = np.maximum(a[:, None, 1], b[None, :, 1])
+    xmax = np.minimum(a[:, None, 2], b[None, :, 2])
+    ymax = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(xmax - xmin, 0, None) * np.clip(ymax - ymin, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+def stitch_tracks(previous, current, min_iou=STITCH_MIN_IOU):
+    # previous/current: {frame: [[xmin, ymin, xmax, ymax, id], ...]} over the frames both shards decoded,
+    # returns {current id: previous id}, greedy on mean IoU over the frames the current track was seen
+    iou_sums = {}
+    frames_seen = {}
+    for frame, boxes in current.items():
+        for box in boxes:
+            frames_seen[int(box[4])] = frames_seen.get(int(box[4]), 0) + 1
+        
+        previous_boxes = previous.get(frame)
+        if not previous_boxes or not boxes:
+            continue
+        a = np.array(previous_boxes, dtype=np.float64)
+        b = np.array(boxes, dtype=np.float64)
+        ious = iou_matrix(a, b)
+        for i, j in zip(*np.nonzero(ious)):
+            key = (int(a[i, 4]), int(b[j, 4]))
+            iou_sums[key] = iou_sums.get(key, 0.0) + ious[i, j]
+    
+    scores = sorted(((total / frames_seen[key[1]], key) for key, total in iou_sums.items()), reverse=True)
+    matches = {}
+    used = set()
+    for score, (previous_id, current_id) in scores:
+        if score < min_iou:
+            break
+        if current_id in matches or previous_id in used:
+            continue
+        matches[current_id] = previous_id
+        used.add(previous_id)
+    return matches
+
+def tracker_for(category):
+    return "helmet" if category == "helmet" else "line"
+
+def merge_events(shards, results, fps):
+    # global track ids: stitched tracks keep the id from the shard before, everything else gets a new one
+    ids = [{} for _ in shards]
+    next_id = {}
+    
+    def global_id(shard_index, tracker, local_id):
+        mapping = ids[shard_index].setdefault(tracker, {})
+        if local_id not in mapping:
+            next_id[tracker] = next_id.get(tracker, 0) + 1
+            mapping[local_id] = next_id[tracker]
+        return mapping[local_id]
+    
+    for shard, result in zip(shards[1:], results[1:]):
+        previous = results[shard["index"] - 1]
+        for tracker, current_tracks in result["tracks"].items():
+            matches = stitch_tracks(previous["tracks"].get(tracker, {}), current_tracks)
+            for current_id, previous_id in matches.items():
+                ids[shard["index"]].setdefault(tracker, {})[current_id] = global_id(shard["index"] - 1, tracker, previous_id)
+            logger.info(f"Shard {shard['index']}: {len(matches)} {tracker} tracks stitched to shard {shard['index'] - 1}")
+    
+    events = []
+    captured = set()
+    for shard, result in zip(shards, results):
+        for event in sorted(result["summary"]["events"], key=lambda event: event["frame_index"]):
+            frame_index = shard["read_start"] + event["frame_index"]
+            
+            # the overlap before a shard's own range belongs to the shard before it
+            if not shard["start"] <= frame_index < shard["end"]:
+                continue
+            
+            track_id = global_id(shard["index"], tracker_for(event["category"]), event["track_id"])
+            if (event["category"], track_id) in captured:
+                continue
+            captured.add((event["category"], track_id))
+            
+            events.append({
+                **event,
+                "track_id": track_id,
+                "frame_index": frame_index,
+                "video_time": round(frame_index / fps, 3) if fps else None,
+                "shard_file_path": event["file_path"]
+            })
+    return events
+
+def move_evidence(events, shard_dirs, file_dir):
+    # keep the crops of merged events under the video's own folders, named by global frame and track
+    for event in events:
+        source = event.pop("shard_file_path")
+        if not source:
+            continue
+        shard_dir = next(path for path in shard_dirs if os.path.commonpath([os.path.abspath(path), os.path.abspath(source)]) == os.path.abspath(path))
+        target_dir = os.path.join(file_dir, os.path.relpath(os.path.dirname(source), shard_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        
+        target = os.path.join(target_dir, f"{event['frame_index']:06d}_{event['track_id']}.jpg")
+        os.replace(source, target)
+        event["file_path"] = target
+
+def concatenate_outputs(shards, results, output_file_path, fps, frame_size=(1280, 720)):
+    out = cv2.VideoWriter(output_file_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, frame_size)
+    written = 0
+    try:
+        for shard, result in zip(shards, results):
+            capture = cv2.VideoCapture(result["output_file_path"])
+            
+            # the warm-up frames were already written by the shard before
+            for _ in range(shard["start"] - shard["read_start"]):
+                capture.grab()
+            for _ in range(shard["end"] - shard["start"]):
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                out.write(frame)
+                written += 1
+            capture.release()
+    finally:
+        out.release()
+    
+    make_faststart(output_file_path)
+    return written
+
+def merge_stats(results):
+    stages = {}
+    for result in results:
+        for name, stage in result.get("stats", {}).get("stages", {}).items():
+            merged = stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            merged["seconds"] = round(merged["seconds"] + stage["seconds"], 6)
+            merged["calls"] += stage["calls"]
+    return {
+        "shards": len(results),
+        "frames_dropped": sum(result.get("stats", {}).get("frames_dropped", 0) for result in results),
+        "busy_seconds": {
+            stage: round(sum(result.get("stats", {}).get("busy_seconds", {}).get(stage, 0.0) for result in results), 3)
+            for stage in ("decode", "process", "encode")
+        },
+        "stages": stages
+    }
+
+def start_sharded_detection(file_dir, video_input_path, violation_type, shards, workers=None, overlap_seconds=DEFAULT_OVERLAP_SECONDS, progress_callback=None, stats_callback=None, summary_callback=None, index=None, calibration_cache=None, camera_id=None, stop_event=None, initializer=None, initargs=(), executor=None, threads=None, **options):
+    capture = cv2.VideoCapture(video_input_path)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    
+    plan = plan_shards(total_frames, shards, int(round(overlap_seconds * fps)))
+    video_id = os.path.basename(file_dir)
+    
+    work_dir = os.path.join(file_dir, "shards")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    shard_dirs = [os.path.join(work_dir, str(shard["index"])) for shard in plan]
+    
+    if executor is None:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(plan)))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        logger.info(f"Sharding {video_input_path} into {len(plan)} segments on {workers} processes, {threads} threads each")
+    else:
+        # a process pool's workers already split the cores between them, the shards queue on those
+        logger.info(f"Sharding {video_input_path} into {len(plan)} segments on the detection worker pool, {threads} threads each")
+    
+    # spawned, not forked: the parent may hold loaded models and running threads
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    messages = manager.Queue()
+    cancel_event = manager.Event()
+    
+    def task(shard, calibration=None, forward=False):
+        windows = []
+        if shard["index"] > 0:
+            windows.append((shard["read_start"], shard["start"]))
+        if shard["index"] + 1 < len(plan):
+            windows.append((plan[shard["index"] + 1]["read_start"], shard["end"]))
+        return {
+            "index": shard["index"],
+            "file_dir": shard_dirs[shard["index"]],
+            "video_input_path": video_input_path,
+            "violation_type": violation_type,
+            "read_start": shard["read_start"],
+            "end": shard["end"],
+            "windows": windows,
+            "threads": threads,
+            "camera_id": camera_id,
+            "calibration": calibration,
+            "calibration_dir": (calibration_cache.cache_dir if calibration_cache else os.path.join(work_dir, "calibration")) if forward else None,
+            "calibration_max_entries": calibration_cache.max_entries if calibration_cache else None,
+            "messages": messages,
+            "stop_event": cancel_event,
+            "options": options
+        }
+    
+    progress = {}
+    futures = {}
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer, initargs=initargs)
+    try:
+        # the first shard calibrates the crosswalk, the rest start once its areas are known
+        if violation_type in ("line", "all") and len(plan) > 1:
+            futures[0] = executor.submit(run_shard, task(plan[0], forward=True))
+            pending = plan[1:]
+        else:
+            futures = {shard["index"]: executor.submit(run_shard, task(shard)) for shard in plan}
+            pending = []
+        
+        while not all(future.done() for future in futures.values()) or pending:
+            if stop_event is not None and stop_event.is_set() and not cancel_event.is_set():
+                # running shards stop at their next frame, the ones not started yet are dropped
+                # instead of each spawning a process and loading models only to exit
+                cancel_event.set()
+                for future in futures.values():
+                    future.cancel()
+                if pending:
+                    logger.info(f"Sharded run stopped, {len(pending)} shards not started")
+                    pending = []
+            
+            try:
+                kind, *payload = messages.get(timeout=0.2)
+            except queue.Empty:
+                kind, payload = None, None
+            
+            if kind == "progress":
+                progress[payload[0]] = payload[1]
+                if progress_callback:
+                    progress_callback(sum(progress.values()), sum(shard["end"] - shard["read_start"] for shard in plan))
+            elif kind == "calibration" and pending:
+                logger.info(f"Calibration from shard 0 ready, starting {len(pending)} more shards")
+                futures.update({shard["index"]: executor.submit(run_shard, task(shard, calibration=payload[0])) for shard in pending})
+                pending = []
+            
+            if pending and futures[0].done():
+                # no calibration in the first segment, every later shard calibrates on its own
+                logger.warning("Shard 0 finished without a crosswalk calibration, later shards calibrate on their own")
+                futures.update({shard["index"]: executor.submit(run_shard, task(shard)) for shard in pending})
+                pending = []
+        
+        # a stopped run keeps the leading shards that ran, the later ones were never started
+        ran = []
+        for shard in plan:
+            future = futures.get(shard["index"])
+            if future is None or future.cancelled():
+                break
+            ran.append(shard)
+        results = [futures[shard["index"]].result() for shard in ran]
+    except BaseException:
+        # a shared pool outlives this run, so shards it hasn't finished are stopped or dropped here
+        cancel_event.set()
+        for future in futures.values():
+            future.cancel()
+        raise
+    finally:
+        if own_executor:
+            executor.shutdown()
+        manager.shutdown()
+    
+    if not results:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return None
+    
+    events = merge_events(ran, results, fps)
+    move_evidence(events, shard_dirs, file_dir)
+    
+    counters = {}
+    for result in results:
+        counters.update({category: 0 for category in result["summary"]["counters"]})
+    for event in events:
+        counters[event["category"]] += 1
+    
+    summary = {**results[-1]["summary"], "counters": counters, "events": events}
+    if "areas" in results[0]["summary"]:
+        summary["areas"] = results[0]["summary"]["areas"]
+    
+    output_file_path = None
+    if all(result["output_file_path"] for result in results):
+        result_dir = os.path.join(file_dir, "results")
+        os.makedirs(result_dir, exist_ok=True)
+        output_file_path = os.path.join(result_dir, f"{video_id}_{violation_type}_result.mp4")
+        concatenate_outputs(ran, results, output_file_path, fps)
+    
+    if index:
+        index.clear_violations(video_id, list(counters))
+        for event in events:
+            index.add_violation(
+                video_id, event["category"], event["file_path"] or "",
+                filename=f"{event['frame_index']:06d}_{event['track_id']}.jpg",
+                track_id=event["track_id"],
+                frame_index=event["frame_index"],
+                video_time=event["video_time"],
+                bbox=event["bbox"],
+                traffic_light=event["traffic_light"]
+            )
+        if output_file_path:
+            index.add_result(video_id, violation_type, output_file_path)
+    
+    shutil.rmtree(work_dir, ignore_errors=True)
+    
+    stats = merge_stats(results)
+    logger.info(f"Sharded run merged: {len(events)} events, {stats}")
+    if stats_callback:
+        stats_callback(stats)
+    if summary_callback:
+        summary_callback(summary)
+    
+    return output_file_path
\ No newline at end of file
@@ -0,0 +1,63 @@
+import cv2
+import time
+import queue
+import logging
+import threading
+from timing import NULL_TIMER
+
+logger = logging.getLogger(__name__)
+
+class SnapshotWriter:
+    def __init__(self, workers=2, queue_size=32, jpeg_quality=95, timer=NULL_TIMER):
+        self.jpeg_quality = jpeg_quality
+        self.timer = timer
+        
+        # bounded so a burst of violations slows detection down instead of piling up crops
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.errors = []
+        self.written = 0
+        self.lock = threading.Lock()
+        
+        self.workers = [threading.Thread(target=self.work, name=f"snapshot-{i}", daemon=True) for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+    
+    def submit(self, frame, crop_box, image_output_path):
+        # copy only the padded crop, the caller keeps drawing on the full frame
+        xmin, ymin, xmax, ymax = crop_box
+        cropped_frame = frame[ymin:ymax, xmin:xmax].copy()
+        self.queue.put((cropped_frame, image_output_path))
+    
+    def work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                
+                cropped_frame, image_output_path = item
+                start = time.perf_counter()
+                if not cv2.imwrite(image_output_path, cropped_frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]):
+                    raise IOError(f"Failed to write {image_output_path}")
+                self.timer.record("snapshot_write", time.perf_counter() - start)
+                
+                with self.lock:
+                    self.written += 1
+            except Exception as e:
+                logger.exception(f"Snapshot write failed: {e}")
+                with self.lock:
+                    self.errors.append(e)
+            finally:
+                self.queue.task_done()
+    
+    def flush(self):
+        self.queue.join()
+    
+    def close(self):
+        self.flush()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        
+        logger.info(f"Snapshot writer closed, {self.written} written, {len(self.errors)} failed")
\ No newline at end of file
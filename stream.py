@@ -0,0 +1,182 @@
+import os
+import cv2
+import glob
+import time
+import logging
+import threading
+from faststart import make_faststart
+
+logger = logging.getLogger(__name__)
+
+# live sources often report 0 or a nonsense rate (RTSP clocks), fall back to this for output segments
+DEFAULT_STREAM_FPS = 15
+
+def parse_source(source):
+    # "0", "1", ... are local capture devices, anything else is a file path or stream URL
+    source = str(source).strip()
+    return int(source) if source.isdigit() else source
+
+class StreamCapture:
+    def __init__(self, source, loop=False, reconnect_attempts=5, reconnect_delay=2.0, cancel_event=None):
+        self.source = parse_source(source)
+        self.loop = loop
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+        self.cancel_event = cancel_event or threading.Event()
+        self.reconnects = 0
+        
+        self.capture = cv2.VideoCapture(self.source)
+        if not self.capture.isOpened():
+            raise IOError(f"Could not open stream source {source}")
+        
+        # a local file standing in for a camera is read at its own frame rate, like a live feed
+        self.local_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1.0 / fps if self.local_file and fps > 0 else 0.0
+        self.next_frame_at = time.monotonic()
+        self.frames_read = 0
+    
+    def get(self, prop):
+        return self.capture.get(prop)
+    
+    def read(self):
+        if self.frame_interval:
+            delay = self.next_frame_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_frame_at = max(self.next_frame_at, time.monotonic() - self.frame_interval) + self.frame_interval
+        
+        ret, frame = self.capture.read()
+        if ret:
+            self.frames_read += 1
+            return ret, frame
+        
+        if self.loop:
+            # local stand-in for a camera: rewind the file and keep going
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read()
+            if ret:
+                self.frames_read += 1
+                return ret, frame
+        
+        if self.local_file:
+            # a file that isn't looped simply ends, only network and device sources drop and come back
+            logger.info(f"Stream {self.source} ended after {self.frames_read} frames")
+            return False, None
+        
+        for attempt in range(1, self.reconnect_attempts + 1):
+            if self.cancel_event.wait(self.reconnect_delay * attempt):
+                break
+            
+            logger.warning(f"Stream {self.source} dropped, reconnecting ({attempt}/{self.reconnect_attempts})")
+            self.capture.release()
+            self.capture = cv2.VideoCapture(self.source)
+            ret, frame = self.capture.read()
+            if ret:
+                self.reconnects += 1
+                self.frames_read += 1
+                return ret, frame
+        
+        return False, None
+    
+    def release(self):
+        self.capture.release()
+
+class FrameRangeCapture:
+    # frames [start, end) of a video file, what one shard of a sharded run decodes
+    def __init__(self, path, start, end):
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError(f"Could not open video {path}")
+        
+        self.start = start
+        self.end = end
+        self.position = 0
+        
+        if start:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+            position = int(self.capture.get(cv2.CAP_PROP_POS_FRAMES))
+            if position != start:
+                # seeking landed on another frame (sparse keyframes), decode forward from the top instead
+                logger.warning(f"Seek to frame {start} of {path} landed on {position}, skipping frames instead")
+                self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                for _ in range(start):
+                    if not self.capture.grab():
+                        break
+    
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.end - self.start
+        return self.capture.get(prop)
+    
+    @property
+    def exhausted(self):
+        # every frame of the range was read, a failed read after that is the normal end
+        return self.position >= self.end - self.start
+    
+    def read(self):
+        if self.exhausted:
+            return False, None
+        ret, frame = self.capture.read()
+        if ret:
+            self.position += 1
+        return ret, frame
+    
+    def release(self):
+        self.capture.release()
+
+class SegmentWriter:
+    def __init__(self, output_dir, prefix, fps, frame_size=(1280, 720), segment_seconds=300, max_segments=12, on_segment=None):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.fps = fps if 0 < fps <= 120 else DEFAULT_STREAM_FPS
+        self.frame_size = frame_size
+        self.segment_frames = max(1, int(segment_seconds * self.fps))
+        self.max_segments = max_segments
+        self.on_segment = on_segment
+        
+        self.writer = None
+        self.path = None
+        self.frames = 0
+        self.index = 0
+        
+        os.makedirs(self.output_dir, exist_ok=True)
+    
+    def write(self, frame):
+        if self.writer is None or self.frames >= self.segment_frames:
+            self.rotate()
+        self.writer.write(frame)
+        self.frames += 1
+    
+    def rotate(self):
+        self.close_segment()
+        
+        self.path = os.path.join(self.output_dir, f"{self.prefix}_{self.index:06d}.mp4")
+        self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, self.frame_size)
+        self.frames = 0
+        self.index += 1
+    
+    def close_segment(self):
+        if self.writer is None:
+            return
+        
+        self.writer.release()
+        self.writer = None
+        make_faststart(self.path)
+        logger.info(f"Stream segment closed: {self.path}")
+        
+        if self.on_segment:
+            self.on_segment(self.path)
+        self.prune()
+    
+    def prune(self):
+        # keep disk use bounded, oldest segments go first
+        if not self.max_segments:
+            return
+        segments = sorted(glob.glob(os.path.join(self.output_dir, f"{glob.escape(self.prefix)}_*.mp4")))
+        for path in segments[:max(0, len(segments) - self.max_segments)]:
+            os.remove(path)
+            logger.info(f"Stream segment removed: {path}")
+    
+    def release(self):
+        self.close_segment()
\ No newline at end of file
@@ -0,0 +1,75 @@
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+# per-frame work inside the processing thread, decode and encode are timed by the pipeline
+STAGES = ("inference", "parse", "track", "rules", "draw", "capture")
+
+class StageTimer:
+    # one per run, stage() is used from the processing thread only, record() from any thread
+    def __init__(self, metrics=None):
+        self.totals = {}
+        self.counts = {}
+        
+        # frames, detections, tracks, violations
+        self.counters = {}
+        
+        # optional metrics.DetectionMetrics, every stage and count is forwarded to it
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        
+        # time spent in nested stages, so every stage reports only its own work
+        self.child_seconds = []
+    
+    @contextmanager
+    def stage(self, name):
+        self.child_seconds.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            own = elapsed - self.child_seconds.pop()
+            self.add(name, own)
+            if self.child_seconds:
+                self.child_seconds[-1] += elapsed
+    
+    def record(self, name, seconds):
+        # stages timed elsewhere: decode, encode and snapshot writes on their own threads, whole frames
+        with self.lock:
+            self.add(name, seconds)
+    
+    def add(self, name, seconds):
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if self.metrics:
+            self.metrics.observe_stage(name, seconds)
+    
+    def count(self, name, value=1, **labels):
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.metrics:
+            self.metrics.count(name, value, **labels)
+    
+    def summary(self):
+        return {
+            name: {"seconds": round(self.totals[name], 6), "calls": self.counts[name]}
+            for name in self.totals
+        }
+
+class NullTimer:
+    # stand-in when nobody is measuring, shares a single do-nothing context
+    context = nullcontext()
+    
+    def stage(self, name):
+        return self.context
+    
+    def record(self, name, seconds):
+        pass
+    
+    def count(self, name, value=1, **labels):
+        pass
+    
+    def summary(self):
+        return {}
+
+NULL_TIMER = NullTimer()
\ No newline at end of file
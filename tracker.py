@@ -0,0 +1,187 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# SORT's constant velocity box model, the state is [x, y, area, aspect ratio, vx, vy, varea]:
+# observation noise is higher on area and ratio, unobserved velocities start very uncertain
+OBSERVATION_NOISE = np.diag([1.0, 1.0, 10.0, 10.0])
+PROCESS_NOISE = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+INITIAL_COVARIANCE = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])
+
+# per-track arrays, row i of each belongs to the same track and rows stay in creation order
+TRACK_FIELDS = ("state", "covariance", "ids", "hit_streak", "time_since_update")
+
+def boxes_to_observations(boxes):
+    # (n, 4) xyxy -> (n, 4) centre x, centre y, area, aspect ratio
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    return np.column_stack((boxes[:, 0] + w / 2.0, boxes[:, 1] + h / 2.0, w * h, w / h))
+
+def states_to_boxes(state):
+    # a negative area times ratio gives nan boxes, the caller drops those tracks
+    with np.errstate(invalid="ignore"):
+        w = np.sqrt(state[:, 2] * state[:, 3])
+        h = state[:, 2] / w
+    return np.column_stack((state[:, 0] - w / 2.0, state[:, 1] - h / 2.0, state[:, 0] + w / 2.0, state[:, 1] + h / 2.0))
+
+def iou_matrix(boxes, others):
+    # (len(boxes), len(others)) intersection over union, degenerate boxes overlap nothing
+    xx1 = np.maximum(boxes[:, None, 0], others[None, :, 0])
+    yy1 = np.maximum(boxes[:, None, 1], others[None, :, 1])
+    xx2 = np.minimum(boxes[:, None, 2], others[None, :, 2])
+    yy2 = np.minimum(boxes[:, None, 3], others[None, :, 3])
+    intersection = np.maximum(0.0, xx2 - xx1) * np.maximum(0.0, yy2 - yy1)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    other_areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        iou = intersection / (areas[:, None] + other_areas[None, :] - intersection)
+    return np.nan_to_num(iou, nan=0.0, posinf=0.0, neginf=0.0)
+
+def associate(detections, predictions, iou_threshold):
+    # (matches as (detection, track) rows, unmatched detections) in the order SORT creates tracks from them
+    if len(predictions) == 0 or len(detections) == 0:
+        return np.empty((0, 2), dtype=np.int64), np.arange(len(detections))
+    
+    iou = iou_matrix(detections, predictions)
+    overlaps = iou > iou_threshold
+    if overlaps.sum(axis=1).max() == 1 and overlaps.sum(axis=0).max() == 1:
+        # every overlap is one to one, the usual case between consecutive frames, no solver needed
+        rows, cols = np.nonzero(overlaps)
+    else:
+        rows, cols = linear_sum_assignment(-iou)
+    
+    good = iou[rows, cols] >= iou_threshold
+    assigned = np.zeros(len(detections), dtype=bool)
+    assigned[rows] = True
+    unmatched = np.concatenate((np.flatnonzero(~assigned), rows[~good]))
+    return np.column_stack((rows[good], cols[good])), unmatched
+
+class Tracker:
+    # drop-in for sort.Sort: update(dets) takes (n, 5) xyxy + score rows once per frame and returns
+    # (m, 5) xyxy + track id rows, newest track first. Tracks live in structure-of-arrays storage, so
+    # Kalman predict/update run once per frame for all tracks instead of once per track
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, capacity=64):
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        self.frame_count = 0
+        
+        # ids start at 1 and are never reused within a tracker
+        self.next_id = 1
+        
+        # rows [0, count) of the arrays hold live tracks, the rest is spare capacity
+        self.count = 0
+        self.state = np.zeros((capacity, 7))
+        self.covariance = np.zeros((capacity, 7, 7))
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.hit_streak = np.zeros(capacity, dtype=np.int64)
+        self.time_since_update = np.zeros(capacity, dtype=np.int64)
+        
+        # ids of tracks dropped since the last pop_ended()
+        self.ended = []
+    
+    def __len__(self):
+        return self.count
+    
+    def active_ids(self):
+        return self.ids[:self.count].tolist()
+    
+    def pop_ended(self):
+        # ids that will never be reported again, so per-track state kept for them can go
+        ended, self.ended = self.ended, []
+        return ended
+    
+    def reserve(self, count):
+        capacity = len(self.ids)
+        if count <= capacity:
+            return
+        while capacity < count:
+            capacity *= 2
+        for name in TRACK_FIELDS:
+            array = getattr(self, name)
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self.count] = array[:self.count]
+            setattr(self, name, grown)
+    
+    def keep(self, mask):
+        # compacts the live rows to those in mask, in their existing order
+        if mask.all():
+            return
+        self.ended.extend(self.ids[:self.count][~mask].tolist())
+        kept = int(mask.sum())
+        for name in TRACK_FIELDS:
+            array = getattr(self, name)
+            array[:kept] = array[:self.count][mask]
+        self.count = kept
+    
+    def add(self, boxes):
+        start, end = self.count, self.count + len(boxes)
+        self.reserve(end)
+        self.state[start:end] = 0.0
+        self.state[start:end, :4] = boxes_to_observations(boxes)
+        self.covariance[start:end] = INITIAL_COVARIANCE
+        self.ids[start:end] = np.arange(self.next_id, self.next_id + len(boxes))
+        self.hit_streak[start:end] = 0
+        self.time_since_update[start:end] = 0
+        self.next_id += len(boxes)
+        self.count = end
+    
+    def predict(self):
+        x = self.state[:self.count]
+        P = self.covariance[:self.count]
+        
+        # area velocity is stopped before it would take the area below zero
+        x[x[:, 6] + x[:, 2] <= 0, 6] = 0.0
+        
+        # F adds each velocity to its position, written out so it costs a few adds instead of 7x7 products
+        x[:, :3] += x[:, 4:]
+        P[:, :3, :] += P[:, 4:, :]
+        P[:, :, :3] += P[:, :, 4:]
+        P += PROCESS_NOISE
+        
+        self.hit_streak[:self.count][self.time_since_update[:self.count] > 0] = 0
+        self.time_since_update[:self.count] += 1
+    
+    def correct(self, rows, boxes):
+        # Kalman update of the given tracks, H observes the first four state entries
+        x = self.state[rows]
+        P = self.covariance[rows]
+        
+        residual = boxes_to_observations(boxes) - x[:, :4]
+        PHT = P[:, :, :4]
+        S = P[:, :4, :4] + OBSERVATION_NOISE
+        K = PHT @ np.linalg.inv(S)
+        x += (K @ residual[:, :, None])[:, :, 0]
+        
+        # Joseph form, as filterpy computes it
+        I_KH = np.broadcast_to(np.eye(7), P.shape).copy()
+        I_KH[:, :, :4] -= K
+        P = I_KH @ P @ I_KH.transpose(0, 2, 1) + (K * np.diag(OBSERVATION_NOISE)) @ K.transpose(0, 2, 1)
+        
+        self.state[rows] = x
+        self.covariance[rows] = P
+        self.hit_streak[rows] += 1
+        self.time_since_update[rows] = 0
+    
+    def update(self, dets=np.empty((0, 5))):
+        self.frame_count += 1
+        dets = np.asarray(dets, dtype=np.float64).reshape(-1, 5)
+        
+        self.predict()
+        predictions = states_to_boxes(self.state[:self.count])
+        valid = ~np.isnan(predictions).any(axis=1)
+        self.keep(valid)
+        predictions = predictions[valid]
+        
+        matches, unmatched = associate(dets[:, :4], predictions, self.iou_threshold)
+        if len(matches):
+            self.correct(matches[:, 1], dets[matches[:, 0], :4])
+        if len(unmatched):
+            self.add(dets[unmatched, :4])
+        
+        live = slice(0, self.count)
+        reported = (self.time_since_update[live] < 1) & ((self.hit_streak[live] >= self.min_hits) | (self.frame_count <= self.min_hits))
+        rows = np.flatnonzero(reported)[::-1]
+        results = np.column_stack((states_to_boxes(self.state[rows]), self.ids[rows].astype(np.float64)))
+        
+        self.keep(self.time_since_update[live] <= self.max_age)
+        return results
\ No newline at end of file
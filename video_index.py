@@ -0,0 +1,248 @@
+import os
+import json
+import sqlite3
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger(__name__)
+
+VIOLATION_CATEGORIES = ['helmet', 'traffic_line', 'wrong_way']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    video_path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    created_at TEXT,
+    fps REAL,
+    frame_count INTEGER,
+    width INTEGER,
+    height INTEGER,
+    duration REAL,
+    content_hash TEXT,
+    video_hash TEXT,
+    is_stream INTEGER
+);
+CREATE INDEX IF NOT EXISTS uploads_content ON uploads (content_hash);
+CREATE TABLE IF NOT EXISTS results (
+    id TEXT NOT NULL,
+    violation_type TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    PRIMARY KEY (id, violation_type)
+);
+CREATE TABLE IF NOT EXISTS violations (
+    id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    track_id INTEGER,
+    frame_index INTEGER,
+    video_time REAL,
+    bbox TEXT,
+    traffic_light TEXT,
+    PRIMARY KEY (id, category, filename)
+);
+CREATE INDEX IF NOT EXISTS violations_time ON violations (id, video_time);
+CREATE TABLE IF NOT EXISTS manifest_versions (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+# upload columns for dedupe and the result cache, NULL for uploads indexed before them
+UPLOAD_HASH_COLUMNS = {
+    'content_hash': 'TEXT',
+    'video_hash': 'TEXT'
+}
+
+# live sources registered like uploads, NULL for rows indexed before streams were marked
+UPLOAD_SOURCE_COLUMNS = {
+    'is_stream': 'INTEGER'
+}
+
+# manifest columns added after the first release, backfilled as NULL on older index files
+VIOLATION_RECORD_COLUMNS = {
+    'track_id': 'INTEGER',
+    'frame_index': 'INTEGER',
+    'video_time': 'REAL',
+    'bbox': 'TEXT',
+    'traffic_light': 'TEXT'
+}
+
+class VideoIndex:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        
+        # one connection shared by request and detection threads, serialized by the lock
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.migrate()
+            self.conn.executescript(SCHEMA)
+    
+    def migrate(self):
+        for table, added_columns in (('uploads', UPLOAD_HASH_COLUMNS), ('uploads', UPLOAD_SOURCE_COLUMNS), ('violations', VIOLATION_RECORD_COLUMNS)):
+            columns = {row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if not columns:
+                continue
+            for column, column_type in added_columns.items():
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    
+    def add_upload(self, id, dir, video_path, created_at=None, metadata=None, content_hash=None, video_hash=None, is_stream=False):
+        # content_hash: sha256 of the bytes as uploaded, video_hash: of the file detection reads,
+        # video_path of a stream is its source URL or device
+        metadata = metadata or {}
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO uploads (id, dir, video_path, filename, created_at, fps, frame_count, width, height, duration, content_hash, video_hash, is_stream) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (id, dir, video_path, os.path.basename(video_path), created_at,
+                 metadata.get('fps'), metadata.get('frame_count'), metadata.get('width'), metadata.get('height'), metadata.get('duration'),
+                 content_hash, video_hash, int(is_stream))
+            )
+    
+    def get_upload(self, id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM uploads WHERE id = ?", (id,)).fetchone()
+        return dict(row) if row else None
+    
+    def find_uploads_by_content(self, content_hash):
+        # newest first, the caller skips any whose file is gone
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM uploads WHERE content_hash = ? ORDER BY created_at DESC", (content_hash,)).fetchall()
+        return [dict(row) for row in rows]
+    
+    def add_result(self, id, violation_type, output_path):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO results (id, violation_type, output_path) VALUES (?, ?, ?)", (id, violation_type, output_path))
+    
+    def get_results(self, id):
+        with self.lock:
+            rows = self.conn.execute("SELECT violation_type, output_path FROM results WHERE id = ?", (id,)).fetchall()
+        return {row['violation_type']: row['output_path'] for row in rows}
+    
+    def bump_version(self, id):
+        self.conn.execute(
+            "INSERT INTO manifest_versions (id, version) VALUES (?, 1) "
+            "ON CONFLICT(id) DO UPDATE SET version = version + 1",
+            (id,)
+        )
+    
+    def add_violation(self, id, category, file_path, track_id=None, frame_index=None, video_time=None, bbox=None, traffic_light=None, filename=None):
+        # file_path is empty when the run skipped evidence crops, filename still keys the record
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO violations (id, category, filename, file_path, track_id, frame_index, video_time, bbox, traffic_light) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (id, category, filename or os.path.basename(file_path), file_path, track_id, frame_index, video_time,
+                 json.dumps([int(v) for v in bbox]) if bbox is not None else None, traffic_light)
+            )
+            self.bump_version(id)
+    
+    def clear_violations(self, id, categories):
+        # a new detection run replaces the records of the categories it produces
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM violations WHERE id = ? AND category IN ({', '.join('?' * len(categories))})", (id, *categories))
+            self.bump_version(id)
+    
+    def query_violations(self, id, categories=None, start_time=None, end_time=None, limit=None, offset=0):
+        where = "id = ?"
+        params = [id]
+        if categories:
+            where += f" AND category IN ({', '.join('?' * len(categories))})"
+            params += categories
+        if start_time is not None:
+            where += " AND video_time >= ?"
+            params.append(start_time)
+        if end_time is not None:
+            where += " AND video_time <= ?"
+            params.append(end_time)
+        
+        with self.lock:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM violations WHERE {where}", params).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT * FROM violations WHERE {where} ORDER BY frame_index IS NULL, frame_index, category, filename LIMIT ? OFFSET ?",
+                params + [limit if limit is not None else -1, offset]
+            ).fetchall()
+        
+        records = []
+        for row in rows:
+            record = dict(row)
+            record['bbox'] = json.loads(record['bbox']) if record['bbox'] else None
+            records.append(record)
+        return records, total
+    
+    def manifest_version(self, id):
+        with self.lock:
+            row = self.conn.execute("SELECT version FROM manifest_versions WHERE id = ?", (id,)).fetchone()
+        return row['version'] if row else 0
+    
+    def rebuild(self, upload_folder, probe=None):
+        # walk an existing uploads tree once and (re)index every upload found in it
+        uploads = 0
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM uploads")
+            self.conn.execute("DELETE FROM results")
+            self.conn.execute("DELETE FROM violations")
+            self.conn.execute("UPDATE manifest_versions SET version = version + 1")
+        
+        for uid in sorted(os.listdir(upload_folder)):
+            upload_dir = os.path.join(upload_folder, uid)
+            if not os.path.isdir(upload_dir):
+                continue
+            
+            videos = [file for file in os.listdir(upload_dir) if file.endswith('.mp4') and file.split('_')[0] == uid]
+            if not videos:
+                continue
+            
+            video_path = os.path.join(upload_dir, videos[0])
+            created_at = os.path.splitext(videos[0])[0].rsplit('_', 1)[-1]
+            self.add_upload(uid, upload_dir, video_path, created_at, probe(video_path) if probe else None)
+            uploads += 1
+            
+            result_dir = os.path.join(upload_dir, 'results')
+            if os.path.isdir(result_dir):
+                for file in os.listdir(result_dir):
+                    if file.startswith(f"{uid}_") and file.endswith('_result.mp4'):
+                        violation_type = file[len(uid) + 1:-len('_result.mp4')]
+                        self.add_result(uid, violation_type, os.path.join(result_dir, file))
+            
+            for category in VIOLATION_CATEGORIES:
+                category_dir = os.path.join(upload_dir, 'traffic_violation', category)
+                if os.path.isdir(category_dir):
+                    for file in os.listdir(category_dir):
+                        if file.endswith('.jpg'):
+                            self.add_violation(uid, category, os.path.join(category_dir, file))
+        
+        logger.info(f"Rebuilt index {self.db_path}: {uploads} uploads")
+        return uploads
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the uploads index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="rebuild the index from an existing uploads tree")
+    rebuild_parser.add_argument("--uploads", default="./uploads")
+    rebuild_parser.add_argument("--index", default="./uploads_index.sqlite3")
+    rebuild_parser.add_argument("--no-probe", action="store_true", help="skip probing video metadata")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    from file_utils import FileUtils
+    utils = FileUtils(args.uploads, args.index)
+    uploads = utils.index.rebuild(args.uploads, probe=None if args.no_probe else utils.probe_video)
+    print(f"Indexed {uploads} uploads from {args.uploads}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
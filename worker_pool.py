@@ -0,0 +1,231 @@
+import os
+import cv2
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from calibration import CalibrationCache
+from metrics import metrics
+from model import model_registry, MODEL_PATHS
+
+logger = logging.getLogger(__name__)
+
+# intra-op threads per worker when only the worker count is left open, a few small
+# torch pools beat one large one on throughput, benchmark.py workers measures the trade-off
+DEFAULT_WORKER_THREADS = 2
+
+# how often (in frames) a worker reports progress back to the parent
+WORKER_PROGRESS_INTERVAL = 15
+
+def available_cpus():
+    # cores this process may run on, fewer than the machine has under taskset or a cpuset
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def plan_workers(workers=None, threads=None, cpus=None):
+    # (workers, threads per worker) with workers * threads never above the cores available
+    cpus = cpus or available_cpus()
+    if workers and workers > cpus:
+        logger.warning(f"{workers} detection workers requested on {cpus} cores, using {cpus}")
+        workers = cpus
+    
+    if workers and threads and workers * threads > cpus:
+        logger.warning(f"{workers} workers x {threads} threads oversubscribes {cpus} cores, using {max(1, cpus // workers)} threads each")
+        threads = None
+    
+    if not workers:
+        threads = min(threads or DEFAULT_WORKER_THREADS, cpus)
+        workers = max(1, cpus // threads)
+    threads = threads or max(1, cpus // workers)
+    return workers, threads
+
+def core_slices(workers, threads):
+    # disjoint core sets for pinning, one per worker, in the order the cores are allowed
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    return [cores[i * threads:(i + 1) * threads] for i in range(workers)]
+
+def configure_threads(threads):
+    # OpenMP/MKL read these when torch is first imported, set_num_threads covers an already loaded torch
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(threads)
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except ImportError:
+        pass
+    except RuntimeError:
+        # inter-op threads can only be set before torch has run anything in this process
+        pass
+
+def init_worker(threads, cores, log_level, preload, warmup, initializer, initargs):
+    if log_level:
+        logging.basicConfig(level=log_level)
+    configure_threads(threads)
+    
+    if cores is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            core_set = cores.get_nowait()
+            os.sched_setaffinity(0, core_set)
+            logger.info(f"Detection worker {os.getpid()} pinned to cores {core_set}")
+        except queue.Empty:
+            # a replacement worker after a crash, the original slices are taken
+            pass
+    
+    if initializer:
+        initializer(*initargs)
+    
+    # every worker keeps its own models, loaded once before it takes a job
+    if warmup:
+        model_registry.warmup(preload)
+    else:
+        for path in preload:
+            model_registry.get(path)
+
+class IndexForwarder:
+    # stands in for the VideoIndex inside a worker, writes are applied by the parent in order
+    def __init__(self, messages):
+        self.messages = messages
+    
+    def add_result(self, *args, **kwargs):
+        self.messages.put(("index", "add_result", args, kwargs))
+    
+    def add_violation(self, *args, **kwargs):
+        self.messages.put(("index", "add_violation", args, kwargs))
+    
+    def clear_violations(self, *args, **kwargs):
+        self.messages.put(("index", "clear_violations", args, kwargs))
+
+def run_job(task):
+    from detect import start_detection
+    
+    messages = task["messages"]
+    
+    def on_progress(processed_frames, total_frames):
+        if processed_frames % WORKER_PROGRESS_INTERVAL == 0 or processed_frames == total_frames:
+            messages.put(("progress", processed_frames, total_frames))
+    
+    def on_stats(stats):
+        messages.put(("stats", stats, metrics.drain()))
+    
+    output_file_path = start_detection(
+        task["file_dir"], task["video_input_path"], task["violation_type"],
+        progress_callback=on_progress, stats_callback=on_stats,
+        summary_callback=lambda summary: messages.put(("summary", summary)),
+        index=IndexForwarder(messages) if task["index"] else None,
+        calibration_cache=CalibrationCache(task["calibration_dir"], max_entries=task["calibration_max_entries"]) if task["calibration_dir"] else None,
+        stop_event=task["stop_event"], **task["options"]
+    )
+    messages.put(("metrics", metrics.drain()))
+    return output_file_path
+
+class DetectionWorkerPool:
+    # detection jobs in spawned processes, each with preloaded models and a fixed share of the cores
+    def __init__(self, workers=None, threads=None, pin_cores=False, preload=MODEL_PATHS, warmup=True, initializer=None, initargs=()):
+        self.workers, self.threads = plan_workers(workers, threads)
+        self.pin_cores = pin_cores
+        self.preload = list(preload)
+        self.warmup = warmup
+        self.initializer = initializer
+        self.initargs = initargs
+        
+        # spawned, not forked: the parent holds running threads and possibly loaded models
+        self.context = multiprocessing.get_context("spawn")
+        self.manager = self.context.Manager()
+        self.lock = threading.Lock()
+        self.executor = self.create_executor()
+        
+        logger.info(f"Detection worker pool: {self.workers} processes x {self.threads} threads{', pinned' if pin_cores else ''}")
+    
+    def create_executor(self):
+        cores = None
+        if self.pin_cores:
+            cores = self.context.Queue()
+            for core_set in core_slices(self.workers, self.threads):
+                cores.put(core_set)
+        
+        initargs = (self.threads, cores, logging.getLogger().level, self.preload, self.warmup, self.initializer, self.initargs)
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context, initializer=init_worker, initargs=initargs)
+        
+        # start every worker now so models are loaded before the first job, not during it
+        for _ in range(self.workers):
+            executor.submit(os.getpid)
+        return executor
+    
+    def run_detection(self, file_dir, video_input_path, violation_type, progress_callback=None, stats_callback=None, summary_callback=None, stop_event=None, index=None, calibration_cache=None, **options):
+        # same call as start_detection, blocks the calling thread until a worker has run the job
+        with self.lock:
+            executor = self.executor
+        
+        if options.get("shards", 1) > 1:
+            # shards queue on this pool's workers rather than starting processes of their own,
+            # so a sharded job stays within the cores the pool was given
+            from detect import start_detection
+            try:
+                return start_detection(file_dir, video_input_path, violation_type, progress_callback=progress_callback, stats_callback=stats_callback, summary_callback=summary_callback, stop_event=stop_event, index=index, calibration_cache=calibration_cache, shard_executor=executor, shard_threads=self.threads, **options)
+            except BrokenProcessPool:
+                self.restart(executor)
+                raise
+        
+        messages = self.manager.Queue()
+        cancel_event = self.manager.Event()
+        task = {
+            "file_dir": file_dir,
+            "video_input_path": video_input_path,
+            "violation_type": violation_type,
+            "index": index is not None,
+            "calibration_dir": calibration_cache.cache_dir if calibration_cache else None,
+            "calibration_max_entries": calibration_cache.max_entries if calibration_cache else None,
+            "messages": messages,
+            "stop_event": cancel_event,
+            "options": options
+        }
+        
+        future = executor.submit(run_job, task)
+        
+        while True:
+            # everything a job sends is queued before its future completes, so drain until both are done
+            done = future.done()
+            if stop_event is not None and stop_event.is_set():
+                cancel_event.set()
+            try:
+                kind, *payload = messages.get(timeout=0.2)
+            except queue.Empty:
+                if done:
+                    break
+                continue
+            
+            if kind == "progress" and progress_callback:
+                progress_callback(*payload)
+            elif kind == "stats":
+                metrics.merge(payload[1])
+                if stats_callback:
+                    stats_callback(payload[0])
+            elif kind == "summary" and summary_callback:
+                summary_callback(payload[0])
+            elif kind == "metrics":
+                metrics.merge(payload[0])
+            elif kind == "index" and index is not None:
+                getattr(index, payload[0])(*payload[1], **payload[2])
+        
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # a worker died (killed, out of memory), later jobs get a fresh pool
+            self.restart(executor)
+            raise
+    
+    def restart(self, broken):
+        with self.lock:
+            if self.executor is broken:
+                logger.error("Detection worker died, restarting the worker pool")
+                self.executor = self.create_executor()
+        broken.shutdown(wait=False)
+    
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+        self.manager.shutdown()
\ No newline at end of file